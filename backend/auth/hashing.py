@@ -1,7 +1,25 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
 
-pwd_cxt = CryptContext(schemes=["bcrypt"], deprecated="auto")
+## bcrypt cost factor for new hashes (see `python manage.py calibrate-bcrypt`).
+## Existing hashes keep verifying with the cost stored in them.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+## Processes dedicated to hashing, and how many more requests may wait for one
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", str(HASH_WORKERS * 8)))
+
+## Seconds a client is told to wait when hashing is saturated
+HASH_RETRY_AFTER = 1
+
+
+pwd_cxt = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 class Hash:
     @staticmethod
@@ -11,3 +29,58 @@ class Hash:
     @staticmethod
     def verify(plain_password: str, hashed_password: str) -> bool:
         return pwd_cxt.verify(plain_password, hashed_password)
+
+
+## Process pool running bcrypt off the event loop, with a bound on queued work.
+## Once HASH_WORKERS + HASH_QUEUE_LIMIT calls are in flight, new ones get a 503 right away.
+class HashingPool:
+    def __init__(self, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn: forking a process that runs an event loop and threads is not safe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def _run(self, function, *args):
+        if self.in_flight >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is busy, please retry shortly",
+                headers={"Retry-After": str(HASH_RETRY_AFTER)},
+            )
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._get_executor(), function, *args)
+            except BrokenProcessPool:
+                # A worker died, start a fresh pool and retry once
+                self._executor = None
+                return await loop.run_in_executor(self._get_executor(), function, *args)
+        finally:
+            self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(Hash.bcrypt, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(Hash.verify, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+## Shared pool used by sign-up and login
+hashing_pool = HashingPool()
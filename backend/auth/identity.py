@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from fastapi import Depends, HTTPException, status
+import os
+import time
+
+from database import get_db, PooledConnection
+from metrics import cache_entries
+from timing import timed
+from .views import get_current_user
+from .services import fetch_identity, fetch_claims_version
+from .utils import claims_versions
+
+
+## Maximum number of cached identities, and how long one stays valid (seconds).
+## Writes on this process invalidate right away, the TTL bounds staleness across processes.
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "60"))
+
+
+## TTL + LRU cache of resolved identities, keyed by user id
+class IdentityCache:
+    def __init__(self, max_size: int = IDENTITY_CACHE_SIZE, ttl: float = IDENTITY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, user_id: int):
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+
+        expires_at, identity = entry
+        if expires_at < time.monotonic():
+            del self.entries[user_id]
+            return None
+
+        self.entries.move_to_end(user_id)
+        return identity
+
+    def put(self, user_id: int, identity: dict):
+        self.entries[user_id] = (time.monotonic() + self.ttl, identity)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self.entries.pop(user_id, None)
+
+
+identity_cache = IdentityCache()
+cache_entries.track(("identity",), lambda: len(identity_cache.entries))
+
+
+## Dependency: the caller's identity {id, email, claims_version, profile_id, worker_id, role, city},
+## profile and worker fields are None until the user creates them
+async def get_identity(
+    db: PooledConnection = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+):
+    with timed("auth"):
+        identity = identity_cache.get(current_user["id"])
+        if identity is None:
+            cursor = await db.cursor(dictionary=True)
+            identity = await fetch_identity(cursor, current_user["id"])
+            if identity is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+                )
+            identity_cache.put(current_user["id"], identity)
+            claims_versions.put(current_user["id"], identity["claims_version"])
+
+    # Handlers get their own copy, the cached one stays untouched
+    return dict(identity)
+
+
+## Dependency: the caller's identity {id, email, profile_id, worker_id, role} taken from the
+## token claims when their version is current (no query while the version is cached).
+## Tokens without claims or with stale claims are resolved from the database instead.
+async def get_token_identity(
+    db: PooledConnection = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+):
+    with timed("auth"):
+        if "claims_version" in current_user:
+            version = claims_versions.get(current_user["id"])
+            if version is None:
+                cursor = await db.cursor()
+                version = await fetch_claims_version(cursor, current_user["id"])
+                if version is not None:
+                    claims_versions.put(current_user["id"], version)
+
+            if version == current_user["claims_version"]:
+                return current_user
+
+    return await get_identity(db, current_user)
@@ -0,0 +1,29 @@
+## Helper function to resolve a user's identity (profile, worker, role, city) in one query
+async def fetch_identity(cursor, user_id: int):
+    await cursor.execute(
+        """
+        SELECT users.id, users.email, users.claims_version, profile.id AS profile_id,
+            worker.id AS worker_id, profile.role, profile.city
+        FROM users
+        LEFT JOIN profile ON profile.user_id = users.id
+        LEFT JOIN worker ON worker.profile_id = profile.id
+        WHERE users.id = %s
+        """,
+        (user_id,),
+    )
+    return await cursor.fetchone()
+
+
+## Helper function to get the current claims version of a user
+async def fetch_claims_version(cursor, user_id: int):
+    await cursor.execute("SELECT claims_version FROM users WHERE id = %s", (user_id,))
+    result = await cursor.fetchone()
+    return result[0] if result else None
+
+
+## Helper function to mark the identity claims of a user's tokens as stale
+## (call it in the transaction changing the profile, role or worker)
+async def bump_claims_version(cursor, user_id: int):
+    await cursor.execute(
+        "UPDATE users SET claims_version = claims_version + 1 WHERE id = %s", (user_id,)
+    )
@@ -1,13 +1,106 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException, Depends, status
 from jwt import ExpiredSignatureError, InvalidTokenError
+import hashlib
+import os
+import time
 import jwt
 
+from metrics import cache_entries
+
 
 SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 7200
 
+## Maximum number of verified tokens kept in memory (0 disables the cache)
+TOKEN_CACHE_SIZE = 10000
+
+
+## Bounded LRU cache of verified tokens, keyed by the token digest, entries expire at the token exp claim
+class VerifiedTokenCache:
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, digest: bytes):
+        entry = self.entries.get(digest)
+        if entry is None:
+            return None
+
+        expires_at, token_data = entry
+        if expires_at <= time.time():
+            del self.entries[digest]
+            return None
+
+        self.entries.move_to_end(digest)
+        return token_data
+
+    def put(self, digest: bytes, expires_at: float, token_data: dict):
+        if self.max_size <= 0:
+            return
+
+        self.entries[digest] = (expires_at, token_data)
+        self.entries.move_to_end(digest)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+token_cache = VerifiedTokenCache()
+cache_entries.track(("token",), lambda: len(token_cache.entries))
+
+
+## Seconds a user's claims version is trusted before it is read again from users.claims_version
+CLAIMS_VERSION_TTL = float(os.getenv("CLAIMS_VERSION_TTL", "30"))
+CLAIMS_VERSION_CACHE_SIZE = 100000
+
+
+## Bounded cache of users.claims_version, used to tell if the identity claims of a token are current
+class ClaimsVersionCache:
+    def __init__(self, max_size: int = CLAIMS_VERSION_CACHE_SIZE, ttl: float = CLAIMS_VERSION_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, user_id: int):
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+
+        expires_at, version = entry
+        if expires_at < time.monotonic():
+            del self.entries[user_id]
+            return None
+
+        self.entries.move_to_end(user_id)
+        return version
+
+    def put(self, user_id: int, version: int):
+        self.entries[user_id] = (time.monotonic() + self.ttl, version)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self.entries.pop(user_id, None)
+
+
+claims_versions = ClaimsVersionCache()
+cache_entries.track(("claims_version",), lambda: len(claims_versions.entries))
+
+
+## Function to build the token payload of a user, with its versioned identity claims
+def identity_claims(identity: dict):
+    return {
+        "sub": identity["email"],
+        "id": identity["id"],
+        "pid": identity["profile_id"],
+        "wid": identity["worker_id"],
+        "role": identity["role"],
+        "cv": identity["claims_version"],
+    }
+
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -21,6 +114,12 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 
 
 def verify_token(token: str, credentials_exception):
+    # A token verified before is returned without decoding it again, until its exp
+    digest = hashlib.sha256(token.encode()).digest()
+    token_data = token_cache.get(digest)
+    if token_data is not None:
+        return dict(token_data)
+
     try:
         # Decode the JWT token
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -34,7 +133,18 @@ def verify_token(token: str, credentials_exception):
             raise credentials_exception
     
         token_data = {"email": email, "id": user_id}
-        return token_data
+
+        # Versioned identity claims, only in tokens issued with identity_claims()
+        if "cv" in payload:
+            token_data.update({
+                "profile_id": payload.get("pid"),
+                "worker_id": payload.get("wid"),
+                "role": payload.get("role"),
+                "claims_version": payload["cv"],
+            })
+
+        token_cache.put(digest, payload["exp"], token_data)
+        return dict(token_data)
 
     except ExpiredSignatureError:
         # Handle expired token error with an appropriate response
@@ -1,17 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import JSONResponse
-from mysql.connector import connection
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-from .hashing import Hash
-from .utils import create_access_token, verify_token
-from database import get_db
+from .hashing import hashing_pool
+from .utils import create_access_token, verify_token, identity_claims, claims_versions
+from .services import fetch_identity
+from database import get_db, pooled_connection, PooledConnection
+from timing import TimedRoute, timed
 from .schemas import Login
 
 
 auth_router = APIRouter(
-    tags=["Authentication"]
+    tags=["Authentication"],
+    route_class=TimedRoute,
 )
 
 
@@ -27,24 +29,52 @@ async def get_current_user(token: HTTPAuthorizationCredentials = Depends(bearer_
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    return verify_token(token.credentials, credentials_exception) 
+    with timed("auth"):
+        return verify_token(token.credentials, credentials_exception)
 
 
 ## POST Endpoint: User login
 @auth_router.post("/login")
-def login(data: Login, db: connection.MySQLConnection = Depends(get_db)):
-    cursor = db.cursor(dictionary=True)
+async def login(data: Login):
+    # The connection is released before bcrypt runs, a login waiting for a hashing process
+    # must not hold one of the pool's connections
+    async with pooled_connection() as db:
+        cursor = await db.cursor(dictionary=True)
 
-    cursor.execute("SELECT * FROM users WHERE email=%s", (data.email,))
-    result = cursor.fetchone()
+        await cursor.execute("SELECT * FROM users WHERE email=%s", (data.email,))
+        result = await cursor.fetchone()
 
-    if not result:
-        return JSONResponse(content={"detail": "Email is not registered!"}, status_code=status.HTTP_404_NOT_FOUND)
-    
-    if not Hash.verify(data.password, result["password"]):
+        if not result:
+            return JSONResponse(content={"detail": "Email is not registered!"}, status_code=status.HTTP_404_NOT_FOUND)
+
+        # Embed the identity claims (profile, worker, role) with their version
+        identity = await fetch_identity(cursor, result["id"])
+
+    # Verify the password in the hashing process pool, bcrypt would block the event loop
+    if not await hashing_pool.verify(data.password, result["password"]):
         return JSONResponse(content={"detail": "Incorrect password"}, status_code=status.HTTP_401_UNAUTHORIZED)
 
-    access_token = create_access_token(data={"sub": result["email"], "id": result["id"]})
+    claims_versions.put(identity["id"], identity["claims_version"])
+
+    access_token = create_access_token(data=identity_claims(identity))
     return JSONResponse(content={"access_token": access_token, "token_type": "bearer", "detail": "Sing in successfully!", }, status_code=status.HTTP_200_OK)
 
+
+## POST Endpoint: Reissue the token with the current identity claims (after a role switch, worker creation...)
+@auth_router.post("/token/refresh")
+async def refresh_token(
+    db: PooledConnection = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+):
+    cursor = await db.cursor(dictionary=True)
+
+    identity = await fetch_identity(cursor, current_user["id"])
+    if not identity:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    claims_versions.put(identity["id"], identity["claims_version"])
+
+    access_token = create_access_token(data=identity_claims(identity))
+    return {"access_token": access_token, "token_type": "bearer"}
+
  
\ No newline at end of file
@@ -0,0 +1,75 @@
+## Benchmark: concurrent request throughput with the old sync pool vs the async pool
+##
+## Every simulated request runs one query that takes QUERY_SECONDS on the server.
+## The sync pool blocks the event loop for the whole query, the async pool does not.
+##
+## Run from the backend folder against a local MySQL instance:
+##     python -m benchmarks.db_concurrency --requests 200 --concurrency 50
+import argparse
+import asyncio
+import time
+from mysql.connector import pooling
+
+from database import DB_CONFIG, AsyncConnectionPool
+
+
+QUERY_SECONDS = 0.02
+
+
+## Old behaviour: async handler calling the blocking mysql.connector pool
+async def sync_pool_request(pool):
+    connection = pool.get_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT SLEEP(%s)", (QUERY_SECONDS,))
+        cursor.fetchall()
+    finally:
+        connection.close()
+
+
+## New behaviour: async handler awaiting the async pool
+async def async_pool_request(pool):
+    connection = await pool.get_connection()
+    try:
+        cursor = await connection.cursor()
+        await cursor.execute("SELECT SLEEP(%s)", (QUERY_SECONDS,))
+        await cursor.fetchall()
+    finally:
+        await connection.close()
+
+
+async def run(request_func, pool, total_requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request():
+        async with semaphore:
+            await request_func(pool)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_request() for _ in range(total_requests)))
+    elapsed = time.perf_counter() - start
+
+    return total_requests / elapsed, elapsed
+
+
+async def main(total_requests: int, concurrency: int, pool_size: int):
+    sync_pool = pooling.MySQLConnectionPool(
+        pool_name="benchmark", pool_size=pool_size, **DB_CONFIG
+    )
+    rps, elapsed = await run(sync_pool_request, sync_pool, total_requests, concurrency)
+    print(f"sync pool : {rps:8.1f} req/s ({elapsed:.2f}s for {total_requests} requests)")
+
+    async_pool = AsyncConnectionPool(min_size=pool_size, max_size=pool_size, **DB_CONFIG)
+    rps, elapsed = await run(async_pool_request, async_pool, total_requests, concurrency)
+    print(f"async pool: {rps:8.1f} req/s ({elapsed:.2f}s for {total_requests} requests)")
+    await async_pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pool-size", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.requests, args.concurrency, args.pool_size))
@@ -0,0 +1,73 @@
+## Benchmark: lookups per second of the offline IP range table
+##
+## Builds a synthetic range file (contiguous IPv4 ranges over the whole space, a few
+## thousand cities) unless one is given, then times lookups of random addresses.
+##
+## Run from the backend folder (no database or network needed):
+##     python -m benchmarks.ip_lookup --ranges 1000000 --lookups 500000
+##     python -m benchmarks.ip_lookup --file ip_ranges.bin
+import argparse
+import csv
+import ipaddress
+import os
+import random
+import tempfile
+import time
+
+from users.ip_ranges import IpRangeTable, build_range_file
+
+
+CITIES = 5000
+
+
+def build_synthetic_file(directory: str, ranges: int) -> str:
+    rng = random.Random(7)
+    csv_path = os.path.join(directory, "ranges.csv")
+    step = 2 ** 32 // ranges
+
+    with open(csv_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["start_ip", "end_ip", "city", "latitude", "longitude"])
+        for index in range(ranges):
+            city = rng.randrange(CITIES)
+            writer.writerow([
+                index * step, index * step + step - 1, f"city-{city}",
+                round(rng.uniform(-60, 70), 4), round(rng.uniform(-180, 180), 4),
+            ])
+
+    output_path = os.path.join(directory, "ranges.bin")
+    start = time.perf_counter()
+    build_range_file(csv_path, output_path)
+    print(f"Built {ranges} ranges in {time.perf_counter() - start:.2f} s ({os.path.getsize(output_path) / 1e6:.1f} MB)")
+    return output_path
+
+
+def run(path: str, lookups: int):
+    table = IpRangeTable(path)
+    rng = random.Random(11)
+    addresses = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(lookups)]
+
+    found = 0
+    start = time.perf_counter()
+    for address in addresses:
+        if table.lookup(address) is not None:
+            found += 1
+    elapsed = time.perf_counter() - start
+    table.close()
+
+    print(f"{lookups} lookups in {elapsed:.2f} s: {lookups / elapsed:,.0f} lookups/s, "
+          f"{elapsed / lookups * 1e6:.2f} us each, {found} located")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", default=None, help="Existing range file, a synthetic one is built otherwise")
+    parser.add_argument("--ranges", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=500000)
+    args = parser.parse_args()
+
+    if args.file:
+        run(args.file, args.lookups)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            run(build_synthetic_file(directory, args.ranges), args.lookups)
@@ -0,0 +1,311 @@
+## Load test: scripted user journeys against a running app, latency percentiles per endpoint
+##
+## Setup registers a pool of workers (profile, worker, working area) in one city, each one
+## listening on its SSE stream. Then every virtual user runs journeys until the time is up:
+## sign up, log in, create a profile, search, request a worker, listen for the answer,
+## and the worker accepts. SSE delivery is timed from the request that published it.
+##
+## Run from the backend folder against an app started locally (uvicorn main:app):
+##     python -m benchmarks.load_test run --concurrency 20 --duration 60 --output before.json
+##     python -m benchmarks.load_test compare before.json after.json --threshold 10
+import argparse
+import asyncio
+import base64
+import json
+import sys
+import time
+import uuid
+import httpx
+
+
+CITY = "loadtest"
+PASSWORD = "load-test-password"
+
+## Seconds to wait for an SSE notification before counting it as an error
+SSE_TIMEOUT = 10
+
+PERCENTILES = (("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99))
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+## Latencies and errors per endpoint, recording starts with the measured phase
+class Recorder:
+    def __init__(self):
+        self.enabled = False
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name: str, milliseconds: float, ok: bool = True):
+        if not self.enabled:
+            return
+        self.latencies.setdefault(name, []).append(milliseconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, duration: float):
+        endpoints = {}
+        for name, latencies in sorted(self.latencies.items()):
+            endpoints[name] = {
+                "count": len(latencies),
+                "errors": self.errors.get(name, 0),
+                "throughput_rps": round(len(latencies) / duration, 2),
+                **{key: round(percentile(latencies, fraction), 2) for key, fraction in PERCENTILES},
+                "max_ms": round(max(latencies), 2),
+            }
+        return endpoints
+
+
+recorder = Recorder()
+
+
+## Pairs the send and receive times of notifications, whichever is seen first
+## (the worker may be notified before the request publishing it has returned)
+class DeliveryTimer:
+    def __init__(self, name: str):
+        self.name = name
+        self.sent = {}
+        self.received = {}
+
+    def mark_sent(self, key, at: float):
+        if key in self.received:
+            recorder.record(self.name, (self.received.pop(key) - at) * 1000)
+        else:
+            self.sent[key] = at
+
+    def mark_received(self, key, at: float):
+        if key in self.sent:
+            recorder.record(self.name, (at - self.sent.pop(key)) * 1000)
+        else:
+            self.received[key] = at
+
+
+## Function to send a request and record its latency under "METHOD /route"
+async def call(client, method: str, route: str, url: str | None = None, token: str | None = None, **kwargs):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url or route, headers=headers, **kwargs)
+    except httpx.HTTPError:
+        recorder.record(f"{method} {route}", (time.perf_counter() - start) * 1000, ok=False)
+        raise
+
+    recorder.record(f"{method} {route}", (time.perf_counter() - start) * 1000, ok=response.status_code < 400)
+    response.raise_for_status()
+    return response
+
+
+def token_claims(token: str) -> dict:
+    # Only reads the payload, the server is the one verifying the signature
+    payload = token.split(".")[1]
+    return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+
+
+def profile_body(role: str):
+    return {
+        "first_name": "Load",
+        "last_name": "Test",
+        "phone_number": "0000000000",
+        "gender": "Other",
+        "role": role,
+        "city": CITY,
+        "location": "load test",
+        "longitude": "0",
+        "latitude": "0",
+    }
+
+
+## Journey steps shared by users and workers: sign up, log in and create a profile, returns the token
+async def register(client, role: str):
+    email = f"load-{uuid.uuid4().hex}@example.com"
+    await call(client, "POST", "/user/", json={"email": email, "password": PASSWORD})
+    response = await call(client, "POST", "/login", json={"email": email, "password": PASSWORD})
+    token = response.json()["access_token"]
+    await call(client, "POST", "/profile/", token=token, json=profile_body(role))
+    return token
+
+
+## Function to register a worker with a working area, returns (token, worker id)
+async def register_worker(client):
+    token = await register(client, "Worker")
+    await call(client, "POST", "/worker/", token=token)
+    await call(
+        client, "POST", "/working_area_info/", token=token,
+        json={"name": "plumber", "rate_type": "Per_hour", "rate": 100, "description": "load test"},
+    )
+
+    # The new token carries the worker id
+    response = await call(client, "POST", "/token/refresh", token=token)
+    token = response.json()["access_token"]
+    return token, token_claims(token)["wid"]
+
+
+## Function to read the notifications of an SSE stream, calls on_event(data, receive time) for each one
+async def listen(client, route: str, url: str, on_event, ready: asyncio.Event | None = None):
+    start = time.perf_counter()
+    async with client.stream("GET", url, timeout=httpx.Timeout(10, read=None)) as response:
+        recorder.record(f"GET {route}", (time.perf_counter() - start) * 1000, ok=response.status_code < 400)
+        if ready is not None:
+            ready.set()
+        async for line in response.aiter_lines():
+            if line.startswith("data: "):
+                if on_event(line[len("data: "):], time.perf_counter()):
+                    return
+
+
+## Worker side: keeps its stream open and times the delivery of new requests
+async def worker_listener(client, worker_id: int, deliveries: DeliveryTimer, ready: asyncio.Event):
+    def on_event(data, received_at):
+        # "New request from User <id> with Request ID <request id>"
+        deliveries.mark_received(int(data.rsplit(" ", 1)[-1]), received_at)
+
+    await listen(client, "/sse/worker/{worker_id}", f"/sse/worker/{worker_id}", on_event, ready)
+
+
+## One journey of a user, the worker answers the request
+async def journey(client, workers, index: int, deliveries: DeliveryTimer):
+    token = await register(client, "User")
+    await call(client, "GET", "/search_workers/", token=token, params={"limit": 10})
+
+    worker_token, worker_id = workers[index % len(workers)]
+    requested = time.perf_counter()
+    response = await call(client, "POST", "/request_worker/", token=token, params={"worker_id": worker_id})
+    request_id = response.json()["request_id"]
+    deliveries.mark_sent(request_id, requested)
+
+    # The user listens for the answer while the worker responds
+    answered = {}
+    ready = asyncio.Event()
+
+    def on_answer(data, received_at):
+        answered["at"] = received_at
+        return True
+
+    listener = asyncio.create_task(
+        listen(client, "/sse/user/{request_id}", f"/sse/user/{request_id}", on_answer, ready)
+    )
+    try:
+        await asyncio.wait_for(ready.wait(), SSE_TIMEOUT)
+        responded = time.perf_counter()
+        await call(
+            client, "PUT", "/request_worker/", token=worker_token,
+            params={"request_id": request_id, "response": "Accepted"},
+        )
+        await asyncio.wait_for(listener, SSE_TIMEOUT)
+        recorder.record("SSE user notification", (answered["at"] - responded) * 1000)
+    except asyncio.TimeoutError:
+        recorder.record("SSE user notification", SSE_TIMEOUT * 1000, ok=False)
+    finally:
+        listener.cancel()
+
+
+async def virtual_user(client, workers, deadline: float, deliveries: DeliveryTimer, counts: dict):
+    index = 0
+    while time.perf_counter() < deadline:
+        try:
+            await journey(client, workers, index, deliveries)
+            counts["completed"] += 1
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            # The failed call is already recorded, start a new journey
+            counts["failed"] += 1
+            print(f"Journey failed: {e}", file=sys.stderr)
+        index += 1
+
+
+async def run(base_url: str, concurrency: int, duration: float, workers_count: int, output: str):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=httpx.Limits(max_connections=None)) as client:
+        print(f"Registering {workers_count} workers")
+        workers = [await register_worker(client) for _ in range(workers_count)]
+
+        deliveries = DeliveryTimer("SSE worker notification")
+        readies = [asyncio.Event() for _ in workers]
+        listeners = [
+            asyncio.create_task(worker_listener(client, worker_id, deliveries, ready))
+            for (_, worker_id), ready in zip(workers, readies)
+        ]
+        await asyncio.gather(*(ready.wait() for ready in readies))
+
+        print(f"Running {concurrency} virtual users for {duration:.0f} s")
+        recorder.enabled = True
+        counts = {"completed": 0, "failed": 0}
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(virtual_user(client, workers, start + duration, deliveries, counts) for _ in range(concurrency))
+        )
+        elapsed = time.perf_counter() - start
+        recorder.enabled = False
+
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+
+    result = {
+        "base_url": base_url,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "workers": workers_count,
+        "journeys": counts,
+        "journeys_per_s": round(counts["completed"] / elapsed, 2),
+        "endpoints": recorder.report(elapsed),
+    }
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+
+    print(f"{counts['completed']} journeys ({counts['failed']} failed) in {elapsed:.1f} s")
+    print(f"{'endpoint':36s} {'count':>7s} {'errors':>7s} {'rps':>8s} {'p50':>8s} {'p95':>8s} {'p99':>8s}")
+    for name, stats in result["endpoints"].items():
+        print(
+            f"{name:36s} {stats['count']:7d} {stats['errors']:7d} {stats['throughput_rps']:8.1f} "
+            f"{stats['p50_ms']:8.1f} {stats['p95_ms']:8.1f} {stats['p99_ms']:8.1f}"
+        )
+    print(f"Results written to {output}")
+
+
+## Function to compare two result files, returns False when a percentile or the throughput regressed beyond the threshold
+def compare(baseline_path: str, current_path: str, threshold: float) -> bool:
+    with open(baseline_path) as file:
+        baseline = json.load(file)["endpoints"]
+    with open(current_path) as file:
+        current = json.load(file)["endpoints"]
+
+    ok = True
+    print(f"{'endpoint':36s} {'metric':>14s} {'before':>9s} {'after':>9s} {'change':>8s}")
+    for name in sorted(set(baseline) & set(current)):
+        for metric in ("throughput_rps", *(key for key, _ in PERCENTILES)):
+            before, after = baseline[name][metric], current[name][metric]
+            change = (after - before) / before * 100 if before else 0.0
+
+            # Latency going up or throughput going down is a regression
+            regressed = change < -threshold if metric == "throughput_rps" else change > threshold
+            ok = ok and not regressed
+            print(f"{name:36s} {metric:>14s} {before:9.1f} {after:9.1f} {change:+7.1f}%{'  REGRESSED' if regressed else ''}")
+
+    for name in sorted(set(baseline) ^ set(current)):
+        print(f"{name}: only in {'the baseline' if name in baseline else 'the current run'}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the journeys and write the results")
+    run_parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    run_parser.add_argument("--concurrency", type=int, default=10, help="Virtual users running journeys at once")
+    run_parser.add_argument("--duration", type=float, default=30, help="Seconds of measured load")
+    run_parser.add_argument("--workers", type=int, default=5, help="Workers receiving the requests")
+    run_parser.add_argument("--output", default="load_test_results.json")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=10, help="Allowed change in percent")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run(args.base_url, args.concurrency, args.duration, args.workers, args.output))
+    else:
+        sys.exit(0 if compare(args.baseline, args.current, args.threshold) else 1)
@@ -0,0 +1,117 @@
+## Benchmark: cross-process notification delivery through the sqlite broker
+##
+## Starts several subscriber processes and one publisher process sharing a
+## temporary broker log, then checks that every subscriber received every
+## notification, in publish order, and reports the delivery latency.
+## Ordering, heartbeats and slow subscribers are tested in tests/test_notification.py.
+##
+## Run from the backend folder (no database needed):
+##     python -m benchmarks.notification_fanout --subscribers 4 --messages 500
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from broker import SQLiteBroker
+
+
+def subscriber_process(path: str, total_messages: int, ready, results):
+    async def run():
+        received = []
+        done = asyncio.Event()
+
+        def deliver(channel, key, notification):
+            message = json.loads(notification)
+            received.append((message["seq"], time.time() - message["sent_at"]))
+            if len(received) == total_messages:
+                done.set()
+
+        broker = SQLiteBroker(path)
+        await broker.start(deliver)
+        ready.set()
+
+        try:
+            await asyncio.wait_for(done.wait(), timeout=60)
+        except asyncio.TimeoutError:
+            pass
+        await broker.stop()
+        results.put((os.getpid(), received))
+
+    asyncio.run(run())
+
+
+def publisher_process(path: str, total_messages: int, interval: float):
+    async def run():
+        broker = SQLiteBroker(path)
+        await broker.start(lambda channel, key, notification: None)
+        for seq in range(total_messages):
+            message = json.dumps({"seq": seq, "sent_at": time.time()})
+            await broker.publish("worker", 1, message)
+            await asyncio.sleep(interval)
+        await broker.stop()
+
+    asyncio.run(run())
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main(subscribers: int, total_messages: int, interval: float) -> bool:
+    path = os.path.join(tempfile.mkdtemp(), "notifications.db")
+    results = multiprocessing.Queue()
+
+    readies = [multiprocessing.Event() for _ in range(subscribers)]
+    processes = [
+        multiprocessing.Process(target=subscriber_process, args=(path, total_messages, ready, results))
+        for ready in readies
+    ]
+    for process in processes:
+        process.start()
+    for ready in readies:
+        ready.wait()
+
+    publisher = multiprocessing.Process(target=publisher_process, args=(path, total_messages, interval))
+    publisher.start()
+    publisher.join()
+
+    ok = True
+    latencies = []
+    for _ in processes:
+        pid, received = results.get()
+        sequence = [seq for seq, _ in received]
+        in_order = sequence == sorted(sequence)
+        complete = len(sequence) == total_messages
+        ok = ok and in_order and complete
+        latencies.extend(latency for _, latency in received)
+        print(f"subscriber {pid}: received {len(sequence)}/{total_messages}, in order: {in_order}")
+
+    for process in processes:
+        process.join()
+
+    if latencies:
+        print(
+            "latency ms: "
+            f"p50={percentile(latencies, 0.50) * 1000:.1f} "
+            f"p95={percentile(latencies, 0.95) * 1000:.1f} "
+            f"p99={percentile(latencies, 0.99) * 1000:.1f} "
+            f"mean={statistics.mean(latencies) * 1000:.1f}"
+        )
+
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--interval", type=float, default=0.001)
+    args = parser.parse_args()
+
+    sys.exit(0 if main(args.subscribers, args.messages, args.interval) else 1)
@@ -0,0 +1,158 @@
+## Benchmark: search latency, three round trips (old path) vs one statement (new path)
+##
+## Seeds throw-away cities with 10, 100 and 1000 workers (three working areas each),
+## times a first page of /search_workers/ both ways and removes the seeded rows.
+##
+## Run from the backend folder against a local MySQL instance:
+##     python -m benchmarks.search_latency --runs 50
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from database import connection_pool
+from search_workers.services import fetch_city_workers_page, serialize_worker
+
+
+CITY_SIZES = [10, 100, 1000]
+AREAS_PER_WORKER = 3
+
+
+## Old path: caller city, grouped worker ids, then the working areas with an IN list
+async def legacy_search(cursor, current_user, limit: int):
+    await cursor.execute("SELECT city FROM profile WHERE user_id = %s", (current_user["id"],))
+    city = (await cursor.fetchone())["city"]
+
+    await cursor.execute(
+        """
+        SELECT users.id AS user_id FROM users
+        JOIN profile ON users.id = profile.user_id
+        JOIN worker ON profile.id = worker.profile_id
+        JOIN working_area_info ON worker.id = working_area_info.worker_id
+        WHERE profile.city = %s AND profile.role = 'Worker' AND users.email != %s
+        GROUP BY users.id LIMIT %s
+        """,
+        (city, current_user["email"], limit),
+    )
+    worker_ids = [row["user_id"] for row in await cursor.fetchall()]
+    if not worker_ids:
+        return []
+
+    await cursor.execute(
+        f"""
+        SELECT users.email, profile.first_name, profile.last_name, profile.gender, profile.phone_number,
+            profile.city, working_area_info.name, working_area_info.rate_type, working_area_info.rate,
+            AVG(ratings.stars) AS avg_stars, working_area_info.description
+        FROM users
+        JOIN profile ON users.id = profile.user_id
+        JOIN worker ON profile.id = worker.profile_id
+        JOIN working_area_info ON worker.id = working_area_info.worker_id
+        LEFT JOIN ratings ON worker.id = ratings.worker_id
+        WHERE users.id IN ({', '.join(str(user_id) for user_id in worker_ids)})
+        GROUP BY users.email, profile.first_name, profile.last_name, profile.gender, profile.phone_number,
+            profile.city, working_area_info.name, working_area_info.rate_type, working_area_info.rate,
+            working_area_info.description
+        """
+    )
+    rows = await cursor.fetchall()
+
+    workers = {}
+    for row in rows:
+        workers.setdefault(row["email"], {"working_areas": []})["working_areas"].append(row["name"])
+    return list(workers.values())
+
+
+## New path: one statement
+async def single_statement_search(cursor, current_user, limit: int):
+    rows = await fetch_city_workers_page(cursor, current_user, {}, None, 0, limit)
+    return [serialize_worker(row) for row in rows]
+
+
+async def seed_city(connection, city: str, workers: int):
+    cursor = await connection.cursor()
+    emails = [f"bench-{city}-{index}@example.com" for index in range(workers + 1)]
+
+    await cursor.executemany(
+        "INSERT INTO users (email, password) VALUES (%s, %s)", [(email, "x") for email in emails]
+    )
+    await cursor.execute(
+        f"SELECT id FROM users WHERE email IN ({', '.join(['%s'] * len(emails))}) ORDER BY id",
+        tuple(emails),
+    )
+    user_ids = [row[0] for row in await cursor.fetchall()]
+
+    await cursor.executemany(
+        "INSERT INTO profile (user_id, first_name, last_name, phone_number, gender, role, city) "
+        "VALUES (%s, 'Bench', 'Worker', '0000000000', 'Male', %s, %s)",
+        [(user_id, "User" if index == 0 else "Worker", city) for index, user_id in enumerate(user_ids)],
+    )
+    await cursor.execute(
+        "INSERT INTO worker (profile_id) SELECT id FROM profile WHERE city = %s AND role = 'Worker'",
+        (city,),
+    )
+    await cursor.execute(
+        "SELECT worker.id FROM worker JOIN profile ON profile.id = worker.profile_id WHERE profile.city = %s",
+        (city,),
+    )
+    worker_ids = [row[0] for row in await cursor.fetchall()]
+
+    await cursor.executemany(
+        "INSERT INTO working_area_info (worker_id, name, rate_type, rate, description) VALUES (%s, %s, 'Per_hour', %s, 'bench')",
+        [(worker_id, f"trade-{area}", 100 + area) for worker_id in worker_ids for area in range(AREAS_PER_WORKER)],
+    )
+    await connection.commit()
+
+    return {"id": user_ids[0], "email": emails[0]}
+
+
+async def cleanup_city(connection, city: str):
+    cursor = await connection.cursor()
+    await cursor.execute("SELECT user_id FROM profile WHERE city = %s", (city,))
+    user_ids = [row[0] for row in await cursor.fetchall()]
+
+    # Profiles, workers and working areas go with the users (ON DELETE CASCADE)
+    await cursor.execute(
+        f"DELETE FROM users WHERE id IN ({', '.join(['%s'] * len(user_ids))})", tuple(user_ids)
+    )
+    await connection.commit()
+
+
+async def time_search(search, connection, current_user, runs: int, limit: int):
+    cursor = await connection.cursor(dictionary=True)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await search(cursor, current_user, limit)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+async def main(runs: int, limit: int):
+    connection = await connection_pool.get_connection()
+    try:
+        for size in CITY_SIZES:
+            city = f"bench-{uuid.uuid4().hex[:8]}"
+            current_user = await seed_city(connection, city, size)
+            try:
+                legacy = await time_search(legacy_search, connection, current_user, runs, limit)
+                single = await time_search(single_statement_search, connection, current_user, runs, limit)
+                print(
+                    f"{size:5d} workers/city  "
+                    f"3 round trips: median {legacy[0]:6.2f} ms (max {legacy[1]:6.2f})  "
+                    f"1 statement: median {single[0]:6.2f} ms (max {single[1]:6.2f})"
+                )
+            finally:
+                await cleanup_city(connection, city)
+    finally:
+        await connection.close()
+        await connection_pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.runs, args.limit))
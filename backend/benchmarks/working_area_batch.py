@@ -0,0 +1,155 @@
+## Benchmark: N single working area writes vs one batch
+##
+## Seeds a throw-away worker, then writes N working areas (create, update, delete)
+## the old way (one request each: worker lookup, statement, commit) and through
+## apply_working_area_batch, counting the statements sent and the wall time.
+##
+## Run from the backend folder against a local MySQL instance:
+##     python -m benchmarks.working_area_batch --items 10
+import argparse
+import asyncio
+import time
+import uuid
+from types import SimpleNamespace
+
+from database import connection_pool
+from workers.services import apply_working_area_batch
+
+
+## Cursor wrapper counting the statements sent to the server
+class CountingCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.round_trips = 0
+
+    async def execute(self, *args):
+        self.round_trips += 1
+        return await self.cursor.execute(*args)
+
+    async def executemany(self, operation, seq_params):
+        # mysql.connector sends a multi-row INSERT as one statement, anything else row by row
+        seq_params = list(seq_params)
+        self.round_trips += 1 if operation.lstrip().upper().startswith("INSERT") else len(seq_params)
+        return await self.cursor.executemany(operation, seq_params)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def area(index: int, **fields):
+    values = {"name": f"trade-{index}", "rate_type": "Per_hour", "rate": 100 + index, "description": "bench"}
+    values.update(fields)
+    return SimpleNamespace(**values)
+
+
+async def seed_worker(connection):
+    cursor = await connection.cursor()
+    email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+    await cursor.execute("INSERT INTO users (email, password) VALUES (%s, 'x')", (email,))
+    user_id = cursor.lastrowid
+    await cursor.execute(
+        "INSERT INTO profile (user_id, first_name, role, city) VALUES (%s, 'Bench', 'Worker', 'bench')",
+        (user_id,),
+    )
+    await cursor.execute("INSERT INTO worker (profile_id) VALUES (%s)", (cursor.lastrowid,))
+    worker_id = cursor.lastrowid
+    await connection.commit()
+    return user_id, worker_id
+
+
+## Old path: every operation is its own request and transaction
+async def single_requests(connection, user_id: int, items: int):
+    cursor = CountingCursor(await connection.cursor())
+    commits = 0
+
+    created = []
+    for index in range(items):
+        await cursor.execute(
+            "SELECT id FROM worker WHERE profile_id = (SELECT id FROM profile WHERE user_id = %s)", (user_id,)
+        )
+        worker_id = (await cursor.fetchone())[0]
+        data = area(index)
+        await cursor.execute(
+            "INSERT INTO working_area_info (worker_id, name, rate_type, rate, description) VALUES (%s, %s, %s, %s, %s)",
+            (worker_id, data.name, data.rate_type, data.rate, data.description),
+        )
+        created.append(cursor.lastrowid)
+        await connection.commit()
+        commits += 1
+
+    for area_info_id in created:
+        await cursor.execute(
+            """
+            SELECT wai.id, wai.worker_id FROM working_area_info as wai
+            JOIN worker as w ON wai.worker_id = w.id
+            JOIN profile as p ON w.profile_id = p.id
+            WHERE p.user_id = %s AND wai.id = %s
+            """,
+            (user_id, area_info_id),
+        )
+        await cursor.fetchall()
+        await cursor.execute(
+            "UPDATE working_area_info SET rate = %s WHERE worker_id = %s AND id = %s", (1, worker_id, area_info_id)
+        )
+        await connection.commit()
+        commits += 1
+
+    for area_info_id in created:
+        await cursor.execute("DELETE FROM working_area_info WHERE id = %s", (area_info_id,))
+        await connection.commit()
+        commits += 1
+
+    return cursor.round_trips + commits
+
+
+## New path: one batch per kind of operation, each in a single transaction
+async def batched(connection, worker_id: int, items: int):
+    cursor = CountingCursor(await connection.cursor())
+
+    results = await apply_working_area_batch(
+        cursor, worker_id, SimpleNamespace(create=[area(index) for index in range(items)], update=[], delete=[])
+    )
+    await connection.commit()
+    created = [result["id"] for result in results["created"]]
+
+    updates = [area(index, id=area_info_id, rate=1) for index, area_info_id in enumerate(created)]
+    await apply_working_area_batch(cursor, worker_id, SimpleNamespace(create=[], update=updates, delete=[]))
+    await connection.commit()
+
+    await apply_working_area_batch(cursor, worker_id, SimpleNamespace(create=[], update=[], delete=created))
+    await connection.commit()
+
+    return cursor.round_trips + 3
+
+
+async def main(items: int):
+    connection = await connection_pool.get_connection()
+    try:
+        user_id, worker_id = await seed_worker(connection)
+        try:
+            start = time.perf_counter()
+            single_round_trips = await single_requests(connection, user_id, items)
+            single_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            batch_round_trips = await batched(connection, worker_id, items)
+            batch_ms = (time.perf_counter() - start) * 1000
+
+            print(f"{items} creates + {items} updates + {items} deletes")
+            print(f"one request per item: {single_round_trips:4d} round trips, {single_ms:8.2f} ms")
+            print(f"batch endpoint:       {batch_round_trips:4d} round trips, {batch_ms:8.2f} ms")
+        finally:
+            cursor = await connection.cursor()
+            await cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            await connection.commit()
+    finally:
+        await connection.close()
+        await connection_pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.items))
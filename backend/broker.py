@@ -0,0 +1,186 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+## Broker backend used for notifications: "memory" (single process) or "sqlite" (all processes on the host)
+NOTIFICATION_BROKER = os.getenv("NOTIFICATION_BROKER", "memory")
+
+## Shared SQLite log used by the sqlite broker
+NOTIFICATION_BROKER_PATH = os.getenv("NOTIFICATION_BROKER_PATH", "/tmp/findworker_notifications.db")
+
+## Seconds between two reads of the shared log
+POLL_INTERVAL = 0.02
+
+## Seconds a published notification stays in the shared log, it is also the replay window
+## for clients reconnecting to another process (as PENDING_TTL in notification.py)
+LOG_RETENTION = 300
+
+
+## In-process broker: notifications only reach subscribers of the current process,
+## the hubs keep the backlog of undelivered ones themselves
+class InProcessBroker:
+    shared = False
+
+    def __init__(self):
+        self.deliver = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def publish(self, channel: str, key: int, notification: str):
+        self.deliver(channel, key, notification)
+
+    async def replay(self, channel: str, key: int):
+        return []
+
+    async def stop(self):
+        self.deliver = None
+
+
+## Cross-process broker: every uvicorn process appends to and tails a shared SQLite WAL log.
+## The log is also the backlog: a notification no process had a subscriber for stays
+## undelivered there, and is claimed by whichever process the client reconnects to.
+class SQLiteBroker:
+    shared = True
+
+    def __init__(self, path: str = NOTIFICATION_BROKER_PATH, poll_interval: float = POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.deliver = None
+        self.last_id = 0
+        self.last_prune = 0.0
+        self._connection = None
+        self._poll_task = None
+        # One thread owns the SQLite connection, so the event loop never blocks on disk
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-broker")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("PRAGMA busy_timeout=5000")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                key INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                delivered INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(notifications)")]
+        if "delivered" not in columns:
+            # Log created by an older version
+            self._connection.execute("ALTER TABLE notifications ADD COLUMN delivered INTEGER NOT NULL DEFAULT 0")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS notifications_key ON notifications (channel, key)")
+        # Only deliver notifications published after this process started
+        row = self._connection.execute("SELECT MAX(id) FROM notifications").fetchone()
+        self.last_id = row[0] or 0
+
+    def _insert(self, channel: str, key: int, notification: str):
+        self._connection.execute(
+            "INSERT INTO notifications (channel, key, message, created_at) VALUES (?, ?, ?, ?)",
+            (channel, key, notification, time.time()),
+        )
+
+    def _read_new(self):
+        rows = self._connection.execute(
+            "SELECT id, channel, key, message FROM notifications WHERE id > ? ORDER BY id",
+            (self.last_id,),
+        ).fetchall()
+
+        # Prune old entries now and then, any process may do it
+        now = time.time()
+        if now - self.last_prune > LOG_RETENTION:
+            self.last_prune = now
+            self._connection.execute(
+                "DELETE FROM notifications WHERE created_at < ?", (now - LOG_RETENTION,)
+            )
+
+        return rows
+
+    def _mark_delivered(self, ids):
+        self._connection.executemany("UPDATE notifications SET delivered = 1 WHERE id = ?", [(id,) for id in ids])
+
+    def _claim(self, channel: str, key: int, up_to_id: int):
+        # Atomic, so two processes replaying the same key never both get a notification
+        rows = self._connection.execute(
+            """
+            UPDATE notifications SET delivered = 1
+            WHERE channel = ? AND key = ? AND delivered = 0 AND id <= ? AND created_at >= ?
+            RETURNING id, message
+            """,
+            (channel, key, up_to_id, time.time() - LOG_RETENTION),
+        ).fetchall()
+        return [message for _, message in sorted(rows)]
+
+    async def _poll(self):
+        while True:
+            try:
+                rows = await self._run(self._read_new)
+            except sqlite3.Error as e:
+                print(f"Notification broker error: {e}")
+                rows = []
+
+            delivered = []
+            for notification_id, channel, key, message in rows:
+                self.last_id = notification_id
+                if self.deliver(channel, key, message):
+                    delivered.append(notification_id)
+
+            if delivered:
+                try:
+                    await self._run(self._mark_delivered, delivered)
+                except sqlite3.Error as e:
+                    print(f"Notification broker error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def start(self, deliver):
+        self.deliver = deliver
+        await self._run(self._open)
+        self._poll_task = asyncio.create_task(self._poll())
+
+    async def publish(self, channel: str, key: int, notification: str):
+        # Delivery, including to this process, happens when the log is tailed
+        await self._run(self._insert, channel, key, notification)
+
+    async def replay(self, channel: str, key: int):
+        # Notifications already tailed (newer ones reach the new subscriber live) that no process delivered
+        try:
+            return await self._run(self._claim, channel, key, self.last_id)
+        except sqlite3.Error as e:
+            print(f"Notification broker error: {e}")
+            return []
+
+    async def stop(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=False)
+
+
+## Function to create the configured broker
+def create_broker(name: str = NOTIFICATION_BROKER):
+    if name == "memory":
+        return InProcessBroker()
+    if name == "sqlite":
+        return SQLiteBroker()
+    raise ValueError(f"Unknown notification broker: {name}")
@@ -0,0 +1,289 @@
+## Streaming bulk import of users, profiles, workers and working areas
+##
+## One record per user, as JSON lines or CSV:
+##     email, password, first_name, last_name, phone_number, gender, role, city,
+##     location, longitude, latitude, working_areas
+## working_areas is a list of {name, rate_type, rate, description} (a JSON string in CSV).
+## A worker row is created for every record with role "Worker".
+##
+## Records are read and written BATCH_SIZE at a time, so memory does not grow with the file.
+## Passwords of the next batch are hashed on all cores while the current batch is inserted.
+## After each committed batch the position is saved to a checkpoint file, an interrupted
+## import started again with the same checkpoint resumes after the last committed batch.
+## Emails already registered are skipped, so replaying a batch never duplicates users.
+## A batch the database rejects is retried one record per transaction: the records that still
+## fail are reported and counted in the checkpoint, appended to a rejects file in the format of
+## the input (to fix and import again), and the import goes on.
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from mysql.connector import errors
+from pydantic import ValidationError
+
+from auth.hashing import Hash
+from users.schemas import UserCreate, UserProfile
+from users.services import validate_password_length
+from workers.schemas import WorkingAreaInfo
+
+
+## Records inserted per transaction
+BATCH_SIZE = 500
+
+## Processes hashing passwords during an import
+IMPORT_HASH_WORKERS = os.cpu_count() or 1
+
+
+## Function to stream the raw records of a JSONL (one line each) or CSV (one dict each) file
+def read_records(path: str, file_format: str):
+    with open(path, newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield line
+
+
+## Function to validate a raw record with the API schemas, returns (user, profile, working areas)
+def parse_record(record):
+    # Parsed from a copy, a rejected record is written back as it was read
+    record = json.loads(record) if isinstance(record, str) else dict(record)
+    if isinstance(record.get("working_areas"), str):
+        record["working_areas"] = json.loads(record["working_areas"] or "[]")
+
+    user = UserCreate(email=record.get("email"), password=record.get("password"))
+    # Same rule as signup
+    if not validate_password_length(user.password):
+        raise ValueError("Password must contain at least 4 characters")
+    profile = UserProfile(**{field: record.get(field) for field in UserProfile.model_fields})
+    working_areas = [WorkingAreaInfo(**area) for area in record.get("working_areas") or []]
+    return user, profile, working_areas
+
+
+def load_checkpoint(checkpoint_path: str):
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as file:
+            state = json.load(file)
+        # Checkpoints of older versions listed the rejected positions
+        if isinstance(state.get("rejected"), list):
+            state["rejected"] = len(state["rejected"])
+        return state
+    return {"records": 0, "imported": 0, "skipped": 0, "failed": 0, "rejected": 0}
+
+
+def save_checkpoint(checkpoint_path: str, state: dict):
+    if not checkpoint_path:
+        return
+
+    # Write then rename, a crash never leaves a half written checkpoint
+    temporary_path = checkpoint_path + ".tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(state, file)
+    os.replace(temporary_path, checkpoint_path)
+
+
+## Function to append the records the database rejected to the rejects file, in the format of the input.
+## A batch replayed after a crash may append its rejects a second time.
+def save_rejects(rejects_path: str, file_format: str, raw_records):
+    if not rejects_path or not raw_records:
+        return
+
+    new_file = not os.path.exists(rejects_path)
+    with open(rejects_path, "a", newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            writer = csv.DictWriter(file, fieldnames=list(raw_records[0]))
+            if new_file:
+                writer.writeheader()
+            writer.writerows(raw_records)
+        else:
+            for line in raw_records:
+                file.write(line if line.endswith("\n") else line + "\n")
+
+
+def in_list(values):
+    return ", ".join(["%s"] * len(values))
+
+
+## Helper function to insert one batch of parsed records in a single transaction, returns the number imported
+async def insert_batch(connection, parsed, hashed_passwords):
+    cursor = await connection.cursor()
+
+    # Already registered emails are left untouched
+    emails = [user.email for user, _, _ in parsed]
+    await cursor.execute(f"SELECT email FROM users WHERE email IN ({in_list(emails)})", tuple(emails))
+    existing = {row[0] for row in await cursor.fetchall()}
+
+    records = []
+    for (user, profile, working_areas), hashed_password in zip(parsed, hashed_passwords):
+        if user.email not in existing:
+            existing.add(user.email)  # Duplicates inside the batch too
+            records.append((user, profile, working_areas, hashed_password))
+    if not records:
+        return 0
+
+    try:
+        await cursor.executemany(
+            "INSERT INTO users (email, password) VALUES (%s, %s)",
+            [(user.email, hashed_password) for user, _, _, hashed_password in records],
+        )
+        emails = [user.email for user, _, _, _ in records]
+        await cursor.execute(f"SELECT email, id FROM users WHERE email IN ({in_list(emails)})", tuple(emails))
+        user_ids = dict(await cursor.fetchall())
+
+        await cursor.executemany(
+            """
+            INSERT INTO profile (user_id, first_name, last_name, phone_number, gender, role, city, location, longitude, latitude)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            [
+                (
+                    user_ids[user.email], profile.first_name, profile.last_name, profile.phone_number,
+                    profile.gender.value, profile.role.value, profile.city, profile.location,
+                    profile.longitude, profile.latitude,
+                )
+                for user, profile, _, _ in records
+            ],
+        )
+
+        worker_user_ids = [user_ids[user.email] for user, profile, _, _ in records if profile.role.value == "Worker"]
+        if worker_user_ids:
+            await cursor.execute(
+                f"INSERT INTO worker (profile_id) SELECT id FROM profile WHERE user_id IN ({in_list(worker_user_ids)})",
+                tuple(worker_user_ids),
+            )
+            await cursor.execute(
+                f"""
+                SELECT profile.user_id, worker.id FROM worker
+                JOIN profile ON profile.id = worker.profile_id
+                WHERE profile.user_id IN ({in_list(worker_user_ids)})
+                """,
+                tuple(worker_user_ids),
+            )
+            worker_ids = dict(await cursor.fetchall())
+
+            areas = [
+                (worker_ids[user_ids[user.email]], area.name, area.rate_type.value, area.rate, area.description)
+                for user, _, working_areas, _ in records
+                if user_ids[user.email] in worker_ids
+                for area in working_areas
+            ]
+            if areas:
+                await cursor.executemany(
+                    """
+                    INSERT INTO working_area_info (worker_id, name, rate_type, rate, description)
+                    VALUES (%s, %s, %s, %s, %s)
+                    """,
+                    areas,
+                )
+
+        await connection.commit()
+
+    except Exception:
+        await connection.rollback()
+        raise
+
+    return len(records)
+
+
+## Helper function to insert a batch, or its records one by one when the database rejects the batch.
+## Returns (imported, positions of the rejected records); connection errors still stop the import.
+async def insert_records(connection, parsed, hashed_passwords, positions):
+    try:
+        return await insert_batch(connection, parsed, hashed_passwords), []
+    except (errors.OperationalError, errors.InterfaceError):
+        raise
+    except errors.DatabaseError:
+        pass
+
+    imported = 0
+    rejected = []
+    for record, hashed_password, position in zip(parsed, hashed_passwords, positions):
+        try:
+            imported += await insert_batch(connection, [record], [hashed_password])
+        except (errors.OperationalError, errors.InterfaceError):
+            raise
+        except errors.DatabaseError as e:
+            rejected.append(position)
+            print(f"Record {position}: rejected by the database, {e}", file=sys.stderr)
+    return imported, rejected
+
+
+## Function to import a file, resuming from the checkpoint when there is one
+async def import_file(
+    connection, path: str, file_format: str, checkpoint_path: str | None = None,
+    batch_size: int = BATCH_SIZE, rejects_path: str | None = None,
+):
+    state = load_checkpoint(checkpoint_path)
+    records = read_records(path, file_format)
+
+    # Skip what a previous run already committed
+    for _ in islice(records, state["records"]):
+        pass
+
+    loop = asyncio.get_running_loop()
+    executor = ProcessPoolExecutor(
+        max_workers=IMPORT_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    )
+
+    position = state["records"]
+
+    def next_batch():
+        nonlocal position
+        parsed = []
+        positions = []
+        raw_records = []
+        raw_count = 0
+        failed = 0
+        for record in islice(records, batch_size):
+            raw_count += 1
+            position += 1
+            try:
+                parsed.append(parse_record(record))
+                positions.append(position)
+                raw_records.append(record)
+            except (ValidationError, TypeError, ValueError, AttributeError) as e:
+                failed += 1
+                print(f"Record {position}: skipped, {e}", file=sys.stderr)
+        if not raw_count:
+            return None
+
+        # Hashing starts now and runs while the previous batch is being inserted
+        hashing = asyncio.gather(
+            *(loop.run_in_executor(executor, Hash.bcrypt, user.password) for user, _, _ in parsed)
+        )
+        return raw_count, failed, parsed, positions, raw_records, hashing
+
+    batch = None
+    try:
+        batch = next_batch()
+        while batch is not None:
+            raw_count, failed, parsed, positions, raw_records, hashing = batch
+            hashed_passwords = await hashing
+            batch = next_batch()
+
+            imported, rejected = await insert_records(connection, parsed, hashed_passwords, positions) if parsed else (0, [])
+
+            state["records"] += raw_count
+            state["imported"] += imported
+            state["skipped"] += len(parsed) - imported - len(rejected)
+            state["failed"] += failed + len(rejected)
+            state["rejected"] = state.get("rejected", 0) + len(rejected)
+            rejected = set(rejected)
+            save_rejects(rejects_path, file_format, [raw for raw, at in zip(raw_records, positions) if at in rejected])
+            save_checkpoint(checkpoint_path, state)
+            print(
+                f"{state['records']} records read, {state['imported']} imported, "
+                f"{state['skipped']} already registered, {state['failed']} failed"
+            )
+
+    finally:
+        if batch is not None:
+            batch[5].cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return state
@@ -1,21 +1,387 @@
-import mysql.connector
-from mysql.connector import pooling
-
-# MySQL connection pooling for performance
-connection_pool = pooling.MySQLConnectionPool(
-    pool_name="mypool",
-    pool_size=10,
-    pool_reset_session=True,
-    host="localhost",
-    database="findworkers",
-    user="root",
-    password="root"
-) 
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import os
+import time
+import mysql.connector.aio
+from fastapi import HTTPException, status
 
-# Dependency to get the connection for each request
-def get_db():
-    connection = connection_pool.get_connection()
+from metrics import Counter, Histogram, Observed
+from timing import current_timings, timed, TimedCursor
+
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": int(os.getenv("DB_PORT", "3306")),
+    "database": os.getenv("DB_NAME", "findworkers"),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", "root"),
+}
+
+## Connections kept open when idle, and the most the pool opens
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+
+## Seconds a request waits for a connection before getting a 503 (0 waits forever)
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5"))
+
+## Connections are closed once this old (seconds), or after sitting idle this long above the minimum.
+## Both stay below the server's wait_timeout (8 hours by default).
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+
+## Seconds between two passes pinging the idle connections (0 turns the checks off)
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+
+## Reset the session (variables, temporary tables, user locks) when a connection comes back.
+## With 0 only an open transaction is rolled back, saving a round trip per checkout.
+DB_POOL_RESET_SESSION = os.getenv("DB_POOL_RESET_SESSION", "1") == "1"
+
+## Seconds a client is told to wait when every connection is busy
+DB_POOL_RETRY_AFTER = 1
+
+
+## Pool metrics, the connection counts are read when scraped
+pool_acquire_seconds = Histogram(
+    "findworker_db_pool_acquire_seconds",
+    "Time to get a pooled connection (waiting for a free one or connecting)",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+pool_connections = Observed("findworker_db_pool_connections", "Pooled connections by state", labelnames=("state",))
+pool_errors = Counter(
+    "findworker_db_pool_errors_total", "Failed connects, broken connections dropped and acquire timeouts", ("kind",)
+)
+pool_recycled = Counter("findworker_db_pool_recycled_total", "Healthy connections closed by the pool", ("reason",))
+
+
+## Connection checked out of the async pool, it returns itself to the pool on close
+class PooledConnection:
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+        self._cursors = []
+
+    async def cursor(self, **kwargs):
+        cursor = await self._connection.cursor(**kwargs)
+        self._cursors.append(cursor)
+
+        # Statements are timed only while a request is being timed (REQUEST_TIMING)
+        timings = current_timings.get()
+        return cursor if timings is None else TimedCursor(cursor, timings)
+
+    async def commit(self):
+        with timed("db"):
+            await self._connection.commit()
+
+    async def rollback(self):
+        with timed("db"):
+            await self._connection.rollback()
+
+    async def close(self):
+        # Close the cursors opened during the checkout before handing the connection back
+        for cursor in self._cursors:
+            await cursor.close()
+        self._cursors.clear()
+        await self._pool.release(self._connection)
+
+    async def discard(self):
+        # Drop the connection instead of draining it (e.g. a streaming query stopped half way)
+        self._cursors.clear()
+        await self._pool.discard(self._connection)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+## Elastic async MySQL connection pool.
+## Keeps min_size connections open and grows up to max_size. When all are busy, callers queue
+## in arrival order and get a released connection handed over directly, or a 503 after
+## acquire_timeout. A background task pings idle connections and closes stale ones.
+class AsyncConnectionPool:
+    def __init__(
+        self,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        acquire_timeout: float = DB_POOL_ACQUIRE_TIMEOUT,
+        max_lifetime: float = DB_POOL_MAX_LIFETIME,
+        max_idle: float = DB_POOL_MAX_IDLE,
+        health_check_interval: float = DB_POOL_HEALTH_CHECK_INTERVAL,
+        pool_reset_session: bool = DB_POOL_RESET_SESSION,
+        **config,
+    ):
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout or None
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self.pool_reset_session = pool_reset_session
+        self.config = config
+
+        self._idle = deque()  # (connection, idle since), the most recently used on the right
+        self._waiters = deque()  # futures of the callers waiting, oldest on the left
+        self._created = {}  # connection -> time it was opened
+        self._opened = 0  # connections open or being opened
+        self._connecting = 0
+        self.in_use = 0
+        self._maintenance = None
+        self._tasks = set()
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def connecting(self) -> int:
+        return self._connecting
+
+    def start(self):
+        # Needs the running event loop: opens the minimum in the background and starts the health checks
+        if self._maintenance is None and self.health_check_interval > 0:
+            self._maintenance = asyncio.create_task(self._maintain())
+        self._replenish()
+
+    async def get_connection(self) -> PooledConnection:
+        self.start()
+
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.acquire_timeout):
+                connection = await self._acquire()
+        except TimeoutError:
+            pool_errors.inc("timeout")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Database is busy, please retry shortly",
+                headers={"Retry-After": str(DB_POOL_RETRY_AFTER)},
+            )
+
+        pool_acquire_seconds.observe(time.perf_counter() - start)
+        self.in_use += 1
+        return PooledConnection(self, connection)
+
+    async def _acquire(self):
+        # Most recently used first: the extra connections stay idle and the health checks close them
+        while self._idle:
+            connection, _ = self._idle.pop()
+            if not self._expired(connection):
+                return connection
+            await self._recycle(connection, "lifetime")
+
+        if self._opened < self.max_size:
+            return await self._connect()
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Timed out right after a connection was handed over, pass it on
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._hand_over(future.result())
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            if future in self._waiters:
+                self._waiters.remove(future)
+
+    async def _connect(self):
+        self._opened += 1
+        self._connecting += 1
+        try:
+            connection = await mysql.connector.aio.connect(**self.config)
+        except BaseException as e:
+            # Also on cancellation (acquire timeout, shutdown)
+            self._opened -= 1
+            if isinstance(e, Exception):
+                pool_errors.inc("connect")
+            raise
+        finally:
+            self._connecting -= 1
+
+        self._created[connection] = time.monotonic()
+        return connection
+
+    def _expired(self, connection) -> bool:
+        return time.monotonic() - self._created.get(connection, 0) > self.max_lifetime
+
+    def _hand_over(self, connection):
+        # The oldest waiter still waiting gets the connection, otherwise it goes back to the idle ones
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(connection)
+                return
+        self._idle.append((connection, time.monotonic()))
+
+    def _forget(self, connection):
+        self._opened -= 1
+        self._created.pop(connection, None)
+
+    def _replenish(self):
+        # Open connections for the callers waiting (a closed one freed a slot) and up to min_size.
+        # The slot is taken now, so calls made before the connect starts do not open more.
+        wanted = max(self.min_size - self._opened, len(self._waiters) - self._connecting)
+        for _ in range(min(wanted, self.max_size - self._opened)):
+            self._opened += 1
+            self._connecting += 1
+            task = asyncio.create_task(mysql.connector.aio.connect(**self.config))
+            self._tasks.add(task)
+            task.add_done_callback(self._spare_opened)
+
+    def _spare_opened(self, task):
+        self._tasks.discard(task)
+        self._connecting -= 1
+        if task.cancelled() or task.exception() is not None:
+            # The next checkout or health check tries again
+            self._opened -= 1
+            if not task.cancelled():
+                pool_errors.inc("connect")
+                # The oldest caller waiting gets the error rather than waiting for the timeout
+                while self._waiters:
+                    future = self._waiters.popleft()
+                    if not future.done():
+                        future.set_exception(task.exception())
+                        break
+            return
+
+        connection = task.result()
+        self._created[connection] = time.monotonic()
+        self._hand_over(connection)
+
+    async def _recycle(self, connection, reason: str):
+        self._forget(connection)
+        pool_recycled.inc(reason)
+        self._replenish()
+        try:
+            await connection.close()
+        except Exception:
+            pass
+
+    async def release(self, connection):
+        self.in_use -= 1
+        try:
+            if self.pool_reset_session:
+                await connection.cmd_reset_connection()
+            elif connection.in_transaction:
+                await connection.rollback()
+        except Exception:
+            # Broken connection, replace it so waiting requests are not left hanging
+            pool_errors.inc("broken")
+            await self._drop(connection)
+            return
+
+        if self._expired(connection):
+            await self._recycle(connection, "lifetime")
+            return
+
+        self._hand_over(connection)
+
+    async def discard(self, connection):
+        # Drop the connection instead of draining it (e.g. a streaming query stopped half way)
+        self.in_use -= 1
+        await self._drop(connection)
+
+    async def _drop(self, connection):
+        self._forget(connection)
+        self._replenish()
+        try:
+            # shutdown() closes the socket without reading what the server still sends
+            await connection.shutdown()
+        except Exception:
+            pass
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await self.check_idle()
+            except Exception as e:
+                print(f"Connection pool health check failed: {e}")
+
+    ## Function to close the stale idle connections and ping the ones unused since the last pass
+    async def check_idle(self):
+        now = time.monotonic()
+        for entry in list(self._idle):
+            # Checked out (or already closed) since the snapshot
+            if entry not in self._idle:
+                continue
+
+            connection, idle_since = entry
+            if self._expired(connection):
+                reason = "lifetime"
+            elif now - idle_since > self.max_idle and self._opened > self.min_size:
+                # The minimum stays open, pinged like the others
+                reason = "idle"
+            else:
+                reason = None
+
+            if reason is not None:
+                self._idle.remove(entry)
+                await self._recycle(connection, reason)
+            elif now - idle_since >= self.health_check_interval:
+                self._idle.remove(entry)
+                try:
+                    await connection.ping()
+                except Exception:
+                    pool_errors.inc("broken")
+                    await self._drop(connection)
+                    continue
+                # A ping keeps the connection alive but does not count as use for max_idle
+                if self._waiters:
+                    self._hand_over(connection)
+                else:
+                    self._idle.appendleft(entry)
+
+        self._replenish()
+
+    async def close(self):
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            try:
+                await self._maintenance
+            except asyncio.CancelledError:
+                pass
+            self._maintenance = None
+
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        while self._idle:
+            connection, _ = self._idle.popleft()
+            self._forget(connection)
+            await connection.close()
+
+
+# Async MySQL connection pooling for performance, sized and tuned through the DB_POOL_* settings
+connection_pool = AsyncConnectionPool(**DB_CONFIG)
+
+pool_connections.track(("in_use",), lambda: connection_pool.in_use)
+pool_connections.track(("idle",), lambda: connection_pool.idle)
+pool_connections.track(("connecting",), lambda: connection_pool.connecting)
+pool_connections.track(("waiting",), lambda: connection_pool.waiting)
+pool_connections.track(("min",), lambda: connection_pool.min_size)
+pool_connections.track(("max",), lambda: connection_pool.max_size)
+
+
+## Context manager checking out a pooled connection, for endpoints that only need one on some paths
+@asynccontextmanager
+async def pooled_connection():
+    with timed("pool"):
+        connection = await connection_pool.get_connection()
     try:
         yield connection
     finally:
-        connection.close()
+        await connection.close()
+
+
+# Dependency to get the connection for each request
+async def get_db():
+    async with pooled_connection() as connection:
+        yield connection
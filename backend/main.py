@@ -1,13 +1,33 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from database import connection_pool
+from auth.hashing import hashing_pool
+from users.utils import geolocation
 from users.views import user_router
 from workers.views import worker_router
 from auth.views import auth_router
 from search_workers.views import search_workers_router
-from notification import sse_router
+from notification import sse_router, start_notifications, stop_notifications
+from timing import REQUEST_TIMING, ServerTimingMiddleware
+from metrics import MetricsMiddleware, metrics_router
 
 
-app = FastAPI()
+## Start the notification broker, warm up the database pool and open the geolocation provider,
+## close them and the hashing processes on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_notifications()
+    connection_pool.start()
+    geolocation.start()
+    yield
+    await stop_notifications()
+    hashing_pool.shutdown()
+    await geolocation.aclose()
+    await connection_pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS settings
 origins = [
@@ -20,8 +40,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  
     allow_headers=["*"],  
+    expose_headers=["X-Next-Cursor", "X-Next-After-Id"],
 )
 
+## Request latency, status and error metrics per route (served by GET /metrics)
+app.add_middleware(MetricsMiddleware)
+
+## Per-request Server-Timing header and timing log lines (REQUEST_TIMING=1)
+if REQUEST_TIMING:
+    app.add_middleware(ServerTimingMiddleware)
+
 
 ## Register the auth router
 app.include_router(auth_router)
@@ -37,3 +65,6 @@ app.include_router(search_workers_router)
 
 ## Register the sse router
 app.include_router(sse_router)
+
+## Register the metrics router
+app.include_router(metrics_router)
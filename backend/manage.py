@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import statistics
+import time
+import mysql.connector.aio
+from passlib.hash import bcrypt
+
+from bulk_import import import_file, BATCH_SIZE
+from database import connection_pool, DB_CONFIG
+from migrate import migrate, migration_status
+from query_plans import check_query_plans, check_plans_database, QUERY_PLANS_DB_NAME
+from synthetic_data import PRESETS, DEFAULT_SEED, load_into_database, write_load_files
+from users.ip_ranges import build_range_file
+from workers.services import rebuild_rating_summary
+
+
+## Command: rebuild rating summaries from the ratings table
+async def rebuild_rating_summary_command(args):
+    connection = await connection_pool.get_connection()
+    try:
+        cursor = await connection.cursor()
+        rows = await rebuild_rating_summary(cursor, args.worker_id)
+        await connection.commit()
+        print(f"Rebuilt rating summary for {rows} worker(s)")
+    except Exception:
+        await connection.rollback()
+        raise
+    finally:
+        await connection.close()
+
+
+## Command: pick the highest bcrypt cost whose median hash time stays under the target
+async def calibrate_bcrypt_command(args):
+    chosen = None
+    for rounds in range(args.min_rounds, args.max_rounds + 1):
+        hasher = bcrypt.using(rounds=rounds)
+        timings = []
+        for _ in range(args.samples):
+            start = time.perf_counter()
+            hasher.hash("calibration-password")
+            timings.append((time.perf_counter() - start) * 1000)
+
+        median = statistics.median(timings)
+        print(f"rounds={rounds:2d}  median {median:8.1f} ms")
+        if median > args.target_ms:
+            break
+        chosen = rounds
+
+    if chosen is None:
+        print(f"Even {args.min_rounds} rounds take more than {args.target_ms} ms on this host")
+    else:
+        print(f"Set BCRYPT_ROUNDS={chosen}")
+
+
+## Command: stream users, profiles, workers and working areas from a JSONL or CSV file
+async def import_workers_command(args):
+    file_format = args.format or ("csv" if args.path.lower().endswith(".csv") else "jsonl")
+    checkpoint = args.checkpoint or f"{args.path}.checkpoint"
+    rejects = args.rejects or f"{args.path}.rejects"
+
+    connection = await connection_pool.get_connection()
+    try:
+        state = await import_file(connection, args.path, file_format, checkpoint, args.batch_size, rejects)
+        print(f"Import finished: {state['imported']} imported, {state['skipped']} already registered, {state['failed']} failed")
+        if state.get("rejected"):
+            print(f"{state['rejected']} record(s) rejected by the database, written to {rejects}")
+    finally:
+        await connection.close()
+
+
+## Command: convert a CSV IP range dump into the memory-mapped file of the offline geolocation provider
+async def build_ip_ranges_command(args):
+    count = build_range_file(args.csv_path, args.output)
+    print(f"Wrote {count} IPv4 ranges to {args.output}")
+
+
+## Command: apply the pending schema migrations
+async def migrate_command(args):
+    connection = await connection_pool.get_connection()
+    try:
+        if args.status:
+            for version, name, state in await migration_status(connection):
+                print(f"{version:04d}_{name}  {state}")
+            return
+
+        applied = await migrate(connection, args.target, args.dry_run)
+        print(f"{len(applied)} migration(s) {'pending' if args.dry_run else 'applied'}")
+    finally:
+        await connection.close()
+
+
+## Command: EXPLAIN the service layer queries on data seeded in a dedicated database,
+## fails on full scans, filesorts, temporary tables and plans changed from the snapshot
+async def check_query_plans_command(args):
+    check_plans_database(args.database)
+    if args.users < 1:
+        raise SystemExit("--users must be at least 1, only seeded rows are sampled")
+
+    connection = await mysql.connector.aio.connect(**{**DB_CONFIG, "database": args.database})
+    try:
+        await migrate(connection)
+        passed = await check_query_plans(connection, args.users, args.update_snapshot)
+    finally:
+        await connection.close()
+
+    if not passed:
+        raise SystemExit(1)
+
+
+## Command: generate the deterministic synthetic dataset, into MySQL or as LOAD DATA INFILE files
+async def generate_data_command(args):
+    users = args.users if args.users is not None else PRESETS[args.preset]
+    start = time.perf_counter()
+
+    if args.output:
+        counts = write_load_files(args.output, users, args.seed)
+    else:
+        connection = await connection_pool.get_connection()
+        try:
+            counts = await load_into_database(connection, users, args.seed)
+        finally:
+            await connection.close()
+
+    for table, count in counts.items():
+        print(f"{table:20s} {count:10d} rows")
+    destination = f"{args.output}/load.sql" if args.output else "the database"
+    print(f"Generated {users} users (seed {args.seed}) into {destination} in {time.perf_counter() - start:.1f} s")
+
+
+## Available commands
+COMMANDS = {
+    "rebuild-rating-summary": rebuild_rating_summary_command,
+    "calibrate-bcrypt": calibrate_bcrypt_command,
+    "import-workers": import_workers_command,
+    "build-ip-ranges": build_ip_ranges_command,
+    "migrate": migrate_command,
+    "check-query-plans": check_query_plans_command,
+    "generate-data": generate_data_command,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FindWorker management commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = subparsers.add_parser(
+        "rebuild-rating-summary", help="Rebuild rating summaries from the ratings table"
+    )
+    rebuild_parser.add_argument("--worker-id", type=int, default=None, help="Only rebuild this worker")
+
+    calibrate_parser = subparsers.add_parser(
+        "calibrate-bcrypt", help="Pick the bcrypt cost (BCRYPT_ROUNDS) for a target hash latency"
+    )
+    calibrate_parser.add_argument("--target-ms", type=float, default=250, help="Target time per hash")
+    calibrate_parser.add_argument("--samples", type=int, default=3, help="Hashes timed per cost")
+    calibrate_parser.add_argument("--min-rounds", type=int, default=4)
+    calibrate_parser.add_argument("--max-rounds", type=int, default=16)
+
+    import_parser = subparsers.add_parser(
+        "import-workers", help="Import users, profiles, workers and working areas from a JSONL or CSV file"
+    )
+    import_parser.add_argument("path", help="File to import")
+    import_parser.add_argument("--format", choices=["jsonl", "csv"], default=None, help="Defaults to the file extension")
+    import_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Records per transaction")
+    import_parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <path>.checkpoint)")
+    import_parser.add_argument("--rejects", default=None, help="File the records rejected by the database are appended to (default: <path>.rejects)")
+
+    ranges_parser = subparsers.add_parser(
+        "build-ip-ranges", help="Build the offline geolocation file from a CSV of start_ip,end_ip,city,latitude,longitude[,org]"
+    )
+    ranges_parser.add_argument("csv_path", help="CSV range dump")
+    ranges_parser.add_argument("--output", default="ip_ranges.bin", help="File to write (GEOLOCATION_RANGES_PATH)")
+
+    migrate_parser = subparsers.add_parser("migrate", help="Apply the pending schema migrations (migrations/ folder)")
+    migrate_parser.add_argument("--target", type=int, default=None, help="Stop after this version")
+    migrate_parser.add_argument("--dry-run", action="store_true", help="List what would be applied")
+    migrate_parser.add_argument("--status", action="store_true", help="Show applied, pending and changed migrations")
+
+    plans_parser = subparsers.add_parser("check-query-plans", help="Check the query plans of the service layer for regressions")
+    plans_parser.add_argument("--database", default=QUERY_PLANS_DB_NAME, help="Dedicated database to seed and explain in (created beforehand, never DB_NAME)")
+    plans_parser.add_argument("--users", type=int, default=20000, help="Users to seed for the check")
+    plans_parser.add_argument("--update-snapshot", action="store_true", help="Rewrite query_plans.json with the current plans (after reviewing them)")
+
+    data_parser = subparsers.add_parser("generate-data", help="Generate a deterministic synthetic dataset for scale tests")
+    data_parser.add_argument("--preset", choices=PRESETS, default="small", help="Dataset size (users)")
+    data_parser.add_argument("--users", type=int, default=None, help="Exact number of users, overrides --preset")
+    data_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    data_parser.add_argument("--output", default=None, help="Write .tsv files and load.sql to this folder instead of inserting")
+
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            await COMMANDS[args.command](args)
+        finally:
+            await connection_pool.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
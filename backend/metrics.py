@@ -0,0 +1,178 @@
+## Prometheus metrics, served as text by GET /metrics
+##
+## Counters and histograms are plain Python numbers updated on the event loop thread, so
+## recording takes no lock. Gauges describing internal state (pool, SSE hubs, caches) are
+## read from their owners when scraped, the hot path does nothing for them.
+## Each worker process serves its own numbers, scrape every process (or add a pid label).
+from bisect import bisect_left
+import time
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from timing import TimedRoute
+
+
+## Default latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+## All registered metrics, in exposition order
+REGISTRY = []
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames, labels, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+## Monotonic counter per label values
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in list(self.values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+
+
+## Histogram per label values: a count per bucket (not cumulative until exposition), sum and count
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.children = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        child = self.children.get(labels)
+        if child is None:
+            child = self.children[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        # Bucket "le" counts the values lower than or equal to its bound, the last one is +Inf
+        child[0][bisect_left(self.buckets, value)] += 1
+        child[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in list(self.children.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames, labels, 'le="' + str(bound) + '"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}"
+
+
+## Values read from their owner at scrape time, one reader per label values
+class Observed:
+    def __init__(self, name: str, documentation: str, type: str = "gauge", labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.labelnames = tuple(labelnames)
+        self.readers = {}
+        REGISTRY.append(self)
+
+    def track(self, labels, read):
+        self.readers[tuple(labels)] = read
+
+    def samples(self):
+        for labels, read in list(self.readers.items()):
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {read()}"
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+request_duration = Histogram(
+    "findworker_http_request_duration_seconds",
+    "Time to the response headers (stream set-up for SSE and NDJSON), by route",
+    ("method", "route"),
+)
+responses_total = Counter(
+    "findworker_http_responses_total", "Responses sent, by route and status", ("method", "route", "status")
+)
+exceptions_total = Counter(
+    "findworker_http_exceptions_total", "Unhandled exceptions (answered 500), by route", ("method", "route", "exception")
+)
+requests_in_flight = Observed("findworker_http_requests_in_flight", "Requests being handled")
+
+## Families the caches report into (see the modules owning them)
+cache_entries = Observed("findworker_cache_entries", "Entries held by the in-process caches", labelnames=("cache",))
+cache_events = Observed(
+    "findworker_cache_events_total", "Cache lookups and removals, by result", type="counter", labelnames=("cache", "event")
+)
+
+
+## ASGI middleware recording latency, status and errors per route template
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = 0
+        requests_in_flight.track((), lambda: self.in_flight)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = None
+
+        async def send_with_metrics(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                request_duration.observe(time.perf_counter() - start, scope["method"], route_of(scope))
+            await send(message)
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        except Exception as e:
+            exceptions_total.inc(scope["method"], route_of(scope), type(e).__name__)
+            if status_code is None:
+                status_code = 500
+                request_duration.observe(time.perf_counter() - start, scope["method"], route_of(scope))
+            raise
+        finally:
+            self.in_flight -= 1
+            responses_total.inc(scope["method"], route_of(scope), str(status_code))
+
+
+def route_of(scope) -> str:
+    # The router leaves the matched route in the scope, its template keeps the label set small
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+metrics_router = APIRouter(route_class=TimedRoute)
+
+
+## GET Endpoint: Metrics in the Prometheus text format
+@metrics_router.get("/metrics", tags=["Metrics"], include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
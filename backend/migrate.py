@@ -0,0 +1,133 @@
+## Versioned schema migrations
+##
+## Migrations are the NNNN_name.sql files of the migrations folder, applied in version order.
+## Applied versions are recorded in schema_migrations with the checksum of their file.
+## MySQL commits every DDL statement on its own, so a migration stopped half way is simply
+## applied again: statements whose object already exists are skipped, which also lets the
+## runner adopt a database created by hand from sql_queries.txt.
+import hashlib
+import os
+import re
+import mysql.connector
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+## Only one runner at a time (MySQL named lock)
+MIGRATION_LOCK = "findworker_schema_migrations"
+MIGRATION_LOCK_TIMEOUT = 60
+
+## Errors meaning the statement was already applied: table, column, index, foreign key or check constraint exists
+ALREADY_APPLIED_ERRORS = {1050, 1060, 1061, 1826, 3822}
+
+
+## Function to list the migration files as (version, name, path), in version order
+def discover_migrations(directory: str = MIGRATIONS_DIR):
+    migrations = []
+    for file_name in os.listdir(directory):
+        match = MIGRATION_FILE.match(file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, file_name)))
+
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Two migrations share a version in {directory}")
+    return migrations
+
+
+## Function to split a migration file into statements (one per ';' ending a line, '--' comments dropped)
+def split_statements(sql: str):
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    statements = re.split(r";\s*$", "\n".join(lines), flags=re.MULTILINE)
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def checksum(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+## Helper function to create the migrations table and read the applied versions {version: checksum}
+async def applied_migrations(cursor):
+    await cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+          version INT NOT NULL PRIMARY KEY,
+          name varchar(255) NOT NULL,
+          checksum char(64) NOT NULL,
+          applied_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    await cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(await cursor.fetchall())
+
+
+## Function to list every migration with its state: applied, pending or changed (file edited after it was applied)
+async def migration_status(connection, directory: str = MIGRATIONS_DIR):
+    cursor = await connection.cursor()
+    applied = await applied_migrations(cursor)
+
+    status = []
+    for version, name, path in discover_migrations(directory):
+        with open(path, encoding="utf-8") as file:
+            file_checksum = checksum(file.read())
+
+        if version not in applied:
+            state = "pending"
+        elif applied[version] != file_checksum:
+            state = "changed"
+        else:
+            state = "applied"
+        status.append((version, name, state))
+    return status
+
+
+## Function to apply the pending migrations up to `target` (all when None), returns the versions applied
+async def migrate(connection, target: int | None = None, dry_run: bool = False, directory: str = MIGRATIONS_DIR):
+    cursor = await connection.cursor()
+
+    await cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT))
+    if (await cursor.fetchone())[0] != 1:
+        raise RuntimeError("Another migration run holds the lock")
+
+    try:
+        applied = await applied_migrations(cursor)
+        done = []
+
+        for version, name, path in discover_migrations(directory):
+            if target is not None and version > target:
+                break
+            if version in applied:
+                continue
+
+            with open(path, encoding="utf-8") as file:
+                sql = file.read()
+
+            print(f"{'Would apply' if dry_run else 'Applying'} {version:04d}_{name}")
+            if dry_run:
+                done.append(version)
+                continue
+
+            for statement in split_statements(sql):
+                try:
+                    await cursor.execute(statement)
+                except mysql.connector.Error as e:
+                    if e.errno not in ALREADY_APPLIED_ERRORS:
+                        raise
+                    print(f"  skipped, already applied: {e.msg}")
+
+            await cursor.execute(
+                "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                (version, name, checksum(sql)),
+            )
+            await connection.commit()
+            done.append(version)
+
+        return done
+
+    finally:
+        await cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+        await cursor.fetchall()
@@ -0,0 +1,82 @@
+-- Tables of the original schema: the ones of sql_queries.txt as first written, plus ratings
+-- and contact, which the code used but the file did not list (now added to it).
+-- Later changes (rating_summary, claims_version, the ratings constraints, indexes) are the
+-- following migrations.
+CREATE TABLE IF NOT EXISTS users (
+  id int NOT NULL AUTO_INCREMENT,
+  email varchar(255) NOT NULL,
+  password varchar(255) NOT NULL,
+  created_at timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (id),
+  UNIQUE KEY email (email)
+);
+
+CREATE TABLE IF NOT EXISTS profile (
+  id int NOT NULL AUTO_INCREMENT,
+  user_id int NOT NULL,
+  first_name varchar(100) DEFAULT NULL,
+  last_name varchar(100) DEFAULT NULL,
+  phone_number varchar(20) DEFAULT NULL,
+  gender varchar(20) DEFAULT NULL,
+  location varchar(255) DEFAULT NULL,
+  longitude varchar(255) DEFAULT NULL,
+  latitude varchar(255) DEFAULT NULL,
+  role varchar(30) DEFAULT NULL,
+  city varchar(255) DEFAULT NULL,
+  created_at timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (id),
+  UNIQUE KEY user_id (user_id),
+  CONSTRAINT profile_ibfk_1 FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS worker (
+  id int NOT NULL AUTO_INCREMENT,
+  profile_id int NOT NULL,
+  created_at timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (id),
+  UNIQUE KEY profile_id (profile_id),
+  CONSTRAINT worker_ibfk_1 FOREIGN KEY (profile_id) REFERENCES profile (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS worker_requests (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  user_id INT NOT NULL,
+  worker_id INT NOT NULL,
+  status varchar(20) DEFAULT NULL,
+  request_time timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  response_time timestamp NULL DEFAULT NULL,
+  KEY fk_user (user_id),
+  KEY fk_worker (worker_id),
+  CONSTRAINT fk_user FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+  CONSTRAINT fk_worker FOREIGN KEY (worker_id) REFERENCES worker (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS working_area_info (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  name varchar(100) DEFAULT NULL,
+  rate_type varchar(50) DEFAULT NULL,
+  rate INT DEFAULT NULL,
+  description varchar(255) DEFAULT NULL,
+  worker_id INT DEFAULT NULL,
+  created_at timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  KEY worker_id (worker_id),
+  CONSTRAINT working_area_info_ibfk_1 FOREIGN KEY (worker_id) REFERENCES worker (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS ratings (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  user_id INT NOT NULL,
+  worker_id INT NOT NULL,
+  stars INT NOT NULL,
+  created_at timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT ratings_ibfk_1 FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+  CONSTRAINT ratings_ibfk_2 FOREIGN KEY (worker_id) REFERENCES worker (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS contact (
+  id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+  email varchar(255) NOT NULL,
+  subject varchar(255) DEFAULT NULL,
+  message text,
+  created_at timestamp NULL DEFAULT CURRENT_TIMESTAMP
+);
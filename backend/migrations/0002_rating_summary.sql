@@ -0,0 +1,13 @@
+-- Per-worker rating aggregates, kept up to date by the rating endpoints.
+-- Existing ratings are folded in by `python manage.py rebuild-rating-summary`.
+CREATE TABLE IF NOT EXISTS rating_summary (
+  worker_id INT NOT NULL PRIMARY KEY,
+  rating_count INT NOT NULL DEFAULT 0,
+  rating_sum INT NOT NULL DEFAULT 0,
+  stars_1 INT NOT NULL DEFAULT 0,
+  stars_2 INT NOT NULL DEFAULT 0,
+  stars_3 INT NOT NULL DEFAULT 0,
+  stars_4 INT NOT NULL DEFAULT 0,
+  stars_5 INT NOT NULL DEFAULT 0,
+  CONSTRAINT rating_summary_ibfk_1 FOREIGN KEY (worker_id) REFERENCES worker (id) ON DELETE CASCADE
+);
@@ -0,0 +1,2 @@
+-- Version of the identity claims carried by a user's tokens
+ALTER TABLE users ADD COLUMN claims_version INT NOT NULL DEFAULT 0 AFTER password;
@@ -0,0 +1,17 @@
+-- City search: equality on city and role, rows read in users.id order (keyset pages)
+CREATE INDEX idx_profile_city_role_user ON profile (city, role, user_id);
+
+-- Role only filters (geo index load, searches of callers without a city)
+CREATE INDEX idx_profile_role_user ON profile (role, user_id);
+
+-- Working area filters checked per worker (EXISTS in the search), covering
+CREATE INDEX idx_wai_worker_filters ON working_area_info (worker_id, name, rate_type, rate);
+
+-- Working area filters driving the search from the trade (name, then rate type and rate range)
+CREATE INDEX idx_wai_name_type_rate ON working_area_info (name, rate_type, rate, worker_id);
+
+-- Ratings of a worker (summary rebuild), covering the stars
+CREATE INDEX idx_ratings_worker_stars ON ratings (worker_id, stars);
+
+-- Pending request check of a user for a worker, covering the status
+CREATE INDEX idx_requests_user_worker_status ON worker_requests (user_id, worker_id, status);
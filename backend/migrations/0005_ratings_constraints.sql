@@ -0,0 +1,6 @@
+-- One rating per user and worker (duplicates answer 409), stars from 1 to 5.
+-- Fails on a database already holding duplicate ratings: keep one row per (user_id, worker_id),
+-- run this again, then python manage.py rebuild-rating-summary.
+ALTER TABLE ratings ADD UNIQUE KEY user_worker (user_id, worker_id);
+
+ALTER TABLE ratings ADD CONSTRAINT ratings_chk_stars CHECK (stars BETWEEN 1 AND 5);
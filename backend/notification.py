@@ -1,56 +1,200 @@
 from fastapi.responses import StreamingResponse
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+import asyncio
 import time
+from broker import create_broker
+from metrics import Observed
+from timing import TimedRoute
 
 
-## Global dictionary to hold worker notifications
-worker_notifications = {}
+## Seconds between heartbeat comments sent to an idle SSE client
+HEARTBEAT_INTERVAL = 15
 
-## Global dictionary to hold user notifications
-user_notifications = {}
+## Maximum number of undelivered notifications kept per subscriber
+SUBSCRIBER_QUEUE_SIZE = 100
 
-sse_router = APIRouter()
+## Seconds a notification waits for a subscriber before the reaper drops it
+PENDING_TTL = 300
+
+
+## A connected SSE client, it owns a bounded queue that is woken on publish
+class Subscriber:
+    def __init__(self, key: int):
+        self.key = key
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def put(self, notification: str) -> bool:
+        # Drop the oldest notification when a slow client lets its queue fill up
+        dropped = self.queue.full()
+        if dropped:
+            self.queue.get_nowait()
+        self.queue.put_nowait(notification)
+        return dropped
+
+
+## Notification hub: fans out published notifications to the subscribers of a key.
+## With a shared broker the backlog for keys without a subscriber lives in the broker log,
+## so a client reconnecting to another process gets each notification once.
+class NotificationHub:
+    def __init__(self, channel: str, broker):
+        self.channel = channel
+        self.broker = broker
+        self.subscribers = {}
+        self.pending = {}
+        self.last_reap = time.monotonic()
+        self.dropped = 0
+
+    def subscribe(self, key: int) -> Subscriber:
+        subscriber = Subscriber(key)
+        self.subscribers.setdefault(key, set()).add(subscriber)
+
+        # Deliver notifications published while nobody was listening
+        for _, notification in self.pending.pop(key, []):
+            subscriber.put(notification)
+
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self.subscribers.get(subscriber.key)
+        if subscribers is None:
+            return
+
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self.subscribers[subscriber.key]
+
+    ## Returns whether a local subscriber got the notification
+    def publish(self, key: int, notification: str) -> bool:
+        subscribers = self.subscribers.get(key)
+        if subscribers:
+            for subscriber in subscribers:
+                if subscriber.put(notification):
+                    self.dropped += 1
+            return True
+
+        if self.broker.shared:
+            return False
+
+        # Keep a bounded backlog for a client that reconnects shortly after
+        pending = self.pending.setdefault(key, [])
+        pending.append((time.monotonic(), notification))
+        del pending[:-SUBSCRIBER_QUEUE_SIZE]
+        self.reap()
+        return False
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+    def queued_count(self) -> int:
+        # Notifications published but not yet written to their client
+        return sum(subscriber.queue.qsize() for subscribers in self.subscribers.values() for subscriber in subscribers)
+
+    def pending_count(self) -> int:
+        return sum(len(pending) for pending in self.pending.values())
+
+    def reap(self):
+        # Forget backlogs nobody came back for, so the hub does not grow without bound
+        now = time.monotonic()
+        if now - self.last_reap < HEARTBEAT_INTERVAL:
+            return
+        self.last_reap = now
+
+        expired_before = now - PENDING_TTL
+        for key in list(self.pending):
+            self.pending[key] = [
+                item for item in self.pending[key] if item[0] >= expired_before
+            ]
+            if not self.pending[key]:
+                del self.pending[key]
+
+    async def event_stream(self, request: Request, key: int):
+        subscriber = self.subscribe(key)
+        try:
+            for notification in (await self.broker.replay(self.channel, key))[-SUBSCRIBER_QUEUE_SIZE:]:
+                subscriber.put(notification)
+
+            while True:
+                try:
+                    notification = await asyncio.wait_for(
+                        subscriber.queue.get(), timeout=HEARTBEAT_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    # Stop streaming once the client has gone away
+                    if await request.is_disconnected():
+                        break
+                    self.reap()
+                    yield ": heartbeat\n\n"
+                    continue
 
-## Event Stream Function for worker notification
-def event_stream_worker(worker_id: int):
-    while True:
-        # Check if there are any notifications for the worker
-        if worker_notifications.get(worker_id):
-            while worker_notifications[worker_id]:
-                notification = worker_notifications[worker_id].pop(0)
                 yield f"data: {notification}\n\n"
-        time.sleep(5)  # Heartbeat to keep connection alive
+        finally:
+            self.unsubscribe(subscriber)
+
+
+## Broker carrying notifications between processes (see broker.py)
+broker = create_broker()
+
+## Hub holding worker notifications (keyed by worker id)
+worker_hub = NotificationHub("worker", broker)
+
+## Hub holding user notifications (keyed by request id)
+user_hub = NotificationHub("user", broker)
+
+## Hubs by channel name, the broker routes published notifications to them
+hubs = {
+    "worker": worker_hub,
+    "user": user_hub,
+}
+
+## SSE metrics, read from the hubs when scraped
+sse_subscribers = Observed("findworker_sse_subscribers", "Connected SSE clients", labelnames=("channel",))
+sse_queued = Observed("findworker_sse_queued_notifications", "Notifications waiting in subscriber queues", labelnames=("channel",))
+sse_pending = Observed("findworker_sse_pending_notifications", "Notifications kept for keys without a subscriber", labelnames=("channel",))
+sse_dropped = Observed(
+    "findworker_sse_dropped_notifications_total", "Notifications dropped by full subscriber queues",
+    type="counter", labelnames=("channel",),
+)
+for channel, hub in hubs.items():
+    sse_subscribers.track((channel,), hub.subscriber_count)
+    sse_queued.track((channel,), hub.queued_count)
+    sse_pending.track((channel,), hub.pending_count)
+    sse_dropped.track((channel,), lambda hub=hub: hub.dropped)
+
+sse_router = APIRouter(route_class=TimedRoute)
+
+
+## Function to deliver a notification from the broker to the local hub
+def deliver_notification(channel: str, key: int, notification: str) -> bool:
+    return hubs[channel].publish(key, notification)
+
+
+## Function to publish a notification to every process through the broker.
+## Callers publish after their commit, so a broker failure (a locked SQLite log...) is logged
+## rather than failing a request whose write is already done.
+async def publish_notification(channel: str, key: int, notification: str):
+    try:
+        await broker.publish(channel, key, notification)
+    except Exception as e:
+        print(f"Notification publish failed on {channel} {key}: {e}")
+
+
+async def start_notifications():
+    await broker.start(deliver_notification)
+
+
+async def stop_notifications():
+    await broker.stop()
 
 
 ## SSE Endpoint for Worker to listen to real-time notifications
 @sse_router.get("/sse/worker/{worker_id}", tags=["SSE"])
-async def worker_sse(worker_id: int):
-    # Register worker if not already in the worker notifications dictionary
-    if worker_id not in worker_notifications:
-        worker_notifications[worker_id] = []
-        
+async def worker_sse(worker_id: int, request: Request):
     # Start streaming worker notifications
-    return StreamingResponse(event_stream_worker(worker_id), media_type="text/event-stream")
-
-
-## Event Stream Function for user notification 
-def event_stream_user(request_id: int):
-    while True:
-        # Check if there are any notifications for the user
-        if user_notifications.get(request_id):
-            while user_notifications[request_id]:
-                notification = user_notifications[request_id].pop(0)
-                yield f"data: {notification}\n\n"
-        time.sleep(5)  # Heartbeat to keep connection alive
+    return StreamingResponse(worker_hub.event_stream(request, worker_id), media_type="text/event-stream")
 
 
-## SSE Endpoint for User to listen to real-time notifications 
+## SSE Endpoint for User to listen to real-time notifications
 @sse_router.get("/sse/user/{request_id}", tags=["SSE"])
-async def user_sse(request_id: int):
-    # Register worker in not already in the user notifications dictionary
-    if request_id not in user_notifications:
-        user_notifications[request_id] = []
-        
+async def user_sse(request_id: int, request: Request):
     # Start streaming user notifications
-    return StreamingResponse(event_stream_user(request_id), media_type="text/event-stream")
-    
\ No newline at end of file
+    return StreamingResponse(user_hub.event_stream(request, request_id), media_type="text/event-stream")
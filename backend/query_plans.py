@@ -0,0 +1,458 @@
+## Query plan regression check for the SQL of the service layer
+##
+## Every case below calls service functions through a recording cursor, against a database
+## seeded with representative volumes, and the recorded statements are run again under EXPLAIN.
+## A plan fails when it reads a large number of rows through a full table or index scan,
+## a filesort or a temporary table. The reviewed plans are committed in query_plans.json, as the
+## statements of each case and the index every table is read through: a case that differs from
+## it, or a missing snapshot, fails the check too. After reviewing a change,
+## --update-snapshot rewrites the file (commit it with the change).
+##
+## Data comes from the synthetic dataset generator (skewed cities and trades, see synthetic_data.py).
+## It runs in its own database, never the application one (DB_NAME): the command migrates it,
+## seeds it, samples the seeded rows only and removes them again, even when a step fails.
+## Run from the backend folder against a local MySQL instance:
+##     python manage.py check-query-plans [--database findworkers_plans] [--users 20000] [--update-snapshot]
+import json
+import os
+import re
+from types import SimpleNamespace
+
+from database import DB_CONFIG
+from auth.services import fetch_identity, fetch_claims_version, bump_claims_version
+from synthetic_data import load_into_database
+from search_workers.services import (
+    fetch_city_workers_page,
+    fetch_workers_in_city,
+    fetch_matching_worker_ids,
+    fetch_workers_by_ids,
+)
+from users.services import (
+    USER_FIELDS,
+    email_exists,
+    users_page_query,
+    list_users_page,
+    fetch_profile,
+    delete_user_profile,
+    update_live_address,
+    switch_user_role,
+)
+from workers.schemas import WorkingAreaInfoBatch
+from workers.services import (
+    get_working_area_info,
+    check_worker_info,
+    delete_working_area_info,
+    apply_working_area_batch,
+    fetch_worker_by_id,
+    get_existing_request,
+    get_worker_request_status,
+    update_worker_request_status,
+    get_user_rating,
+    get_rating_summary,
+    rebuild_rating_summary,
+)
+
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_plans.json")
+
+## A plan step reading at least this many rows (EXPLAIN estimate) counts as a large table
+LARGE_TABLE_ROWS = 1000
+
+## Database the check seeds and explains in, it must not be the application database
+QUERY_PLANS_DB_NAME = os.getenv("QUERY_PLANS_DB_NAME", "findworkers_plans")
+
+## Seeded rows are recognised by this email domain, sampled alone and removed at the end
+SEED_DOMAIN = "plans.invalid"
+SEED_PATTERN = f"%@{SEED_DOMAIN}"
+SEED = 20
+
+
+## Cursor recording the statements it runs, (operation, params) with the first row for executemany
+class RecordingCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.statements = []
+
+    async def execute(self, operation, params=()):
+        self.statements.append((operation, tuple(params or ())))
+        return await self._cursor.execute(operation, params)
+
+    async def executemany(self, operation, seq_params):
+        seq_params = list(seq_params)
+        if seq_params:
+            self.statements.append((operation, tuple(seq_params[0])))
+        return await self._cursor.executemany(operation, seq_params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+## Registered cases: (name, dictionary cursor, coroutine function(cursor, sample), plan issues allowed as {(table, issue)})
+CASES = []
+
+
+def plan_case(name: str, dictionary: bool = True, allow=()):
+    def register(function):
+        CASES.append((name, dictionary, function, set(allow)))
+        return function
+    return register
+
+
+@plan_case("auth.fetch_identity")
+async def case_fetch_identity(cursor, sample):
+    await fetch_identity(cursor, sample["worker_user_id"])
+
+
+@plan_case("auth.fetch_claims_version", dictionary=False)
+async def case_fetch_claims_version(cursor, sample):
+    await fetch_claims_version(cursor, sample["worker_user_id"])
+
+
+@plan_case("auth.bump_claims_version")
+async def case_bump_claims_version(cursor, sample):
+    await bump_claims_version(cursor, sample["worker_user_id"])
+
+
+@plan_case("users.email_exists")
+async def case_email_exists(cursor, sample):
+    await email_exists(cursor, sample["caller"]["email"])
+
+
+@plan_case("users.list_users_page")
+async def case_list_users_page(cursor, sample):
+    await list_users_page(cursor, USER_FIELDS, sample["caller"]["id"], 100)
+
+
+# Streaming every user reads the whole table on purpose, in primary key order
+@plan_case("users.stream_users", allow={("users", "full scan")})
+async def case_stream_users(cursor, sample):
+    await cursor.execute(*users_page_query(USER_FIELDS, None, None))
+    await cursor.fetchall()
+
+
+@plan_case("users.fetch_profile")
+async def case_fetch_profile(cursor, sample):
+    await fetch_profile(cursor, sample["caller"])
+
+
+@plan_case("users.update_live_address")
+async def case_update_live_address(cursor, sample):
+    await update_live_address(cursor, sample["caller"], sample["city"], "somewhere", "0", "0")
+
+
+@plan_case("users.switch_user_role")
+async def case_switch_user_role(cursor, sample):
+    await switch_user_role(cursor, sample["caller"], "Worker")
+
+
+@plan_case("users.delete_user_profile")
+async def case_delete_user_profile(cursor, sample):
+    await delete_user_profile(cursor, sample["caller"])
+
+
+@plan_case("search.fetch_city_workers_page")
+async def case_fetch_city_workers_page(cursor, sample):
+    await fetch_city_workers_page(cursor, sample["caller"], {}, None, 0, 20)
+
+
+@plan_case("search.fetch_city_workers_page.filtered")
+async def case_fetch_city_workers_page_filtered(cursor, sample):
+    await fetch_city_workers_page(cursor, sample["caller"], sample["filters"], sample["caller"]["id"], 0, 20)
+
+
+@plan_case("search.fetch_workers_in_city")
+async def case_fetch_workers_in_city(cursor, sample):
+    await fetch_workers_in_city(cursor, sample["city"], {}, None, 20)
+
+
+@plan_case("search.fetch_workers_in_city.filtered")
+async def case_fetch_workers_in_city_filtered(cursor, sample):
+    await fetch_workers_in_city(cursor, sample["city"], sample["filters"], None, 20)
+
+
+@plan_case("search.fetch_matching_worker_ids")
+async def case_fetch_matching_worker_ids(cursor, sample):
+    await fetch_matching_worker_ids(cursor, sample["caller"], sample["filters"], sample["city_user_ids"])
+
+
+@plan_case("search.fetch_workers_by_ids")
+async def case_fetch_workers_by_ids(cursor, sample):
+    await fetch_workers_by_ids(cursor, sample["city_user_ids"])
+
+
+@plan_case("workers.get_working_area_info")
+async def case_get_working_area_info(cursor, sample):
+    await get_working_area_info(cursor, sample["worker_id"])
+
+
+@plan_case("workers.check_worker_info")
+async def case_check_worker_info(cursor, sample):
+    await check_worker_info(cursor, sample["worker_id"], SimpleNamespace(id=sample["area_ids"][0]))
+
+
+@plan_case("workers.delete_working_area_info")
+async def case_delete_working_area_info(cursor, sample):
+    await delete_working_area_info(cursor, sample["area_ids"][0], sample["worker_id"])
+
+
+@plan_case("workers.apply_working_area_batch", dictionary=False)
+async def case_apply_working_area_batch(cursor, sample):
+    area_ids = sample["area_ids"]
+    batch = WorkingAreaInfoBatch(
+        update=[{"id": area_ids[0], "name": None, "rate_type": None, "rate": 500, "description": None}],
+        delete=area_ids[1:],
+    )
+    await apply_working_area_batch(cursor, sample["worker_id"], batch)
+
+
+@plan_case("workers.fetch_worker_by_id")
+async def case_fetch_worker_by_id(cursor, sample):
+    await fetch_worker_by_id(cursor, sample["worker_id"])
+
+
+@plan_case("workers.get_existing_request")
+async def case_get_existing_request(cursor, sample):
+    await get_existing_request(cursor, sample["caller"]["id"], sample["worker_id"])
+
+
+@plan_case("workers.get_worker_request_status")
+async def case_get_worker_request_status(cursor, sample):
+    await get_worker_request_status(cursor, sample["request_id"])
+
+
+@plan_case("workers.update_worker_request_status")
+async def case_update_worker_request_status(cursor, sample):
+    await update_worker_request_status(cursor, sample["request_id"], "Accepted")
+
+
+@plan_case("workers.get_user_rating")
+async def case_get_user_rating(cursor, sample):
+    await get_user_rating(cursor, sample["rater_id"], sample["worker_id"])
+
+
+@plan_case("workers.get_rating_summary")
+async def case_get_rating_summary(cursor, sample):
+    await get_rating_summary(cursor, sample["worker_id"])
+
+
+@plan_case("workers.rebuild_rating_summary")
+async def case_rebuild_rating_summary(cursor, sample):
+    await rebuild_rating_summary(cursor, sample["worker_id"])
+
+
+# The full rebuild (manage.py command) aggregates every rating on purpose
+@plan_case("workers.rebuild_rating_summary.all", allow={("ratings", "full scan"), ("rating_summary", "full scan")})
+async def case_rebuild_all_rating_summaries(cursor, sample):
+    await rebuild_rating_summary(cursor)
+
+
+## Function to seed the synthetic dataset, with fresh statistics for the optimizer
+async def seed_plan_data(connection, users: int):
+    await load_into_database(connection, users, SEED, SEED_DOMAIN)
+
+    cursor = await connection.cursor()
+    for table in ("users", "profile", "worker", "working_area_info", "ratings", "worker_requests", "rating_summary"):
+        await cursor.execute(f"ANALYZE TABLE {table}")
+        await cursor.fetchall()
+
+
+async def remove_plan_data(connection):
+    # A failed seed or case may have left a transaction open
+    await connection.rollback()
+    cursor = await connection.cursor()
+    # Profiles, workers, working areas, ratings and requests go with the users (ON DELETE CASCADE)
+    await cursor.execute("DELETE FROM users WHERE email LIKE %s", (SEED_PATTERN,))
+    await connection.commit()
+
+
+## Function to check the database the plans are explained in, seeding the application database is refused
+def check_plans_database(database: str):
+    if database == DB_CONFIG["database"]:
+        raise RuntimeError(
+            f"Refusing to seed the application database {database!r}, "
+            "use a dedicated one (--database or QUERY_PLANS_DB_NAME)"
+        )
+
+
+## Function to pick the ids the cases run with, among the seeded rows only:
+## a user of the largest city and a rated worker with requests there
+async def pick_sample(connection):
+    cursor = await connection.cursor(dictionary=True)
+
+    await cursor.execute(
+        "SELECT profile.city FROM profile JOIN users ON users.id = profile.user_id "
+        "WHERE profile.role = 'Worker' AND users.email LIKE %s "
+        "GROUP BY profile.city ORDER BY COUNT(*) DESC LIMIT 1",
+        (SEED_PATTERN,),
+    )
+    row = await cursor.fetchone()
+    if row is None:
+        raise RuntimeError("No seeded workers in the database, raise --users")
+    city = row["city"]
+
+    await cursor.execute(
+        "SELECT users.id, users.email FROM users JOIN profile ON profile.user_id = users.id "
+        "WHERE profile.city = %s AND profile.role = 'User' AND users.email LIKE %s LIMIT 1",
+        (city, SEED_PATTERN),
+    )
+    caller = await cursor.fetchone()
+
+    await cursor.execute(
+        """
+        SELECT worker.id AS worker_id, profile.user_id, MIN(ratings.user_id) AS rater_id, MIN(worker_requests.id) AS request_id
+        FROM worker
+        JOIN profile ON profile.id = worker.profile_id
+        JOIN users ON users.id = profile.user_id
+        JOIN ratings ON ratings.worker_id = worker.id
+        JOIN users AS raters ON raters.id = ratings.user_id
+        JOIN worker_requests ON worker_requests.worker_id = worker.id
+        WHERE profile.city = %s AND users.email LIKE %s AND raters.email LIKE %s
+            AND (SELECT COUNT(*) FROM working_area_info WHERE working_area_info.worker_id = worker.id) >= 2
+        GROUP BY worker.id, profile.user_id
+        LIMIT 1
+        """,
+        (city, SEED_PATTERN, SEED_PATTERN),
+    )
+    worker = await cursor.fetchone()
+    if caller is None or worker is None:
+        raise RuntimeError(f"No seeded user, rated worker and request found in {city}, raise --users")
+
+    await cursor.execute(
+        "SELECT id, name, rate_type FROM working_area_info WHERE worker_id = %s ORDER BY id", (worker["worker_id"],)
+    )
+    areas = await cursor.fetchall()
+
+    await cursor.execute(
+        "SELECT profile.user_id FROM profile JOIN users ON users.id = profile.user_id "
+        "WHERE profile.city = %s AND profile.role = 'Worker' AND users.email LIKE %s ORDER BY profile.user_id LIMIT 50",
+        (city, SEED_PATTERN),
+    )
+    city_user_ids = [row["user_id"] for row in await cursor.fetchall()]
+
+    return {
+        "city": city,
+        "caller": caller,
+        "worker_id": worker["worker_id"],
+        "worker_user_id": worker["user_id"],
+        "rater_id": worker["rater_id"],
+        "request_id": worker["request_id"],
+        "area_ids": [area["id"] for area in areas],
+        "city_user_ids": city_user_ids,
+        "filters": {
+            "working_area_name": areas[0]["name"],
+            "rate_type": areas[0]["rate_type"],
+            "min_rate": 100,
+            "max_rate": 1500,
+            "gender": "Female",
+        },
+    }
+
+
+## Function to list the problems of an EXPLAIN result as [(table, issue)]
+def plan_issues(plan):
+    issues = []
+    for step in plan:
+        rows = step["rows"] or 0
+        if rows < LARGE_TABLE_ROWS:
+            continue
+
+        extra = step["Extra"] or ""
+        if step["type"] in ("ALL", "index"):
+            issues.append((step["table"], "full scan"))
+        if "Using filesort" in extra:
+            issues.append((step["table"], "filesort"))
+        if "Using temporary" in extra:
+            issues.append((step["table"], "temporary table"))
+    return issues
+
+
+## Statements worth explaining: anything reading rows (plain INSERT ... VALUES has no plan)
+def explainable(operation: str) -> bool:
+    return not re.match(r"\s*INSERT\b", operation, re.IGNORECASE) or re.search(r"\bSELECT\b", operation, re.IGNORECASE)
+
+
+## Placeholder lists vary with the sampled rows, they are folded in the snapshot
+def normalize_statement(operation: str) -> str:
+    return re.sub(r"IN \(%s(, %s)*\)", "IN (...)", " ".join(operation.split()))
+
+
+def summarize(steps):
+    # Only the index each table is read through is snapshotted: join types, Extra and row estimates
+    # move with the data volume and the server version (plan_issues checks them), and derived
+    # tables get generated names (<derived2>)
+    indexes = {(step["table"], step["key"]) for step in steps if step["table"] and not step["table"].startswith("<")}
+    return [list(index) for index in sorted(indexes, key=lambda index: (index[0], index[1] or ""))]
+
+
+## Function to run every case and explain its statements, returns ({case: plans}, [failure messages])
+async def explain_cases(connection, sample):
+    plans = {}
+    failures = []
+
+    for name, dictionary, case, allowed in CASES:
+        cursor = RecordingCursor(await connection.cursor(dictionary=dictionary))
+        try:
+            await case(cursor, sample)
+        finally:
+            # Writes of the cases are never kept
+            await connection.rollback()
+
+        explain_cursor = await connection.cursor(dictionary=True)
+        statements, steps = [], []
+        for operation, params in cursor.statements:
+            if not explainable(operation):
+                continue
+
+            await explain_cursor.execute(f"EXPLAIN {operation}", params)
+            plan = await explain_cursor.fetchall()
+            statements.append(normalize_statement(operation))
+            steps.extend(plan)
+
+            for table, issue in plan_issues(plan):
+                if (table, issue) not in allowed:
+                    failures.append(f"{name}: {issue} on {table}")
+
+        plans[name] = {"statements": statements, "indexes": summarize(steps)}
+
+    return plans, failures
+
+
+## Function to compare the plans with the snapshot, returns the names of the cases whose plans changed
+def changed_cases(plans, snapshot):
+    return sorted(
+        name for name in set(plans) | set(snapshot) if plans.get(name) != snapshot.get(name)
+    )
+
+
+## Function to run the check, returns True when no plan regressed or changed from the snapshot
+async def check_query_plans(connection, users: int, update_snapshot: bool = False, snapshot_path: str = SNAPSHOT_PATH):
+    # Seeded rows are removed whatever happens, a partial seed included
+    try:
+        # Leftovers of an interrupted run would collide with the seeded emails
+        await remove_plan_data(connection)
+        print(f"Seeding {users} users")
+        await seed_plan_data(connection, users)
+        sample = await pick_sample(connection)
+        plans, failures = await explain_cases(connection, sample)
+    finally:
+        await remove_plan_data(connection)
+
+    changed = []
+    if update_snapshot:
+        with open(snapshot_path, "w") as file:
+            json.dump(plans, file, indent=2, sort_keys=True)
+        print(f"Wrote {len(plans)} plans to {snapshot_path}")
+    elif not os.path.exists(snapshot_path):
+        # No reviewed baseline: never write one quietly
+        failures.append(f"no snapshot at {snapshot_path}, create it with --update-snapshot and commit it")
+    else:
+        with open(snapshot_path) as file:
+            snapshot = json.load(file)
+        changed = changed_cases(plans, snapshot)
+        for name in changed:
+            print(f"FAIL plan changed: {name} (review it, then --update-snapshot)")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{len(CASES)} cases, {len(failures)} plan regression(s), {len(changed)} changed plan(s)")
+    return not failures and not changed
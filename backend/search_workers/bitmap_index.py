@@ -0,0 +1,354 @@
+import asyncio
+import bisect
+import os
+import time
+
+from database import connection_pool
+
+
+## Answer searches from the in-process index instead of MySQL (off by default)
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "0") == "1"
+
+## Seconds before the index is rebuilt from MySQL, in the background. Hooks only see the writes
+## of this process: this bounds how long the writes of other processes, bulk_import.py and
+## generate-data stay invisible.
+SEARCH_INDEX_TTL = float(os.getenv("SEARCH_INDEX_TTL", "60"))
+
+## Rate buckets of a working area group, with the owners of each bucket: a rate filter only walks
+## the rates of its two edge buckets. Groups smaller than RATE_BUCKET_SIZE per bucket get fewer
+## buckets, which bounds the bitmaps kept per group.
+RATE_BUCKETS = 64
+RATE_BUCKET_SIZE = 256
+
+
+## Bitmaps are Python ints used as bitsets: bit n is set when id n is in the set
+
+def bitmap_from_ids(ids) -> int:
+    ids = list(ids)
+    if not ids:
+        return 0
+
+    data = bytearray(max(ids) // 8 + 1)
+    for id in ids:
+        data[id >> 3] |= 1 << (id & 7)
+    return int.from_bytes(data, "little")
+
+
+def iter_bitmap(bitmap: int):
+    # Walk the set bits in ascending order, skipping empty bytes
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for byte_index, byte in enumerate(data):
+        while byte:
+            low_bit = byte & -byte
+            yield byte_index * 8 + low_bit.bit_length() - 1
+            byte ^= low_bit
+
+
+def set_bit(bitmaps: dict, key, id: int):
+    bitmaps[key] = bitmaps.get(key, 0) | (1 << id)
+
+
+def clear_bit(bitmaps: dict, key, id: int):
+    bitmap = bitmaps.get(key, 0) & ~(1 << id)
+    if bitmap:
+        bitmaps[key] = bitmap
+    else:
+        bitmaps.pop(key, None)
+
+
+## Working areas sharing a (name, rate_type) key, None standing for any value. Bits are the
+## owning workers (users.id), so a search never maps working areas back to their workers:
+##   owners: workers having a working area of the group
+##   rates: sorted (rate, area_id, user_id), split into buckets at the quantiles,
+##   rate_owners[k]: workers having a working area of the group rated in bucket k
+class AreaGroup:
+    def __init__(self, entries=()):
+        # entries: (rate, area_id, user_id) of the working areas of the group, rate may be None
+        entries = list(entries)
+        self.owners = bitmap_from_ids(user_id for _, _, user_id in entries)
+        self.rates = sorted(entry for entry in entries if entry[0] is not None)
+
+        # Bucket k holds the rates from rate_bounds[k - 1] up to rate_bounds[k]
+        count = len(self.rates)
+        buckets = min(RATE_BUCKETS, count // RATE_BUCKET_SIZE)
+        self.rate_bounds = sorted({self.rates[index * count // buckets][0] for index in range(1, buckets)}) if buckets > 1 else []
+        self.rate_owners = [
+            bitmap_from_ids(user_id for _, _, user_id in self.rates[self._bucket_start(k):self._bucket_start(k + 1)])
+            for k in range(len(self.rate_bounds) + 1)
+        ]
+
+    def _bucket(self, rate) -> int:
+        return bisect.bisect_right(self.rate_bounds, rate)
+
+    def _bucket_start(self, k: int) -> int:
+        # Position in rates of the first entry of bucket k
+        if k == 0:
+            return 0
+        if k > len(self.rate_bounds):
+            return len(self.rates)
+        return bisect.bisect_left(self.rates, (self.rate_bounds[k - 1],))
+
+    def add(self, area_id: int, user_id: int, rate):
+        self.owners |= 1 << user_id
+        if rate is not None:
+            bisect.insort(self.rates, (rate, area_id, user_id))
+            self.rate_owners[self._bucket(rate)] |= 1 << user_id
+
+    def remove(self, area_id: int, user_id: int, rate, remaining_rates):
+        # remaining_rates: rates of the user's other working areas in the group, the owner
+        # bits are cleared once no other working area sets them
+        if not remaining_rates:
+            self.owners &= ~(1 << user_id)
+        if rate is None:
+            return
+
+        position = bisect.bisect_left(self.rates, (rate, area_id))
+        if position < len(self.rates) and self.rates[position][:2] == (rate, area_id):
+            del self.rates[position]
+        bucket = self._bucket(rate)
+        if not any(other is not None and self._bucket(other) == bucket for other in remaining_rates):
+            self.rate_owners[bucket] &= ~(1 << user_id)
+
+    def owners_in_range(self, min_rate, max_rate) -> int:
+        start = 0 if min_rate is None else bisect.bisect_left(self.rates, (min_rate,))
+        end = len(self.rates) if max_rate is None else bisect.bisect_right(self.rates, (max_rate, float("inf")))
+        if start >= end:
+            return 0
+
+        # Buckets whole in the range come from their owners, the two edge buckets rate by rate
+        low, high = self._bucket(self.rates[start][0]), self._bucket(self.rates[end - 1][0])
+        if start > self._bucket_start(low):
+            low_edge, low = self.rates[start:min(end, self._bucket_start(low + 1))], low + 1
+        else:
+            low_edge = []
+        if end < self._bucket_start(high + 1) and high >= low:
+            high_edge, high = self.rates[self._bucket_start(high):end], high - 1
+        else:
+            high_edge = []
+
+        owners = 0
+        for k in range(low, high + 1):
+            owners |= self.rate_owners[k]
+        return owners | bitmap_from_ids(user_id for _, _, user_id in low_edge + high_edge)
+
+
+def area_group_keys(name, rate_type):
+    # A working area belongs to its exact key and to the wildcard keys of the filters it matches
+    return ((name, rate_type), (name, None), (None, rate_type), (None, None))
+
+
+## In-process inverted index over the search filters, every bitmap has one bit per worker (users.id):
+##   city, gender and role of the profiles
+##   working area groups by (name, rate_type), with the workers having a working area of the
+##   group and per rate bucket (AreaGroup). The working area filters must hold on the same
+##   working area, which the group of the (name, rate_type) filter key ensures.
+class SearchBitmapIndex:
+    def __init__(self):
+        self.loaded = False
+        self.loaded_at = 0.0
+        self._loading = None
+        self._dirty = None
+        self.profiles = {}
+        self.city = {}
+        self.gender = {}
+        self.role = {}
+        self.areas = {}
+        self.user_areas = {}
+        self.groups = {}
+
+    def _add_profile(self, user_id: int, city, gender, role):
+        self.profiles[user_id] = (city, gender, role)
+        set_bit(self.city, city, user_id)
+        set_bit(self.gender, gender, user_id)
+        set_bit(self.role, role, user_id)
+
+    def _remove_profile(self, user_id: int):
+        profile = self.profiles.pop(user_id, None)
+        if profile is None:
+            return
+
+        city, gender, role = profile
+        clear_bit(self.city, city, user_id)
+        clear_bit(self.gender, gender, user_id)
+        clear_bit(self.role, role, user_id)
+
+    def _add_area(self, area_id: int, user_id: int, name, rate_type, rate):
+        self.areas[area_id] = (user_id, name, rate_type, rate)
+        self.user_areas.setdefault(user_id, set()).add(area_id)
+        for key in area_group_keys(name, rate_type):
+            group = self.groups.get(key)
+            if group is None:
+                self.groups[key] = AreaGroup([(rate, area_id, user_id)])
+            else:
+                group.add(area_id, user_id, rate)
+
+    def remove_area(self, area_id: int):
+        area = self.areas.pop(area_id, None)
+        if area is None:
+            return
+
+        user_id, name, rate_type, rate = area
+        user_areas = self.user_areas.get(user_id, set())
+        user_areas.discard(area_id)
+        if not user_areas:
+            self.user_areas.pop(user_id, None)
+
+        for key in area_group_keys(name, rate_type):
+            group = self.groups.get(key)
+            if group is None:
+                continue
+
+            remaining_rates = [
+                other[3] for other in map(self.areas.get, user_areas)
+                if key[0] in (None, other[1]) and key[1] in (None, other[2])
+            ]
+            group.remove(area_id, user_id, rate, remaining_rates)
+            if not group.owners:
+                del self.groups[key]
+
+    def search(self, current_user, filters: dict, after_id: int | None, offset: int, limit: int):
+        # Same defaults as the SQL path: the caller's city, workers only, without the caller
+        caller = self.profiles.get(current_user["id"])
+        if caller is None:
+            return self.search_city(None, filters, after_id, offset, limit)
+        return self.search_city(caller[0], filters, after_id, offset, limit, exclude_user_id=current_user["id"])
+
+    def search_city(self, city, filters: dict, after_id: int | None, offset: int, limit: int, exclude_user_id: int | None = None):
+        # Workers having a working area that matches every working area filter, from the group
+        # of the filter key (any working area when there is no filter)
+        group = self.groups.get((filters.get("working_area_name") or None, filters.get("rate_type") or None))
+        if group is None:
+            workers = 0
+        elif filters.get("min_rate") is not None or filters.get("max_rate") is not None:
+            workers = group.owners_in_range(filters.get("min_rate"), filters.get("max_rate"))
+        else:
+            workers = group.owners
+
+        if filters.get("gender"):
+            workers &= self.gender.get(filters["gender"], 0)
+
+        # Workers of the city only (no default filter when the caller has no profile)
+        if city is not None:
+            workers &= self.city.get(city, 0) & self.role.get("Worker", 0)
+        if exclude_user_id is not None:
+            workers &= ~(1 << exclude_user_id)
+
+        if after_id is not None:
+            workers = workers >> (after_id + 1) << (after_id + 1)
+
+        user_ids = []
+        for user_id in iter_bitmap(workers):
+            if offset:
+                offset -= 1
+                continue
+            user_ids.append(user_id)
+            if len(user_ids) == limit:
+                break
+        return user_ids
+
+    async def _read(self, connection):
+        # Bitmaps are built in bulk from id lists, setting bits one by one would be quadratic
+        cursor = await connection.cursor(dictionary=True)
+        await cursor.execute("SELECT user_id, city, gender, role FROM profile")
+        city, gender, role = {}, {}, {}
+        for row in await cursor.fetchall():
+            self.profiles[row["user_id"]] = (row["city"], row["gender"], row["role"])
+            city.setdefault(row["city"], []).append(row["user_id"])
+            gender.setdefault(row["gender"], []).append(row["user_id"])
+            role.setdefault(row["role"], []).append(row["user_id"])
+
+        await cursor.execute(
+            """
+            SELECT working_area_info.id, working_area_info.name, working_area_info.rate_type,
+                working_area_info.rate, profile.user_id
+            FROM working_area_info
+            JOIN worker ON worker.id = working_area_info.worker_id
+            JOIN profile ON profile.id = worker.profile_id
+            """
+        )
+        groups = {}
+        for row in await cursor.fetchall():
+            self.areas[row["id"]] = (row["user_id"], row["name"], row["rate_type"], row["rate"])
+            self.user_areas.setdefault(row["user_id"], set()).add(row["id"])
+            for key in area_group_keys(row["name"], row["rate_type"]):
+                groups.setdefault(key, []).append((row["rate"], row["id"], row["user_id"]))
+
+        self.city = {key: bitmap_from_ids(ids) for key, ids in city.items()}
+        self.gender = {key: bitmap_from_ids(ids) for key, ids in gender.items()}
+        self.role = {key: bitmap_from_ids(ids) for key, ids in role.items()}
+        self.groups = {key: AreaGroup(entries) for key, entries in groups.items()}
+
+    async def _load(self):
+        connection = None
+        try:
+            connection = await connection_pool.get_connection()
+
+            # Built aside and swapped in, searches keep using the current index meanwhile
+            self._dirty = set()
+            fresh = SearchBitmapIndex()
+            await fresh._read(connection)
+            self.__dict__.update(
+                {name: value for name, value in fresh.__dict__.items() if name not in ("_loading", "_dirty")}
+            )
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+
+            # Catch up with the users written while the index was loading
+            dirty, self._dirty = self._dirty, None
+            for user_id in dirty:
+                await self.refresh_user(connection, user_id)
+
+        except Exception as e:
+            # Cold: searches stay on SQL and the next one retries. Warm: keep the current index until the next TTL
+            print(f"Search index load failed: {e}")
+            if self.loaded:
+                self.loaded_at = time.monotonic()
+
+        finally:
+            self._dirty = None
+            self._loading = None
+            if connection is not None:
+                await connection.close()
+
+    def ready(self) -> bool:
+        # Starts the first load, or a rebuild once older than SEARCH_INDEX_TTL, in the background;
+        # searches use SQL until the first load is done
+        if self._loading is None and (not self.loaded or time.monotonic() - self.loaded_at > SEARCH_INDEX_TTL):
+            self._loading = asyncio.create_task(self._load())
+        return self.loaded
+
+    async def refresh_user(self, db, user_id: int):
+        # Keep a loaded index in step with profile and working area writes
+        if self._dirty is not None:
+            self._dirty.add(user_id)
+        if not self.loaded:
+            return
+
+        cursor = await db.cursor(dictionary=True)
+        await cursor.execute("SELECT city, gender, role FROM profile WHERE user_id = %s", (user_id,))
+        profile = await cursor.fetchone()
+
+        await cursor.execute(
+            """
+            SELECT working_area_info.id, working_area_info.name, working_area_info.rate_type, working_area_info.rate
+            FROM working_area_info
+            JOIN worker ON worker.id = working_area_info.worker_id
+            JOIN profile ON profile.id = worker.profile_id
+            WHERE profile.user_id = %s
+            """,
+            (user_id,),
+        )
+        areas = await cursor.fetchall()
+
+        self._remove_profile(user_id)
+        for area_id in list(self.user_areas.get(user_id, ())):
+            self.remove_area(area_id)
+
+        if profile:
+            self._add_profile(user_id, profile["city"], profile["gender"], profile["role"])
+        for area in areas:
+            self._add_area(area["id"], user_id, area["name"], area["rate_type"], area["rate"])
+
+
+## Shared index used by the search endpoint
+search_index = SearchBitmapIndex()
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+import os
+import time
+
+from metrics import cache_entries, cache_events
+
+
+## Maximum number of cached search pages
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+
+## Seconds a cached search page stays valid
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "30"))
+
+
+## Function to build the cache key of a search (city, normalized filters, page position)
+def search_cache_key(city: str, filters: dict, after_id: int | None, limit: int):
+    normalized_filters = tuple(
+        (name, float(value) if name in ("min_rate", "max_rate") else value)
+        for name, value in sorted(filters.items())
+        if value is not None and value != ""
+    )
+    return city, normalized_filters, after_id, limit
+
+
+## TTL + LRU cache of search pages, invalidated per city by the write endpoints
+class SearchResultCache:
+    def __init__(self, max_size: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.by_city = {}
+        # id -> {city: number of cached pages of that city listing it}, pruned with the pages
+        self.user_cities = {}
+        self.worker_cities = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, rows = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return rows
+
+    def put(self, key, rows):
+        city = key[0]
+        if key in self.entries:
+            self._remove(key)
+
+        self.entries[key] = (time.monotonic() + self.ttl, rows)
+        self.by_city.setdefault(city, set()).add(key)
+
+        # Remember where each worker appears, so a write can find its old city
+        for row in rows:
+            cities = self.user_cities.setdefault(row["user_id"], {})
+            cities[city] = cities.get(city, 0) + 1
+            cities = self.worker_cities.setdefault(row["worker_id"], {})
+            cities[city] = cities.get(city, 0) + 1
+
+        while len(self.entries) > self.max_size:
+            oldest_key = next(iter(self.entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        self._drop_entry(key)
+        keys = self.by_city.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_city[key[0]]
+
+    def _drop_entry(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        for row in entry[1]:
+            unlink_city(self.user_cities, row["user_id"], key[0])
+            unlink_city(self.worker_cities, row["worker_id"], key[0])
+
+    def invalidate_city(self, city):
+        for key in self.by_city.pop(city, set()):
+            self._drop_entry(key)
+            self.invalidations += 1
+
+    def invalidate_user(self, user_id: int, current_city=None):
+        # Cities where the worker was cached, plus the city it is in now
+        cities = set(self.user_cities.pop(user_id, {}))
+        if current_city is not None:
+            cities.add(current_city)
+        for city in cities:
+            self.invalidate_city(city)
+
+    def invalidate_worker(self, worker_id: int):
+        for city in list(self.worker_cities.pop(worker_id, {})):
+            self.invalidate_city(city)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+## Function to forget one cached page of a city listing an id
+def unlink_city(id_cities: dict, id: int, city):
+    cities = id_cities.get(id)
+    if cities is None:
+        return
+
+    count = cities.get(city, 0) - 1
+    if count > 0:
+        cities[city] = count
+        return
+
+    cities.pop(city, None)
+    if not cities:
+        del id_cities[id]
+
+
+## Shared cache used by the search endpoint
+search_cache = SearchResultCache()
+
+cache_entries.track(("search",), lambda: len(search_cache.entries))
+for event in ("hits", "misses", "evictions", "invalidations"):
+    cache_events.track(("search", event), lambda event=event: getattr(search_cache, event))
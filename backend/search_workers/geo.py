@@ -0,0 +1,252 @@
+import asyncio
+import math
+import os
+import time
+
+from database import connection_pool
+
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+## Grid cell size in degrees (about 11 km of latitude)
+CELL_SIZE = 0.1
+
+## Grid columns around the globe, column indexes wrap at the antimeridian
+COLUMNS = round(360 / CELL_SIZE)
+
+## Serve geo searches from the shared in-process index (0 reads the coordinates from MySQL on each search)
+GEO_INDEX_ENABLED = os.getenv("GEO_INDEX_ENABLED", "1") == "1"
+
+## Seconds before the shared index is rebuilt from MySQL, in the background. Hooks only see the
+## writes of this process: this bounds how long the writes of other processes, bulk_import.py
+## and generate-data stay invisible.
+GEO_INDEX_TTL = float(os.getenv("GEO_INDEX_TTL", "60"))
+
+## Farthest a nearest-workers search looks when no radius is given
+NEAREST_MAX_RADIUS_KM = float(os.getenv("NEAREST_MAX_RADIUS_KM", "100"))
+
+
+## Function to get the great-circle distance between two points in km
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+## Function to parse the varchar coordinates stored in profile
+def parse_coordinates(latitude, longitude):
+    try:
+        lat, lng = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def wrap_column(j: int) -> int:
+    return (j + COLUMNS // 2) % COLUMNS - COLUMNS // 2
+
+
+def cell_of(lat: float, lng: float):
+    return int(math.floor(lat / CELL_SIZE)), wrap_column(int(math.floor(lng / CELL_SIZE)))
+
+
+## In-memory grid index over worker coordinates (keyed by users.id)
+class GeoGridIndex:
+    def __init__(self):
+        self.cells = {}
+        self.points = {}
+        self.loaded = False
+        self.loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self._reloading = None
+        self._dirty = None
+
+    def upsert(self, user_id: int, lat: float, lng: float):
+        self.remove(user_id)
+        cell = cell_of(lat, lng)
+        self.cells.setdefault(cell, {})[user_id] = (lat, lng)
+        self.points[user_id] = cell
+
+    def remove(self, user_id: int):
+        cell = self.points.pop(user_id, None)
+        if cell is None:
+            return
+
+        members = self.cells[cell]
+        members.pop(user_id, None)
+        if not members:
+            del self.cells[cell]
+
+    def _cells_in_ring(self, center, ring: int):
+        ci, cj = center
+        if ring == 0:
+            yield center
+            return
+
+        for j in range(cj - ring, cj + ring + 1):
+            yield ci - ring, wrap_column(j)
+            yield ci + ring, wrap_column(j)
+        for i in range(ci - ring + 1, ci + ring):
+            yield i, wrap_column(cj - ring)
+            yield i, wrap_column(cj + ring)
+
+    def _ring_min_distance_km(self, lat: float, ring: int) -> float:
+        # Lower bound for the distance to any cell outside the first `ring` rings
+        if ring == 0:
+            return 0.0
+        widest_lat = min(89.0, abs(lat) + (ring + 1) * CELL_SIZE)
+        return (ring - 1) * CELL_SIZE * KM_PER_DEGREE * math.cos(math.radians(widest_lat))
+
+    def within_radius(self, lat: float, lng: float, radius_km: float):
+        # Only the cells overlapping the bounding box of the circle are scanned
+        lat_delta = radius_km / KM_PER_DEGREE
+        lng_delta = radius_km / (KM_PER_DEGREE * max(0.01, math.cos(math.radians(min(89.0, abs(lat) + lat_delta)))))
+        min_i = int(math.floor(max(-90.0, lat - lat_delta) / CELL_SIZE))
+        max_i = int(math.floor(min(90.0, lat + lat_delta) / CELL_SIZE))
+        min_j = int(math.floor((lng - lng_delta) / CELL_SIZE))
+        max_j = int(math.floor((lng + lng_delta) / CELL_SIZE))
+
+        # Columns past the antimeridian wrap around, a circle wider than the globe takes each column once
+        columns = range(min_j, max_j + 1) if max_j - min_j < COLUMNS else range(COLUMNS)
+        columns = [wrap_column(j) for j in columns]
+
+        results = []
+        for i in range(min_i, max_i + 1):
+            for j in columns:
+                for user_id, (point_lat, point_lng) in self.cells.get((i, j), {}).items():
+                    distance = haversine_km(lat, lng, point_lat, point_lng)
+                    if distance <= radius_km:
+                        results.append((distance, user_id))
+
+        results.sort()
+        return results
+
+    def nearest(self, lat: float, lng: float, k: int, radius_km: float | None = None):
+        # Expand rings of cells around the point until no closer worker can exist,
+        # never farther than NEAREST_MAX_RADIUS_KM so an empty area does not walk the globe
+        radius_km = min(radius_km or NEAREST_MAX_RADIUS_KM, NEAREST_MAX_RADIUS_KM)
+        center = cell_of(lat, lng)
+        found = []
+        seen = 0
+        ring = 0
+        # Hard stop for the walk: enough rings to cover the radius up to about 84 degrees of latitude,
+        # fewer than half the columns so a ring never wraps onto itself
+        max_ring = min(COLUMNS // 2 - 1, int(radius_km / (CELL_SIZE * KM_PER_DEGREE * 0.1)) + 2)
+
+        while seen < len(self.points) and ring <= max_ring:
+            bound = self._ring_min_distance_km(lat, ring)
+            if len(found) >= k and found[k - 1][0] <= bound:
+                break
+            if bound > radius_km:
+                break
+
+            for cell in self._cells_in_ring(center, ring):
+                for user_id, (point_lat, point_lng) in self.cells.get(cell, {}).items():
+                    seen += 1
+                    distance = haversine_km(lat, lng, point_lat, point_lng)
+                    if distance <= radius_km:
+                        found.append((distance, user_id))
+
+            found.sort()
+            ring += 1
+
+        return found[:k]
+
+    async def _read(self, db):
+        # Built aside and swapped in, searches keep using the current cells meanwhile
+        fresh = GeoGridIndex()
+        cursor = await db.cursor(dictionary=True)
+        await cursor.execute(
+            """
+            SELECT profile.user_id, profile.latitude, profile.longitude FROM profile
+            JOIN worker ON worker.profile_id = profile.id
+            WHERE profile.role = 'Worker'
+            """
+        )
+        for row in await cursor.fetchall():
+            coordinates = parse_coordinates(row["latitude"], row["longitude"])
+            if coordinates:
+                fresh.upsert(row["user_id"], *coordinates)
+
+        self.cells, self.points = fresh.cells, fresh.points
+        self.loaded = True
+        self.loaded_at = time.monotonic()
+
+    async def load(self, db):
+        # The first load holds the search, later ones run in the background once older than GEO_INDEX_TTL
+        if self.loaded:
+            if self._reloading is None and time.monotonic() - self.loaded_at > GEO_INDEX_TTL:
+                self._reloading = asyncio.create_task(self._reload())
+            return
+
+        async with self._lock:
+            if not self.loaded:
+                await self._read(db)
+
+    async def _reload(self):
+        connection = None
+        try:
+            connection = await connection_pool.get_connection()
+            self._dirty = set()
+            await self._read(connection)
+
+            # Writes hooked while reading may be missing from the rebuilt cells
+            dirty, self._dirty = self._dirty, None
+            for user_id in dirty:
+                await self.refresh_user(connection, user_id)
+
+        except Exception as e:
+            # Keep serving the current cells, the next search retries
+            print(f"Geo index reload failed: {e}")
+
+        finally:
+            self._dirty = None
+            self._reloading = None
+            if connection is not None:
+                await connection.close()
+
+    async def refresh_user(self, db, user_id: int):
+        # Keep a loaded index in step with profile and worker writes
+        if not self.loaded:
+            return
+        if self._dirty is not None:
+            self._dirty.add(user_id)
+
+        cursor = await db.cursor(dictionary=True)
+        await cursor.execute(
+            """
+            SELECT profile.latitude, profile.longitude FROM profile
+            JOIN worker ON worker.profile_id = profile.id
+            WHERE profile.role = 'Worker' AND profile.user_id = %s
+            """,
+            (user_id,),
+        )
+        row = await cursor.fetchone()
+        coordinates = row and parse_coordinates(row["latitude"], row["longitude"])
+
+        if coordinates:
+            self.upsert(user_id, *coordinates)
+        else:
+            self.remove(user_id)
+
+
+## Shared index used by the search endpoint, loaded on the first geo search
+geo_index = GeoGridIndex()
+
+
+## Function to get the index a geo search runs on: the shared one, or one read for this search only
+async def current_geo_index(db) -> GeoGridIndex:
+    if GEO_INDEX_ENABLED:
+        await geo_index.load(db)
+        return geo_index
+
+    index = GeoGridIndex()
+    await index.load(db)
+    return index
@@ -0,0 +1,31 @@
+from auth.identity import identity_cache
+from auth.utils import claims_versions
+from .geo import geo_index
+from .bitmap_index import search_index
+from .cache import search_cache
+
+
+## Hook called after a profile, worker or working area write, keeps the search indexes
+## and the caller's identity context up to date.
+## The write is already committed, so a failure here is logged rather than failing the request:
+## the indexes catch up on their next reload and the cached pages expire.
+async def worker_changed(db, user_id: int):
+    identity_cache.invalidate(user_id)
+    claims_versions.invalidate(user_id)
+
+    try:
+        # Invalidate the cached pages of the cities the worker was and is in
+        cursor = await db.cursor()
+        await cursor.execute("SELECT city FROM profile WHERE user_id = %s", (user_id,))
+        profile = await cursor.fetchone()
+        search_cache.invalidate_user(user_id, profile[0] if profile else None)
+
+        await geo_index.refresh_user(db, user_id)
+        await search_index.refresh_user(db, user_id)
+    except Exception as e:
+        print(f"Search refresh failed for user {user_id}: {e}")
+
+
+## Hook called after a rating write, the worker's average changed in the cached pages
+def rating_changed(worker_id: int):
+    search_cache.invalidate_worker(worker_id)
@@ -0,0 +1,207 @@
+import json
+
+
+## Columns returned for every worker, plus its working areas as a JSON array
+WORKER_COLUMNS = """
+    users.id AS user_id,
+    users.email,
+    profile.first_name,
+    profile.last_name,
+    profile.gender,
+    profile.phone_number,
+    profile.city,
+    worker.id AS worker_id
+"""
+
+WORKING_AREAS_AGGREGATE = """
+    JSON_ARRAYAGG(
+        JSON_OBJECT(
+            'name', working_area_info.name,
+            'rate_type', working_area_info.rate_type,
+            'rate', working_area_info.rate,
+            'description', working_area_info.description
+        )
+    ) AS working_areas,
+    rating_summary.rating_sum / rating_summary.rating_count AS avg_stars
+"""
+
+PAGE_GROUP_BY = """
+    page.user_id, page.email, page.first_name, page.last_name, page.gender,
+    page.phone_number, page.city, page.worker_id,
+    rating_summary.rating_sum, rating_summary.rating_count
+"""
+
+
+## Helper function to build the WHERE conditions of the search filters
+def build_search_filters(filters: dict):
+    # Working area filters must all hold on the same working area row
+    area_conditions = ["working_area_info.worker_id = worker.id"]
+    area_params = []
+    profile_conditions = []
+    profile_params = []
+
+    if filters.get("min_rate") is not None:
+        area_conditions.append("working_area_info.rate >= %s")
+        area_params.append(filters["min_rate"])
+    if filters.get("max_rate") is not None:
+        area_conditions.append("working_area_info.rate <= %s")
+        area_params.append(filters["max_rate"])
+    if filters.get("rate_type"):
+        area_conditions.append("working_area_info.rate_type = %s")
+        area_params.append(filters["rate_type"])
+    if filters.get("working_area_name"):
+        area_conditions.append("working_area_info.name = %s")
+        area_params.append(filters["working_area_name"])
+    if filters.get("gender"):
+        profile_conditions.append("profile.gender = %s")
+        profile_params.append(filters["gender"])
+
+    conditions = [
+        f"EXISTS (SELECT 1 FROM working_area_info WHERE {' AND '.join(area_conditions)})"
+    ] + profile_conditions
+
+    return conditions, area_params + profile_params
+
+
+## Helper function to fetch a page of workers in the caller's city with their working areas (one statement)
+async def fetch_city_workers_page(cursor, current_user, filters: dict, after_id: int | None, offset: int, limit: int):
+    conditions, params = build_search_filters(filters)
+
+    # Same defaults as before: only workers of the caller's city, without the caller,
+    # and no default filter when the caller has no profile yet
+    conditions.append(
+        """(
+            NOT EXISTS (SELECT 1 FROM me)
+            OR (profile.city = (SELECT city FROM me) AND profile.role = 'Worker' AND users.email != %s)
+        )"""
+    )
+    params.append(current_user["email"])
+
+    if after_id is not None:
+        conditions.append("users.id > %s")
+        params.append(after_id)
+
+    query = f"""
+        WITH me AS (
+            SELECT city FROM profile WHERE user_id = %s
+        ),
+        page AS (
+            SELECT {WORKER_COLUMNS}
+            FROM users
+            JOIN profile ON users.id = profile.user_id
+            JOIN worker ON profile.id = worker.profile_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY users.id
+            LIMIT %s OFFSET %s
+        )
+        SELECT page.*, {WORKING_AREAS_AGGREGATE}
+        FROM page
+        JOIN working_area_info ON working_area_info.worker_id = page.worker_id
+        LEFT JOIN rating_summary ON rating_summary.worker_id = page.worker_id
+        GROUP BY {PAGE_GROUP_BY}
+        ORDER BY page.user_id
+    """
+
+    await cursor.execute(query, (current_user["id"], *params, limit, offset))
+    return await cursor.fetchall()
+
+
+## Helper function to fetch a page of workers of a city with their working areas (one statement).
+## Unlike fetch_city_workers_page it does not depend on the caller, so the result can be cached.
+async def fetch_workers_in_city(cursor, city: str, filters: dict, after_id: int | None, limit: int):
+    conditions, params = build_search_filters(filters)
+    conditions.append("profile.city = %s")
+    params.append(city)
+    conditions.append("profile.role = 'Worker'")
+
+    if after_id is not None:
+        conditions.append("users.id > %s")
+        params.append(after_id)
+
+    query = f"""
+        WITH page AS (
+            SELECT {WORKER_COLUMNS}
+            FROM users
+            JOIN profile ON users.id = profile.user_id
+            JOIN worker ON profile.id = worker.profile_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY users.id
+            LIMIT %s
+        )
+        SELECT page.*, {WORKING_AREAS_AGGREGATE}
+        FROM page
+        JOIN working_area_info ON working_area_info.worker_id = page.worker_id
+        LEFT JOIN rating_summary ON rating_summary.worker_id = page.worker_id
+        GROUP BY {PAGE_GROUP_BY}
+        ORDER BY page.user_id
+    """
+
+    await cursor.execute(query, (*params, limit))
+    return await cursor.fetchall()
+
+
+## Helper function to fetch the ids of the workers matching the filters among the given users
+async def fetch_matching_worker_ids(cursor, current_user, filters: dict, user_ids):
+    conditions, params = build_search_filters(filters)
+    conditions.append(f"users.id IN ({', '.join(['%s'] * len(user_ids))})")
+    params.extend(user_ids)
+    conditions.append("profile.role = 'Worker'")
+    conditions.append("users.id != %s")
+    params.append(current_user["id"])
+
+    query = f"""
+        SELECT users.id AS user_id
+        FROM users
+        JOIN profile ON users.id = profile.user_id
+        JOIN worker ON profile.id = worker.profile_id
+        WHERE {' AND '.join(conditions)}
+    """
+
+    await cursor.execute(query, tuple(params))
+    return [row["user_id"] for row in await cursor.fetchall()]
+
+
+## Helper function to fetch the given workers with their working areas (one statement)
+async def fetch_workers_by_ids(cursor, user_ids):
+    query = f"""
+        WITH page AS (
+            SELECT {WORKER_COLUMNS}
+            FROM users
+            JOIN profile ON users.id = profile.user_id
+            JOIN worker ON profile.id = worker.profile_id
+            WHERE users.id IN ({', '.join(['%s'] * len(user_ids))})
+        )
+        SELECT page.*, {WORKING_AREAS_AGGREGATE}
+        FROM page
+        JOIN working_area_info ON working_area_info.worker_id = page.worker_id
+        LEFT JOIN rating_summary ON rating_summary.worker_id = page.worker_id
+        GROUP BY {PAGE_GROUP_BY}
+    """
+
+    await cursor.execute(query, tuple(user_ids))
+    return await cursor.fetchall()
+
+
+## Function to serialize a worker row into the search response format
+def serialize_worker(row):
+    working_areas = row["working_areas"]
+    if isinstance(working_areas, (bytes, bytearray, str)):
+        working_areas = json.loads(working_areas)
+
+    return {
+        "first_name": row["first_name"],
+        "last_name": row["last_name"],
+        "gender": row["gender"],
+        "phone_number": row["phone_number"],
+        "city": row["city"],
+        "avg_stars": row["avg_stars"] if row["avg_stars"] else 0,
+        "working_areas": [
+            {
+                "name": area["name"],
+                "rate_type": area["rate_type"],
+                "rate": area["rate"],
+                "description": area["description"],
+            }
+            for area in working_areas
+        ],
+    }
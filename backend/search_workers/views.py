@@ -1,181 +1,200 @@
-from fastapi import APIRouter, Depends, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Response, status, Query
 from typing import Optional
+import base64
+import binascii
+import json
 from fastapi.responses import JSONResponse
-from mysql.connector import connection
 
-from database import get_db
+from database import get_db, PooledConnection
+from timing import TimedRoute
 from users.schemas import UserResponse
 from auth.views import get_current_user
+from auth.identity import get_identity
+from .geo import current_geo_index
+from .bitmap_index import search_index, SEARCH_INDEX_ENABLED
+from .cache import search_cache, search_cache_key
+from .services import (
+    fetch_city_workers_page,
+    fetch_workers_in_city,
+    fetch_matching_worker_ids,
+    fetch_workers_by_ids,
+    serialize_worker,
+)
 
 
 search_workers_router = APIRouter(
-    tags=["Search workers"]
+    tags=["Search workers"],
+    route_class=TimedRoute,
 )
 
 
-## Function to serialize the workers
-def serialize_workers(results):
-    workers = {}
-    for row in results:
-        email = row["email"]
-        
-        # If worker is not in the dictionary by email, add them
-        if email not in workers:
-            workers[email] = {
-                "first_name": row["first_name"],
-                "last_name": row["last_name"],
-                "gender": row["gender"],
-                "phone_number": row["phone_number"],
-                "city": row["city"],
-                "avg_stars": row["avg_stars"] if row["avg_stars"] else 0,
-                "working_areas": []
-            }
-        
-        # Append working area info to the worker
-        workers[email]["working_areas"].append({
-            "name": row["name"],
-            "rate_type": row["rate_type"],
-            "rate": row["rate"],
-            "description": row["description"]
-        })
-        
-    # Return the workers
-    return workers
-
-
-## Function to get working area info for the retrieved workers
-def get_working_area_info(cursor, worker_ids):
-    get_working_area_query = f"""
-        SELECT 
-            users.email, 
-            profile.first_name, 
-            profile.last_name, 
-            profile.gender, 
-            profile.phone_number, 
-            profile.city, 
-            working_area_info.name, 
-            working_area_info.rate_type, 
-            working_area_info.rate, 
-            AVG(ratings.stars) AS avg_stars,
-            working_area_info.description 
-        FROM 
-            users 
-        JOIN 
-            profile ON users.id = profile.user_id 
-        JOIN 
-            worker ON profile.id = worker.profile_id 
-        JOIN 
-            working_area_info ON worker.id = working_area_info.worker_id
-        LEFT JOIN
-            ratings ON worker.id = ratings.worker_id 
-        WHERE 
-            users.id IN ({', '.join([str(id) for id in worker_ids])})
-        GROUP BY
-            users.email, 
-            profile.first_name, 
-            profile.last_name, 
-            profile.gender, 
-            profile.phone_number, 
-            profile.city, 
-            working_area_info.name, 
-            working_area_info.rate_type, 
-            working_area_info.rate, 
-            working_area_info.description;
-    """ 
-    
-    cursor.execute(get_working_area_query)
-    working_areas = cursor.fetchall() 
-    
-    return working_areas
+## Radius used for a geo search when only lat/lng are given
+DEFAULT_RADIUS_KM = 10
+
+## Largest page a client can ask for
+MAX_SEARCH_LIMIT = 50
+
+
+## Function to encode the position after the last worker of a page into an opaque cursor
+def encode_cursor(user_id: int, distance: float | None = None) -> str:
+    position = {"id": user_id}
+    if distance is not None:
+        position["distance"] = distance
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+## Function to decode a cursor sent back by the client
+def decode_cursor(token: str) -> dict:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode()))
+        position["id"] = int(position["id"])
+        if "distance" in position:
+            position["distance"] = float(position["distance"])
+        return position
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+## Function to load a page of a city's workers (bitmap index when warm, else MySQL) in cacheable form
+async def load_city_page(cursor, city, filters: dict, after_id: int | None, limit: int):
+    rows = None
+    if SEARCH_INDEX_ENABLED and search_index.ready():
+        user_ids = search_index.search_city(city, filters, after_id, 0, limit)
+        rows = await fetch_workers_by_ids(cursor, user_ids) if user_ids else []
+        rows.sort(key=lambda row: row["user_id"])
+
+    if rows is None:
+        rows = await fetch_workers_in_city(cursor, city, filters, after_id, limit)
+
+    return [
+        {"user_id": row["user_id"], "worker_id": row["worker_id"], "worker": serialize_worker(row)}
+        for row in rows
+    ]
+
+
+## GET Endpoint: Search cache counters, used to size the cache.
+@search_workers_router.get("/search_workers/cache_stats", status_code=status.HTTP_200_OK)
+async def search_cache_stats(current_user: UserResponse = Depends(get_current_user)):
+    return search_cache.stats()
 
 
 ## GET Endpoint: List all workers & apply many filter to find ideal worker by user.
 @search_workers_router.get("/search_workers/", status_code=status.HTTP_200_OK)
 async def search_workers(
-    db: connection.MySQLConnection = Depends(get_db),
+    response: Response,
+    db: PooledConnection = Depends(get_db),
     min_rate: Optional[float] = Query(None, description="Minimum rate for filtering"),
     max_rate: Optional[float] = Query(None, description="Maximum rate for filtering"),
     rate_type: Optional[str] = Query(None, description="Filter by rate type"),
     working_area_name: Optional[str] = Query(None, description="Filter by working area name"),
     gender: Optional[str] = Query(None, description="Filter by worker gender"),
-    limit: int = Query(10, description="Limit the number of workers returned", gt=0),  # Default limit to 10
+    limit: int = Query(10, description=f"Limit the number of workers returned (at most {MAX_SEARCH_LIMIT})", gt=0),  # Default limit to 10
     page_no: int = Query(0, description="Number of workers to skip", ge=0),  # Default offset to 0
-    current_user: UserResponse = Depends(get_current_user)
+    lat: Optional[float] = Query(None, description="Search around this latitude", ge=-90, le=90),
+    lng: Optional[float] = Query(None, description="Search around this longitude", ge=-180, le=180),
+    radius_km: Optional[float] = Query(None, description="Search radius in km around lat/lng", gt=0),
+    nearest: Optional[int] = Query(None, description="Return the k nearest workers to lat/lng (within radius_km, at most NEAREST_MAX_RADIUS_KM)", gt=0),
+    cursor_token: Optional[str] = Query(None, alias="cursor", description="Cursor from the X-Next-Cursor header of the previous page"),
+    current_user: dict = Depends(get_identity)
 ):
-    cursor = db.cursor(dictionary=True)
-    
-    # Get current user city 
-    cursor.execute("SELECT city FROM profile WHERE user_id = %s", (current_user["id"],))
-    curr_user_result = cursor.fetchone()
-    
-
-    # Base query to get distinct workers
-    get_workers_query = """
-        SELECT 
-        users.id AS user_id,
-        users.email,
-        MIN(profile.first_name) AS first_name,
-        MIN(profile.last_name) AS last_name,
-        MIN(profile.gender) AS gender,
-        MIN(profile.phone_number) AS phone_number,
-        MIN(profile.city) AS city
-    FROM 
-        users 
-    JOIN 
-        profile ON users.id = profile.user_id 
-    JOIN 
-        worker ON profile.id = worker.profile_id 
-    JOIN 
-        working_area_info ON worker.id = working_area_info.worker_id
-    """
-
-    # List to store filters 
-    filters = [] 
-
-    # Add optional filters for working area info
-    if min_rate is not None: 
-        filters.append(f"working_area_info.rate >= {min_rate}") 
-    if max_rate is not None: 
-        filters.append(f"working_area_info.rate <= {max_rate}") 
-    if rate_type:
-        filters.append(f"working_area_info.rate_type = '{rate_type}'")
-    if working_area_name:
-        filters.append(f"working_area_info.name = '{working_area_name}'")
-    if gender:
-        filters.append(f"profile.gender = '{gender}'")
-    
-    # Add default filter by current user city and user role should be Worker
-    if curr_user_result:
-        city = curr_user_result["city"]
-        email = current_user["email"]
-        
-        filters.append(f"profile.city = '{city}'") 
-        filters.append(f"profile.role = 'Worker'")
-        filters.append(f"users.email != '{email}'")
-
-    # If there are any filters, append them to the query
-    if filters:
-        get_workers_query += " WHERE " + " AND ".join(filters)
-    
-    # Add pagination (LIMIT and OFFSET) to distinct workers
-    get_workers_query += f" GROUP BY users.id LIMIT {limit} OFFSET {page_no * limit}"
-    
-    cursor.execute(get_workers_query)
-    workers = cursor.fetchall()
-    
-    # If no workers are found, return an empty list
-    if not workers:
-        return []
-    
-    # Extract worker ids to fetch working area info for each
-    worker_ids = [worker['user_id'] for worker in workers]
-        
-    # Call get_working_area_info() function to get the workers working areas informations
-    working_areas = get_working_area_info(cursor, worker_ids)
-        
-    # Call serialize_workers() function to format the results
-    result = serialize_workers(working_areas)
-    
+    cursor = await db.cursor(dictionary=True)
+
+    filters = {
+        "min_rate": min_rate,
+        "max_rate": max_rate,
+        "rate_type": rate_type,
+        "working_area_name": working_area_name,
+        "gender": gender,
+    }
+
+    # Cap the page size whatever the client asks for
+    limit = min(limit, MAX_SEARCH_LIMIT)
+    after = decode_cursor(cursor_token) if cursor_token else None
+
+    # Geo search: candidates come from the spatial index instead of the city filter
+    if lat is not None and lng is not None:
+        index = await current_geo_index(db)
+
+        if nearest:
+            candidates = index.nearest(lat, lng, nearest, radius_km)
+        else:
+            candidates = index.within_radius(lat, lng, radius_km or DEFAULT_RADIUS_KM)
+
+        distances = {user_id: distance for distance, user_id in candidates}
+        if not distances:
+            return []
+
+        if after is not None and "distance" not in after:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+            )
+
+        # Apply the filters to the candidates, then order them by distance (ties by id)
+        worker_ids = await fetch_matching_worker_ids(cursor, current_user, filters, list(distances))
+        positions = sorted((distances[user_id], user_id) for user_id in worker_ids)
+        if after is not None:
+            positions = [position for position in positions if position > (after["distance"], after["id"])]
+            positions = positions[:limit + 1]
+        else:
+            positions = positions[page_no * limit:page_no * limit + limit + 1]
+
+        # Hand out a cursor for the next page if there is one
+        if len(positions) > limit:
+            positions = positions[:limit]
+            response.headers["X-Next-Cursor"] = encode_cursor(positions[-1][1], positions[-1][0])
+
+        if not positions:
+            return []
+
+        rows = {row["user_id"]: row for row in await fetch_workers_by_ids(cursor, [user_id for _, user_id in positions])}
+
+        # Return the workers nearest first, with their distance
+        result = []
+        for distance, user_id in positions:
+            if user_id in rows:
+                worker = serialize_worker(rows[user_id])
+                worker["distance_km"] = round(distance, 2)
+                result.append(worker)
+        return result
+
+    after_id = after["id"] if after is not None else None
+    offset = 0 if after is not None else page_no * limit
+
+    # First and keyset pages are served from the result cache: the cached page holds
+    # the city's workers and the caller is dropped afterwards, so callers share entries
+    if offset == 0 and current_user["profile_id"] is not None:
+        key = search_cache_key(current_user["city"], filters, after_id, limit)
+        entries = search_cache.get(key)
+        if entries is None:
+            # Two extra rows: one may be the caller, one tells if there is a next page
+            entries = await load_city_page(cursor, current_user["city"], filters, after_id, limit + 2)
+            search_cache.put(key, entries)
+
+        entries = [entry for entry in entries if entry["user_id"] != current_user["id"]]
+        if len(entries) > limit:
+            entries = entries[:limit]
+            response.headers["X-Next-Cursor"] = encode_cursor(entries[-1]["user_id"])
+
+        return [entry["worker"] for entry in entries]
+
+    # City search from the in-process bitmap index when it is enabled and warm,
+    # one extra row tells if there is a next page
+    rows = None
+    if SEARCH_INDEX_ENABLED and search_index.ready():
+        user_ids = search_index.search(current_user, filters, after_id, offset, limit + 1)
+        rows = await fetch_workers_by_ids(cursor, user_ids) if user_ids else []
+        rows.sort(key=lambda row: row["user_id"])
+
+    # Otherwise the caller's city, the page of workers and their working areas in one statement
+    if rows is None:
+        rows = await fetch_city_workers_page(cursor, current_user, filters, after_id, offset, limit + 1)
+
+    # Hand out a cursor for the next page if there is one
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["user_id"])
+
     # Return the list of workers with their respective working areas
-    return list(result.values()) 
-    
+    return [serialize_worker(row) for row in rows]
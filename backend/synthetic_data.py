@@ -0,0 +1,236 @@
+## Deterministic synthetic dataset for scale testing
+##
+## Generates users, profiles, workers, working areas, ratings and worker requests from a seed:
+## the same seed and size always give the same rows. Cities and trades follow Zipf-like
+## distributions (a few large cities and common trades, a long tail), ratings and requests
+## per worker are heavy tailed. Rows carry explicit ids, so the tables can be bulk loaded
+## in any order.
+##
+## Two outputs, both in chunks so memory does not grow with the size:
+##   - straight into MySQL with multi-row inserts
+##   - tab separated files plus a load.sql script for LOAD DATA LOCAL INFILE
+##     (mysql --local-infile=1 findworkers < load.sql), the fastest way to load the 10M preset
+import datetime
+import itertools
+import os
+import random
+
+from workers.services import rebuild_rating_summary
+
+
+## Number of users per preset, about 30% of them are workers
+PRESETS = {
+    "small": 1_000,
+    "100k": 100_000,
+    "10M": 10_000_000,
+}
+
+DEFAULT_SEED = 42
+DEFAULT_DOMAIN = "synthetic.invalid"
+CHUNK_SIZE = 5000
+
+## Every synthetic user logs in with this password (bcrypt hash stored, 12 rounds)
+SYNTHETIC_PASSWORD = "password"
+SYNTHETIC_PASSWORD_HASH = "$2b$12$lc/UU1lY5fM/DS2Co4nXD.5qFb1G4sidHRAM.Hhl7jHdNdVaPhUT."
+
+WORKER_SHARE = 0.3
+
+CITIES = [
+    "Colombo", "Kandy", "Galle", "Jaffna", "Negombo", "Kurunegala", "Anuradhapura", "Ratnapura",
+    "Batticaloa", "Trincomalee", "Matara", "Badulla", "Nuwara Eliya", "Kalutara", "Gampaha",
+] + [f"Town {index:03d}" for index in range(185)]
+
+TRADES = [
+    "Plumber", "Electrician", "Carpenter", "Painter", "Mason", "Cleaner", "Gardener", "Driver",
+    "Cook", "Tutor", "Mechanic", "Tiler", "Welder", "Roofer", "Babysitter", "Caregiver",
+    "Tailor", "Hairdresser", "Photographer", "Locksmith",
+]
+
+## Rate type: (weight, median rate, spread of the log-normal distribution)
+RATE_TYPES = {
+    "Per_hour": (45, 400, 0.5),
+    "Half_day": (20, 1500, 0.4),
+    "Full_day": (25, 2800, 0.4),
+    "Monthly": (10, 60000, 0.3),
+}
+
+GENDERS = ["Male", "Female", "Other"]
+GENDER_WEIGHTS = [52, 46, 2]
+STARS_WEIGHTS = [5, 7, 15, 33, 40]
+REQUEST_STATUSES = ["Pending", "Accepted", "Rejected"]
+REQUEST_STATUS_WEIGHTS = [20, 55, 25]
+
+## Columns written for each table, in load order
+TABLES = {
+    "users": ("id", "email", "password", "created_at"),
+    "profile": (
+        "id", "user_id", "first_name", "last_name", "phone_number", "gender",
+        "location", "longitude", "latitude", "role", "city", "created_at",
+    ),
+    "worker": ("id", "profile_id", "created_at"),
+    "working_area_info": ("id", "name", "rate_type", "rate", "description", "worker_id", "created_at"),
+    "ratings": ("id", "user_id", "worker_id", "stars", "created_at"),
+    "worker_requests": ("id", "user_id", "worker_id", "status", "request_time"),
+}
+
+FIRST_NAMES = ["Nimal", "Kamala", "Sunil", "Anura", "Dilani", "Ruwan", "Chamari", "Kasun", "Ishara", "Tharindu"]
+LAST_NAMES = ["Perera", "Fernando", "Silva", "Jayasinghe", "Bandara", "Dissanayake", "Wickramasinghe", "Kumara"]
+
+START_TIME = datetime.datetime(2023, 1, 1)
+
+
+def zipf_weights(count: int, exponent: float = 1.1):
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+## Function to generate the rows of `users` users, yields (table, rows) chunks.
+## first_ids gives the first id of each table (1 for an empty database).
+def generate_rows(users: int, seed: int = DEFAULT_SEED, first_ids: dict | None = None, domain: str = DEFAULT_DOMAIN, chunk_size: int = CHUNK_SIZE):
+    rng = random.Random(seed)
+    next_ids = {table: (first_ids or {}).get(table, 1) for table in TABLES}
+    buffers = {table: [] for table in TABLES}
+
+    def add(table, row):
+        buffers[table].append(row)
+        next_ids[table] += 1
+
+    city_weights = zipf_weights(len(CITIES))
+    trade_weights = zipf_weights(len(TRADES))
+    rate_type_names = list(RATE_TYPES)
+    rate_type_weights = list(itertools.accumulate(weight for weight, _, _ in RATE_TYPES.values()))
+    centers = {city: (rng.uniform(5.9, 9.8), rng.uniform(79.7, 81.9)) for city in CITIES}
+
+    first_user_id = next_ids["users"]
+    seconds = 2 * 365 * 24 * 3600  # Accounts created over two years
+
+    for index in range(users):
+        user_id = next_ids["users"]
+        created_at = START_TIME + datetime.timedelta(seconds=seconds * index // max(users, 1))
+        add("users", (user_id, f"user-{user_id}@{domain}", SYNTHETIC_PASSWORD_HASH, created_at))
+
+        profile_id = next_ids["profile"]
+        city = rng.choices(CITIES, cum_weights=city_weights)[0]
+        latitude, longitude = centers[city]
+        is_worker = rng.random() < WORKER_SHARE
+        add(
+            "profile",
+            (
+                profile_id, user_id, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+                f"07{rng.randrange(10 ** 8):08d}", rng.choices(GENDERS, GENDER_WEIGHTS)[0], f"{city} area",
+                f"{longitude + rng.gauss(0, 0.05):.6f}", f"{latitude + rng.gauss(0, 0.05):.6f}",
+                "Worker" if is_worker else "User", city, created_at,
+            ),
+        )
+
+        if is_worker:
+            worker_id = next_ids["worker"]
+            add("worker", (worker_id, profile_id, created_at))
+
+            for _ in range(1 + min(4, int(rng.expovariate(1.2)))):
+                rate_type = rng.choices(rate_type_names, cum_weights=rate_type_weights)[0]
+                _, median, spread = RATE_TYPES[rate_type]
+                trade = rng.choices(TRADES, cum_weights=trade_weights)[0]
+                add(
+                    "working_area_info",
+                    (
+                        next_ids["working_area_info"], trade, rate_type,
+                        int(median * rng.lognormvariate(0, spread)), f"{trade} in {city}", worker_id, created_at,
+                    ),
+                )
+
+            # Heavy tail: most workers have a handful of ratings and requests, a few have hundreds
+            ratings = min(int(rng.paretovariate(1.2)) - 1, 500, users - 1)
+            for rater_id in rng.sample(range(first_user_id, first_user_id + users), ratings):
+                if rater_id != user_id:
+                    add("ratings", (next_ids["ratings"], rater_id, worker_id, rng.choices(range(1, 6), STARS_WEIGHTS)[0], created_at))
+
+            for _ in range(min(int(rng.paretovariate(1.5)) - 1, 100)):
+                add(
+                    "worker_requests",
+                    (
+                        next_ids["worker_requests"], rng.randrange(first_user_id, first_user_id + users), worker_id,
+                        rng.choices(REQUEST_STATUSES, REQUEST_STATUS_WEIGHTS)[0], created_at,
+                    ),
+                )
+
+        for table, rows in buffers.items():
+            if len(rows) >= chunk_size:
+                yield table, rows
+                buffers[table] = []
+
+    for table, rows in buffers.items():
+        if rows:
+            yield table, rows
+
+
+## Function to read the first free id of each table, so generated rows never collide with existing ones
+async def next_free_ids(cursor):
+    first_ids = {}
+    for table in TABLES:
+        await cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+        first_ids[table] = (await cursor.fetchone())[0]
+    return first_ids
+
+
+## Function to bulk insert a generated dataset, returns the number of rows per table
+async def load_into_database(connection, users: int, seed: int = DEFAULT_SEED, domain: str = DEFAULT_DOMAIN, chunk_size: int = CHUNK_SIZE):
+    cursor = await connection.cursor()
+    first_ids = await next_free_ids(cursor)
+    counts = dict.fromkeys(TABLES, 0)
+
+    # Rows reference each other by explicit id, checks are skipped while loading
+    await cursor.execute("SET SESSION foreign_key_checks = 0, unique_checks = 0")
+    try:
+        for table, rows in generate_rows(users, seed, first_ids, domain, chunk_size):
+            columns = TABLES[table]
+            # executemany sends the chunk as one multi-row INSERT
+            await cursor.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                rows,
+            )
+            await connection.commit()
+            counts[table] += len(rows)
+    finally:
+        await cursor.execute("SET SESSION foreign_key_checks = 1, unique_checks = 1")
+
+    await rebuild_rating_summary(cursor)
+    await connection.commit()
+    return counts
+
+
+def tsv_value(value) -> str:
+    # LOAD DATA defaults: tab separated, \N for NULL, backslash escapes
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+## Function to write a generated dataset as one .tsv file per table plus load.sql, returns the number of rows per table
+def write_load_files(output_dir: str, users: int, seed: int = DEFAULT_SEED, domain: str = DEFAULT_DOMAIN, chunk_size: int = CHUNK_SIZE):
+    os.makedirs(output_dir, exist_ok=True)
+    output_dir = os.path.abspath(output_dir)
+    paths = {table: os.path.join(output_dir, f"{table}.tsv") for table in TABLES}
+    files = {table: open(path, "w", encoding="utf-8", newline="\n") for table, path in paths.items()}
+    counts = dict.fromkeys(TABLES, 0)
+
+    try:
+        for table, rows in generate_rows(users, seed, None, domain, chunk_size):
+            files[table].writelines("\t".join(tsv_value(value) for value in row) + "\n" for row in rows)
+            counts[table] += len(rows)
+    finally:
+        for file in files.values():
+            file.close()
+
+    with open(os.path.join(output_dir, "load.sql"), "w", encoding="utf-8") as file:
+        file.write(f"-- Synthetic dataset: {users} users, seed {seed}. Load into an empty schema:\n")
+        file.write("--     mysql --local-infile=1 findworkers < load.sql\n")
+        file.write("-- then fill rating_summary with: python manage.py rebuild-rating-summary\n")
+        file.write("SET foreign_key_checks = 0;\nSET unique_checks = 0;\n")
+        for table, columns in TABLES.items():
+            file.write(
+                f"LOAD DATA LOCAL INFILE '{paths[table]}' INTO TABLE {table} "
+                f"CHARACTER SET utf8mb4 ({', '.join(columns)});\n"
+            )
+        file.write("SET foreign_key_checks = 1;\nSET unique_checks = 1;\n")
+
+    return counts
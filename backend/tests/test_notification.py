@@ -0,0 +1,113 @@
+## Tests of the SSE notification hubs: ordered delivery to every subscriber, within a process
+## and across processes sharing the SQLite broker, heartbeats and slow subscribers
+import asyncio
+
+import notification
+from broker import InProcessBroker, SQLiteBroker
+from notification import NotificationHub, SUBSCRIBER_QUEUE_SIZE
+
+
+def drain(subscriber):
+    notifications = []
+    while not subscriber.queue.empty():
+        notifications.append(subscriber.queue.get_nowait())
+    return notifications
+
+
+## Request stand-in for event_stream, the client disconnects after `connected_checks` checks
+class FakeRequest:
+    def __init__(self, connected_checks: int):
+        self.connected_checks = connected_checks
+
+    async def is_disconnected(self) -> bool:
+        self.connected_checks -= 1
+        return self.connected_checks < 0
+
+
+def test_every_subscriber_gets_notifications_in_order():
+    async def run():
+        broker = InProcessBroker()
+        hub = NotificationHub("worker", broker)
+        await broker.start(lambda channel, key, message: hub.publish(key, message))
+
+        first, second, other_key = hub.subscribe(1), hub.subscribe(1), hub.subscribe(2)
+        for seq in range(50):
+            await broker.publish("worker", 1, f"message {seq}")
+        await broker.stop()
+        return drain(first), drain(second), drain(other_key)
+
+    first, second, other_key = asyncio.run(run())
+    expected = [f"message {seq}" for seq in range(50)]
+    assert first == expected
+    assert second == expected
+    assert other_key == []
+
+
+def test_shared_broker_delivers_in_order_to_every_process(tmp_path):
+    # Two brokers on one log stand for two uvicorn processes
+    async def run():
+        path = str(tmp_path / "notifications.db")
+        hubs, subscribers = [], []
+        for _ in range(2):
+            broker = SQLiteBroker(path, poll_interval=0.005)
+            hub = NotificationHub("worker", broker)
+            await broker.start(lambda channel, key, message, hub=hub: hub.publish(key, message))
+            hubs.append(hub)
+            subscribers.append(hub.subscribe(1))
+
+        # At most a queue's worth, the subscribers are only drained once everything is published
+        for seq in range(SUBSCRIBER_QUEUE_SIZE):
+            await hubs[0].broker.publish("worker", 1, f"message {seq}")
+
+        received = [[] for _ in subscribers]
+        async def wait_for_all():
+            while any(len(messages) < SUBSCRIBER_QUEUE_SIZE for messages in received):
+                for messages, subscriber in zip(received, subscribers):
+                    messages.extend(drain(subscriber))
+                await asyncio.sleep(0.01)
+        try:
+            await asyncio.wait_for(wait_for_all(), timeout=10)
+        finally:
+            for hub in hubs:
+                await hub.broker.stop()
+        return received
+
+    expected = [f"message {seq}" for seq in range(SUBSCRIBER_QUEUE_SIZE)]
+    for messages in asyncio.run(run()):
+        assert messages == expected
+
+
+def test_idle_stream_sends_heartbeats_until_the_client_leaves(monkeypatch):
+    monkeypatch.setattr(notification, "HEARTBEAT_INTERVAL", 0.01)
+
+    async def run():
+        hub = NotificationHub("worker", InProcessBroker())
+        stream = hub.event_stream(FakeRequest(connected_checks=1), 1)
+
+        events = [await anext(stream)]
+        hub.publish(1, "hello")
+        events.append(await anext(stream))
+        # The client is gone at the next idle check: the stream ends and unsubscribes
+        events.extend([event async for event in stream])
+        return events, hub.subscriber_count()
+
+    events, subscribers = asyncio.run(run())
+    assert events == [": heartbeat\n\n", "data: hello\n\n"]
+    assert subscribers == 0
+
+
+def test_slow_subscriber_drops_its_oldest_notifications_only():
+    async def run():
+        hub = NotificationHub("worker", InProcessBroker())
+        slow, fast = hub.subscribe(1), hub.subscribe(1)
+
+        fast_received = []
+        for seq in range(SUBSCRIBER_QUEUE_SIZE + 10):
+            hub.publish(1, f"message {seq}")
+            fast_received.extend(drain(fast))
+        return drain(slow), fast_received, hub.dropped
+
+    slow_received, fast_received, dropped = asyncio.run(run())
+    assert fast_received == [f"message {seq}" for seq in range(SUBSCRIBER_QUEUE_SIZE + 10)]
+    assert slow_received == [f"message {seq}" for seq in range(10, SUBSCRIBER_QUEUE_SIZE + 10)]
+    assert dropped == 10
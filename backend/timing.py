@@ -0,0 +1,194 @@
+## Per-request timing: pool acquire, SQL, auth and serialization, sent back as a Server-Timing
+## header and logged as one JSON line per request.
+## Phases may overlap: "auth" includes the identity lookup, whose queries also count in "db".
+##
+## Off by default (REQUEST_TIMING=1 turns it on). When off the middleware and the route
+## wrappers are not installed, and the database layer only reads a context variable.
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import logging
+import os
+import time
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+
+
+REQUEST_TIMING = os.getenv("REQUEST_TIMING", "0") == "1"
+
+## Phases reported, in header order
+PHASES = ("pool", "db", "auth", "serialize")
+
+timing_logger = logging.getLogger("findworker.timing")
+if REQUEST_TIMING and not timing_logger.handlers:
+    timing_logger.addHandler(logging.StreamHandler())
+    timing_logger.setLevel(logging.INFO)
+
+
+## Timings of one request, milliseconds per phase
+class RequestTimings:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.endpoint_done_at = None
+        self._active = set()
+
+    @contextmanager
+    def measure(self, phase: str):
+        # A phase nested in itself (e.g. one auth dependency calling another) is counted once
+        if phase in self._active:
+            yield
+            return
+
+        self._active.add(phase)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] += (time.perf_counter() - start) * 1000
+            self._active.discard(phase)
+
+    def add_query(self, milliseconds: float):
+        self.queries += 1
+        self.phases["db"] += milliseconds
+
+    def total(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def header(self) -> str:
+        entries = [f"{phase};dur={self.phases[phase]:.2f}" for phase in PHASES]
+        entries[PHASES.index("db")] += f';desc="{self.queries} queries"'
+        entries.append(f"total;dur={self.total():.2f}")
+        return ", ".join(entries)
+
+
+## Timings of the current request, None when timing is off or outside a request
+current_timings: ContextVar[RequestTimings | None] = ContextVar("current_timings", default=None)
+
+
+## Context manager adding the time of the block to a phase of the current request
+@contextmanager
+def timed(phase: str):
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    with timings.measure(phase):
+        yield
+
+
+## Cursor timing each statement and fetch into the "db" phase of the request
+class TimedCursor:
+    def __init__(self, cursor, timings: RequestTimings):
+        self._cursor = cursor
+        self._timings = timings
+
+    async def _timed(self, method, *args, count: bool = False):
+        start = time.perf_counter()
+        try:
+            return await method(*args)
+        finally:
+            milliseconds = (time.perf_counter() - start) * 1000
+            if count:
+                self._timings.add_query(milliseconds)
+            else:
+                # Rows of an unbuffered cursor are read from the server while fetching
+                self._timings.phases["db"] += milliseconds
+
+    async def execute(self, operation, params=()):
+        return await self._timed(self._cursor.execute, operation, params, count=True)
+
+    async def executemany(self, operation, seq_params):
+        return await self._timed(self._cursor.executemany, operation, seq_params, count=True)
+
+    async def fetchone(self):
+        return await self._timed(self._cursor.fetchone)
+
+    async def fetchmany(self, size: int = 1):
+        return await self._timed(self._cursor.fetchmany, size)
+
+    async def fetchall(self):
+        return await self._timed(self._cursor.fetchall)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+## Route class timing the serialization: from the endpoint's return to the response being built
+class TimedRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs):
+        if REQUEST_TIMING:
+            endpoint = timed_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        if not REQUEST_TIMING:
+            return handler
+
+        async def timed_handler(request):
+            response = await handler(request)
+            timings = current_timings.get()
+            if timings is not None and timings.endpoint_done_at is not None:
+                timings.phases["serialize"] += (time.perf_counter() - timings.endpoint_done_at) * 1000
+            return response
+
+        return timed_handler
+
+
+def timed_endpoint(endpoint):
+    # Same signature for FastAPI (it follows __wrapped__), every endpoint of the app is async
+    async def wrapper(*args, **kwargs):
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            timings = current_timings.get()
+            if timings is not None:
+                timings.endpoint_done_at = time.perf_counter()
+
+    wrapper.__wrapped__ = endpoint
+    wrapper.__name__ = endpoint.__name__
+    wrapper.__doc__ = endpoint.__doc__
+    return wrapper
+
+
+## ASGI middleware collecting the timings of each request
+class ServerTimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        status_code = None
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                # Streaming bodies (SSE, NDJSON) keep running after this, the log line has their totals
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", timings.header())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timings.reset(token)
+            timing_logger.info(
+                json.dumps(
+                    {
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status_code,
+                        "total_ms": round(timings.total(), 2),
+                        "queries": timings.queries,
+                        **{f"{phase}_ms": round(timings.phases[phase], 2) for phase in PHASES},
+                    }
+                )
+            )
@@ -0,0 +1,141 @@
+## Offline IPv4 geolocation from a memory-mapped range table
+##
+## File layout (little-endian), built by `python manage.py build-ip-ranges`:
+##     header   magic "FWIP", version, range count, offset of the string table
+##     starts   count x uint32, first address of each range, sorted
+##     ends     count x uint32, last address of each range
+##     records  count x (float32 latitude, float32 longitude, uint32 city offset, uint32 org offset)
+##     strings  city and organization names, uint16 length + utf-8 bytes, each name stored once
+## The organization is what ipinfo returns as "org" (NO_STRING when the dump has none).
+## A lookup is a binary search over `starts`, straight on the mapped pages.
+from array import array
+import bisect
+import csv
+import ipaddress
+import mmap
+import socket
+import struct
+import sys
+
+
+MAGIC = b"FWIP"
+VERSION = 2
+HEADER = struct.Struct("<4sHxxII")
+RECORD = struct.Struct("<ffII")
+CITY_LENGTH = struct.Struct("<H")
+NO_STRING = 0xFFFFFFFF
+
+
+## Function to read an IPv4 address given as dotted text or as an integer, ValueError for anything else
+def parse_ipv4(value: str) -> int:
+    value = value.strip()
+    if value.isdigit():
+        # Integers of IPv6 ranges (2^32 and above) are rejected like their text form
+        return int(ipaddress.IPv4Address(int(value)))
+    return int(ipaddress.IPv4Address(value))
+
+
+## Function to convert a CSV range dump (start_ip, end_ip, city, latitude, longitude[, org]) into the mmap format
+def build_range_file(csv_path: str, output_path: str) -> int:
+    ranges = []
+    with open(csv_path, newline="", encoding="utf-8") as file:
+        for row in csv.reader(file):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                start, end = parse_ipv4(row[0]), parse_ipv4(row[1])
+                latitude, longitude = float(row[3]), float(row[4])
+            except ValueError:
+                # Header line, IPv6 range or malformed row
+                continue
+            org = row[5].strip() if len(row) > 5 and row[5].strip() else None
+            ranges.append((start, end, row[2], latitude, longitude, org))
+
+    ranges.sort()
+
+    starts, ends = array("I"), array("I")
+    records = bytearray()
+    strings = bytearray()
+    string_offsets = {}
+
+    def string_offset(value):
+        if value is None:
+            return NO_STRING
+        if value not in string_offsets:
+            encoded = value.encode("utf-8")
+            string_offsets[value] = len(strings)
+            strings.extend(CITY_LENGTH.pack(len(encoded)) + encoded)
+        return string_offsets[value]
+
+    previous_end = -1
+    for start, end, city, latitude, longitude, org in ranges:
+        # Overlapping ranges would break the binary search, the first one wins
+        if start <= previous_end or end < start:
+            continue
+        previous_end = end
+
+        starts.append(start)
+        ends.append(end)
+        records += RECORD.pack(latitude, longitude, string_offset(city), string_offset(org))
+
+    if sys.byteorder != "little":
+        starts.byteswap()
+        ends.byteswap()
+
+    count = len(starts)
+    strings_offset = HEADER.size + count * (4 + 4 + RECORD.size)
+    with open(output_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, count, strings_offset))
+        file.write(starts.tobytes())
+        file.write(ends.tobytes())
+        file.write(records)
+        file.write(strings)
+
+    return count
+
+
+## Read-only view of a range file, pages are loaded by the OS on demand and shared between processes
+class IpRangeTable:
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.count, self._strings_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an IP range file (version {VERSION}), rebuild it with manage.py build-ip-ranges")
+        if sys.byteorder != "little":
+            raise ValueError("IP range files can only be mapped on little-endian hosts")
+
+        view = memoryview(self._map)
+        starts_offset = HEADER.size
+        ends_offset = starts_offset + self.count * 4
+        self._records_offset = ends_offset + self.count * 4
+        self._starts = view[starts_offset:ends_offset].cast("I")
+        self._ends = view[ends_offset:self._records_offset].cast("I")
+
+    def lookup(self, ip: str):
+        # inet_pton is strict and much faster than ipaddress on the lookup path
+        try:
+            address = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+        except (OSError, TypeError):
+            return None
+
+        index = bisect.bisect_right(self._starts, address) - 1
+        if index < 0 or address > self._ends[index]:
+            return None
+
+        latitude, longitude, city_offset, org_offset = RECORD.unpack_from(self._map, self._records_offset + index * RECORD.size)
+        return self._string(city_offset), round(latitude, 4), round(longitude, 4), self._string(org_offset)
+
+    def _string(self, offset: int):
+        if offset == NO_STRING:
+            return None
+        position = self._strings_offset + offset
+        (length,) = CITY_LENGTH.unpack_from(self._map, position)
+        return self._map[position + CITY_LENGTH.size:position + CITY_LENGTH.size + length].decode("utf-8")
+
+    def close(self):
+        self._starts.release()
+        self._ends.release()
+        self._map.close()
+        self._file.close()
@@ -1,10 +1,19 @@
-from auth.hashing import Hash
+import json
+from auth.hashing import hashing_pool
+from database import connection_pool
+
+
+## Columns of users that can be listed (never the password hash)
+USER_FIELDS = ("id", "email", "created_at")
+
+## Rows read from the server per fetch when streaming users
+STREAM_FETCH_SIZE = 500
 
 
 ## Helper function to check if email already exists
-def email_exists(cursor, email: str) -> bool:
-    cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-    return cursor.fetchone() is not None
+async def email_exists(cursor, email: str) -> bool:
+    await cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
+    return await cursor.fetchone() is not None
 
 
 ## Helper function to validate password length
@@ -12,10 +21,14 @@ def validate_password_length(password: str) -> bool:
     return len(password) >= 4
 
 
+## Helper function to hash a new user's password, before any connection is checked out for the insert
+async def hash_new_password(password: str) -> str:
+    return await hashing_pool.hash(password)
+
+
 ## Helper function to insert a new user into the database
-def insert_new_user(cursor, data):
-    hashed_password = Hash.bcrypt(data.password)
-    cursor.execute(
+async def insert_new_user(cursor, data, hashed_password: str):
+    await cursor.execute(
         "INSERT INTO users (email, password) VALUES (%s, %s)",
         (data.email, hashed_password),
     )
@@ -25,25 +38,69 @@ def insert_new_user(cursor, data):
     )  # Return new user ID and row count for success check
 
 
-## Helper function to get all users
-def list_all_users(cursor):
-    cursor.execute("SELECT * FROM users")
-    return cursor.fetchall()
+## Helper function to build the keyset query listing users (id order, only the given columns)
+def users_page_query(fields, after_id: int | None, limit: int | None):
+    # Fields are checked against USER_FIELDS by the caller, id is always read for the keyset
+    columns = ", ".join(dict.fromkeys(("id", *fields)))
+    query = f"SELECT {columns} FROM users"
+    params = []
+
+    if after_id is not None:
+        query += " WHERE id > %s"
+        params.append(after_id)
+    query += " ORDER BY id"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    return query, tuple(params)
+
 
+## Helper function to get a page of users
+async def list_users_page(cursor, fields, after_id: int | None, limit: int | None):
+    await cursor.execute(*users_page_query(fields, after_id, limit))
+    return await cursor.fetchall()
 
-## Helper function to check if the user profile already exists
-def profile_exists(cursor, user_id: int) -> bool:
-    cursor.execute("SELECT id FROM profile WHERE user_id = %s", (user_id,))
-    return cursor.fetchone() is not None
+
+## Function to encode a user row as one NDJSON line
+def encode_user_line(row: dict, fields) -> str:
+    return json.dumps(
+        {field: row[field].isoformat() if hasattr(row[field], "isoformat") else row[field] for field in fields}
+    ) + "\n"
+
+
+## Generator streaming users as NDJSON from an unbuffered cursor, memory stays at one fetch.
+## It checks out its own connection: the request's one is released before the body is sent.
+async def stream_users(fields, after_id: int | None, limit: int | None):
+    connection = await connection_pool.get_connection()
+    finished = False
+    try:
+        cursor = await connection.cursor(dictionary=True)
+        await cursor.execute(*users_page_query(fields, after_id, limit))
+
+        while True:
+            rows = await cursor.fetchmany(STREAM_FETCH_SIZE)
+            if not rows:
+                break
+            yield "".join(encode_user_line(row, fields) for row in rows)
+
+        finished = True
+
+    finally:
+        if finished:
+            await connection.close()
+        else:
+            # Client went away or the query failed: drop the connection rather than read the rest
+            await connection.discard()
 
 
 ## Helper function to insert a new profile into the database
-def insert_profile(cursor, user_id: int, data):
+async def insert_profile(cursor, user_id: int, data):
     insert_query = """
         INSERT INTO profile (user_id, first_name, last_name, phone_number, gender, role, city, location, longitude, latitude) 
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
     """
-    cursor.execute(
+    await cursor.execute(
         insert_query,
         (
             user_id,
@@ -62,44 +119,38 @@ def insert_profile(cursor, user_id: int, data):
 
 
 ## Helper function to fetch user profile
-def fetch_profile(cursor, current_user):
-    cursor.execute("SELECT * FROM profile WHERE user_id = %s", (current_user["id"],))
-    return cursor.fetchone()
+async def fetch_profile(cursor, current_user):
+    await cursor.execute("SELECT * FROM profile WHERE user_id = %s", (current_user["id"],))
+    return await cursor.fetchone()
 
 
 ## Helper function to delete user profile
-def delete_user_profile(cursor, current_user):
-    cursor.execute("DELETE FROM profile WHERE user_id = %s", (current_user["id"],))
+async def delete_user_profile(cursor, current_user):
+    await cursor.execute("DELETE FROM profile WHERE user_id = %s", (current_user["id"],))
 
 
 ## Helper function to update address
-def update_live_address(cursor, current_user, city, location, longitude, latitude):
+async def update_live_address(cursor, current_user, city, location, longitude, latitude):
     update_address_query = """
         UPDATE profile SET city = %s, location = %s, longitude = %s, latitude = %s WHERE user_id = %s
     """
 
-    cursor.execute(
+    await cursor.execute(
         update_address_query, (city, location, longitude, latitude, current_user["id"])
     )
     return cursor.rowcount
 
 
-## Helper function to get current user role
-def get_curr_user_role(cursor, current_user):
-    cursor.execute("SELECT role FROM profile WHERE user_id = %s", (current_user["id"],))
-    return cursor.fetchall()
-
-
 ## Helper function to switch user role
-def switch_user_role(cursor, current_user, role):
-    cursor.execute(
+async def switch_user_role(cursor, current_user, role):
+    await cursor.execute(
         "UPDATE profile SET role = %s WHERE user_id = %s",
         (role, current_user["id"]),
     )
 
 
-def create_message(cursor, data):
-    cursor.execute(
+async def create_message(cursor, data):
+    await cursor.execute(
         "INSERT INTO contact (email, subject, message) VALUES(%s, %s, %s)",
         (data.email, data.subject, data.message),
     )
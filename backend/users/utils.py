@@ -1,20 +1,238 @@
-import requests
+from collections import OrderedDict
+import asyncio
+import ipaddress
+import os
+import random
+import time
+import httpx
 
+from metrics import cache_entries
+from .ip_ranges import IpRangeTable
+
+
+## Geolocation settings
+GEOLOCATION_PROVIDER = os.getenv("GEOLOCATION_PROVIDER", "ipinfo")
+GEOLOCATION_URL = os.getenv("GEOLOCATION_URL", "https://ipinfo.io")
+GEOLOCATION_TIMEOUT = float(os.getenv("GEOLOCATION_TIMEOUT", "3"))
+GEOLOCATION_RETRIES = 2
+GEOLOCATION_BACKOFF = 0.2
+GEOLOCATION_CACHE_SIZE = 4096
+GEOLOCATION_CACHE_TTL = float(os.getenv("GEOLOCATION_CACHE_TTL", "3600"))
+
+## Range file used by the offline provider (see `python manage.py build-ip-ranges`)
+GEOLOCATION_RANGES_PATH = os.getenv("GEOLOCATION_RANGES_PATH", "ip_ranges.bin")
+
+## Reverse proxies whose X-Forwarded-For header is trusted, comma separated addresses or networks
+## (e.g. "127.0.0.1,10.0.0.0/8"). From anyone else the header is ignored, it could be forged.
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.getenv("TRUSTED_PROXIES", "").split(",")
+    if network.strip()
+]
+
+
+## Error worth retrying (network error, timeout, upstream 5xx or 429)
+class TransientGeolocationError(Exception):
+    pass
 
-def get_location():
-    try:
-        # Get the current IP location
-        response = requests.get('https://ipinfo.io/json')
-        data = response.json()
+
+## Provider backed by the ipinfo.io JSON API (or any server answering the same way, e.g. a local stub)
+class IpinfoProvider:
+    def __init__(self, base_url: str = GEOLOCATION_URL, timeout: float = GEOLOCATION_TIMEOUT):
+        self.base_url = base_url
+        self.timeout = timeout
+        self._client = None
+
+    def _get_client(self):
+        # One pooled client for all lookups, connections are kept alive between them
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return self._client
+
+    async def lookup(self, ip: str | None):
+        # No public IP: locate the server itself, as before
+        try:
+            response = await self._get_client().get(f"/{ip}/json" if ip else "/json")
+        except httpx.TransportError as e:
+            raise TransientGeolocationError(str(e))
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientGeolocationError(f"upstream answered {response.status_code}")
+        if response.status_code != 200:
+            return None
+
+        try:
+            data = response.json()
+        except ValueError:
+            raise TransientGeolocationError("upstream answered a body that is not JSON")
+        if not isinstance(data, dict) or "loc" not in data or "city" not in data:
+            return None
 
         # Extract latitude and longitude
-        loc = data['loc'].split(',')
-        latitude = loc[0]
-        longitude = loc[1]
-        city = data['city']
-        location = data["org"]
-
-        return city, latitude, longitude, location
-    except Exception as e:
-        print(f"Error: {e}")
-        return None 
\ No newline at end of file
+        latitude, longitude = data["loc"].split(",")
+        return data["city"], latitude, longitude, data.get("org")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+## Provider answering from a local memory-mapped IP range table, no network access
+class OfflineProvider:
+    def __init__(self, path: str = GEOLOCATION_RANGES_PATH):
+        self.path = path
+        self._table = None
+        self._disabled = False
+
+    def open(self):
+        # Checked once (at startup): without a usable range file the provider is disabled
+        # and every IP is unknown, instead of failing each request
+        if self._table is not None or self._disabled:
+            return
+        try:
+            self._table = IpRangeTable(self.path)
+        except (OSError, ValueError) as e:
+            self._disabled = True
+            print(f"Offline geolocation disabled, every IP is unknown: {e}")
+
+    async def lookup(self, ip: str | None):
+        # The server's own location cannot be found offline
+        if ip is None:
+            return None
+
+        # Opened at startup by the app, on the first lookup otherwise
+        self.open()
+        if self._table is None:
+            return None
+
+        result = self._table.lookup(ip)
+        if result is None:
+            return None
+
+        # Same fields as ipinfo: the last one is the organization ("org"), None when the dump has none
+        city, latitude, longitude, org = result
+        return city, str(latitude), str(longitude), org
+
+    async def aclose(self):
+        if self._table is not None:
+            self._table.close()
+            self._table = None
+
+
+## Available providers, selected with GEOLOCATION_PROVIDER
+PROVIDERS = {
+    "ipinfo": IpinfoProvider,
+    "offline": OfflineProvider,
+}
+
+
+## Async geolocation client: TTL + LRU cache keyed by IP, retries with jittered backoff,
+## concurrent lookups of the same IP share one upstream call
+class GeolocationClient:
+    def __init__(self, provider, cache_size: int = GEOLOCATION_CACHE_SIZE, ttl: float = GEOLOCATION_CACHE_TTL, retries: int = GEOLOCATION_RETRIES):
+        self.provider = provider
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.retries = retries
+        self.cache = OrderedDict()
+        self._in_flight = {}
+
+    def _cache_get(self, ip):
+        entry = self.cache.get(ip)
+        if entry is None:
+            return None
+
+        expires_at, location = entry
+        if expires_at < time.monotonic():
+            del self.cache[ip]
+            return None
+
+        self.cache.move_to_end(ip)
+        return location
+
+    def _cache_put(self, ip, location):
+        self.cache[ip] = (time.monotonic() + self.ttl, location)
+        self.cache.move_to_end(ip)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def _lookup_with_retries(self, ip):
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.provider.lookup(ip)
+            except TransientGeolocationError as e:
+                if attempt == self.retries:
+                    print(f"Geolocation failed for {ip or 'server'}: {e}")
+                    return None
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, GEOLOCATION_BACKOFF * 2 ** attempt))
+
+    async def get_location(self, ip: str | None):
+        location = self._cache_get(ip)
+        if location is not None:
+            return location
+
+        task = self._in_flight.get(ip)
+        if task is None:
+            task = asyncio.ensure_future(self._lookup_with_retries(ip))
+            self._in_flight[ip] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(ip, None))
+
+        location = await asyncio.shield(task)
+
+        # Failures are not cached, the next request tries again
+        if location is not None:
+            self._cache_put(ip, location)
+        return location
+
+    def start(self):
+        if hasattr(self.provider, "open"):
+            self.provider.open()
+
+    async def aclose(self):
+        if hasattr(self.provider, "aclose"):
+            await self.provider.aclose()
+
+
+geolocation = GeolocationClient(PROVIDERS[GEOLOCATION_PROVIDER]())
+cache_entries.track(("geolocation",), lambda: len(geolocation.cache))
+
+
+def parse_ip(value):
+    try:
+        return ipaddress.ip_address(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_trusted_proxy(address) -> bool:
+    return address is not None and any(address in network for network in TRUSTED_PROXIES)
+
+
+## Function to get the public IP of the client. Behind trusted proxies it is the last
+## X-Forwarded-For hop that is not one of them, the hops before it are client-supplied.
+def client_ip(request):
+    address = parse_ip(request.client.host if request.client else None)
+
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if forwarded_for and is_trusted_proxy(address):
+        for hop in reversed(forwarded_for.split(",")):
+            address = parse_ip(hop.strip())
+            if not is_trusted_proxy(address):
+                break
+
+    if address is None:
+        return None
+
+    # Private and loopback addresses cannot be located, the server's location is used instead
+    return str(address) if address.is_global else None
+
+
+## Function to get the location of an IP: (city, latitude, longitude, location) or None
+async def get_location(ip: str | None = None):
+    return await geolocation.get_location(ip)
@@ -1,84 +1,118 @@
-from fastapi import Depends, APIRouter, HTTPException, status
-from fastapi.responses import JSONResponse
-import requests
-from database import get_db
+from fastapi import Depends, APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Optional
+from database import get_db, pooled_connection, PooledConnection
+from timing import TimedRoute
 from .schemas import UserCreate, UserProfile, ProfileUpdate, UserResponse, Contact
-from mysql.connector import connection
 from auth.views import get_current_user
-from .utils import get_location
+from auth.identity import get_identity
+from auth.services import bump_claims_version
+from search_workers.hooks import worker_changed
+from .utils import get_location, client_ip
 from .services import (
     email_exists,
     validate_password_length,
+    hash_new_password,
     insert_new_user,
-    list_all_users,
-    profile_exists,
+    list_users_page,
+    stream_users,
+    USER_FIELDS,
     insert_profile,
     fetch_profile,
     delete_user_profile,
     update_live_address,
-    get_curr_user_role,
     switch_user_role,
     create_message,
 )
 
 
-user_router = APIRouter()
+user_router = APIRouter(route_class=TimedRoute)
 
 user_tags = ["User"]
 profile_tags = ["Profile"]
 
+## Largest page of the JSON listing of users when a limit is given
+## (without one every user is returned, as before; NDJSON streams are not capped)
+MAX_USERS_PAGE = 1000
+
 
 ## POST Endpoint: Create an user.
 @user_router.post("/user/", status_code=status.HTTP_201_CREATED, tags=user_tags)
-async def create_user(
-    data: UserCreate, db: connection.MySQLConnection = Depends(get_db)
-):
-    cursor = db.cursor()
+async def create_user(data: UserCreate):
+    # Validate password length
+    if not validate_password_length(data.password):
+        return JSONResponse(
+            content={"detail": "Password must contain at least 4 characters"},
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
 
-    try:
-        # Check if the email already exists
-        if email_exists(cursor, data.email):
-            return JSONResponse(
-                content={"detail": "Email already registered"},
-                status_code=status.HTTP_409_CONFLICT,
-            )
+    # Hash before checking out a connection, a sign-up waiting for a hashing process must not
+    # hold one of the pool's connections. When hashing is saturated the 503 goes to the client.
+    hashed_password = await hash_new_password(data.password)
 
-        # Validate password length
-        if not validate_password_length(data.password):
-            return JSONResponse(
-                content={"detail": "Password must contain at least 4 characters"},
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            )
+    async with pooled_connection() as db:
+        cursor = await db.cursor()
 
-        # Insert the new user and commit
-        user_id, affected_rows = insert_new_user(cursor, data)
-        if affected_rows > 0:
-            db.commit()
-            return JSONResponse(
-                content={"detail": "User created successfully"},
-                status_code=status.HTTP_201_CREATED,
-            )
-        else:
+        try:
+            # Check if the email already exists
+            if await email_exists(cursor, data.email):
+                return JSONResponse(
+                    content={"detail": "Email already registered"},
+                    status_code=status.HTTP_409_CONFLICT,
+                )
+
+            # Insert the new user and commit
+            user_id, affected_rows = await insert_new_user(cursor, data, hashed_password)
+            if affected_rows > 0:
+                await db.commit()
+                return JSONResponse(
+                    content={"detail": "User created successfully"},
+                    status_code=status.HTTP_201_CREATED,
+                )
+            else:
+                return JSONResponse(
+                    content={"detail": "Something went wrong, Try again!"},
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                )
+
+        except Exception as e:
+            await db.rollback()
             return JSONResponse(
-                content={"detail": "Something went wrong, Try again!"},
+                content={"detail": f"Failed to create new user: {str(e)}"},
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
-    except Exception as e:
-        db.rollback()
-        return JSONResponse(
-            content={"detail": f"Failed to create new user: {str(e)}"},
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        )
-
 
 ## GET Endpoint: List all users.
 @user_router.get("/users/", status_code=status.HTTP_200_OK, tags=user_tags)
-async def all_users(db: connection.MySQLConnection = Depends(get_db)):
-    cursor = db.cursor(dictionary=True)
+async def all_users(
+    response: Response,
+    format: str = Query("json", pattern="^(json|ndjson)$", description="json list, or ndjson stream of all the users"),
+    fields: str = Query(",".join(USER_FIELDS), description=f"Comma separated columns among {', '.join(USER_FIELDS)}"),
+    after_id: Optional[int] = Query(None, description="Only users with a greater id (keyset pagination)"),
+    limit: Optional[int] = Query(None, description=f"Number of users, json pages at most {MAX_USERS_PAGE} (default: all)", gt=0),
+):
+    # Column projection, only whitelisted columns can be selected
+    selected_fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown_fields = [field for field in selected_fields if field not in USER_FIELDS]
+    if not selected_fields or unknown_fields:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Fields must be among {', '.join(USER_FIELDS)}",
+        )
 
-    # Get all the users
-    result = list_all_users(cursor)
+    # NDJSON: stream the users one line each, memory does not grow with the table.
+    # The stream checks out its own connection, none is held while it is set up
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_users(selected_fields, after_id, limit), media_type="application/x-ndjson"
+        )
+
+    # Paging is opt-in: with a limit, one extra row tells if there is a next page
+    page_size = min(limit, MAX_USERS_PAGE) if limit is not None else None
+    async with pooled_connection() as db:
+        cursor = await db.cursor(dictionary=True)
+        result = await list_users_page(cursor, selected_fields, after_id, page_size + 1 if page_size else None)
 
     # If no users found
     if not result:
@@ -86,24 +120,28 @@ async def all_users(db: connection.MySQLConnection = Depends(get_db)):
             status_code=status.HTTP_404_NOT_FOUND, detail="No users found"
         )
 
+    if page_size is not None and len(result) > page_size:
+        result = result[:page_size]
+        response.headers["X-Next-After-Id"] = str(result[-1]["id"])
+
     # Return the list of users
-    return result
+    return [{field: row[field] for field in selected_fields} for row in result]
 
 
 ## POST Endpoint: Create or Update user profile.
 @user_router.post("/profile/", status_code=status.HTTP_201_CREATED, tags=profile_tags)
 async def create_or_update_profile(
     data: UserProfile,
-    db: connection.MySQLConnection = Depends(get_db),
-    current_user: UserResponse = Depends(get_current_user),
+    db: PooledConnection = Depends(get_db),
+    current_user: dict = Depends(get_identity),
 ):
-    cursor = db.cursor()
+    cursor = await db.cursor()
 
     try:
         # Check if the user profile already exists
-        if profile_exists(cursor, current_user["id"]):
+        if current_user["profile_id"] is not None:
             # Update profile logic from PATCH endpoint
-            cursor = db.cursor()
+            cursor = await db.cursor()
 
             # Prepare the update query, checking if the fields are provided
             query = "UPDATE profile SET "
@@ -157,16 +195,21 @@ async def create_or_update_profile(
             query += ", ".join(update_fields) + " WHERE user_id = %s"
             update_values.append(current_user["id"])
 
-            cursor.execute(query, tuple(update_values))
-            db.commit()
+            await cursor.execute(query, tuple(update_values))
+            if data.role and not data.role == "string":
+                await bump_claims_version(cursor, current_user["id"])
+            await db.commit()
+            await worker_changed(db, current_user["id"])
 
             return JSONResponse(content={"detail": "Profile updated successfully!"}, status_code=status.HTTP_200_OK)
 
         # Insert the new profile into the database if it doesn't exist
-        affected_rows = insert_profile(cursor, current_user["id"], data)
+        affected_rows = await insert_profile(cursor, current_user["id"], data)
 
         if affected_rows > 0:
-            db.commit()
+            await bump_claims_version(cursor, current_user["id"])
+            await db.commit()
+            await worker_changed(db, current_user["id"])
             return {"detail": "Profile created successfully"}
         else:
             return JSONResponse(
@@ -175,7 +218,7 @@ async def create_or_update_profile(
             )
 
     except Exception as e:
-        db.rollback()  # Roll back transaction in case of any error
+        await db.rollback()  # Roll back transaction in case of any error
         return JSONResponse(
             content={"detail": f"{str(e)}"},
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -185,13 +228,13 @@ async def create_or_update_profile(
 ## GET Endpoint: View user profile.
 @user_router.get("/profile/", status_code=status.HTTP_200_OK, tags=profile_tags)
 async def view_profile(
-    db: connection.MySQLConnection = Depends(get_db),
+    db: PooledConnection = Depends(get_db),
     current_user: UserResponse = Depends(get_current_user),
 ):
-    cursor = db.cursor(dictionary=True)
+    cursor = await db.cursor(dictionary=True)
 
     # Fetch user profile
-    result = fetch_profile(cursor, current_user)
+    result = await fetch_profile(cursor, current_user)
 
     if not result:
         raise HTTPException(
@@ -206,13 +249,13 @@ async def view_profile(
 @user_router.patch("/profile/", status_code=status.HTTP_200_OK, tags=profile_tags)
 async def update_profile(
     data: ProfileUpdate,
-    db: connection.MySQLConnection = Depends(get_db),
-    current_user: UserResponse = Depends(get_current_user),
+    db: PooledConnection = Depends(get_db),
+    current_user: dict = Depends(get_identity),
 ):
-    cursor = db.cursor()
+    cursor = await db.cursor()
 
     # Check if the profile exists
-    if not profile_exists(cursor, current_user["id"]):
+    if current_user["profile_id"] is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found"
         )
@@ -269,8 +312,11 @@ async def update_profile(
     query += ", ".join(update_fields) + " WHERE user_id = %s"
     update_values.append(current_user["id"])
 
-    cursor.execute(query, tuple(update_values))
-    db.commit()
+    await cursor.execute(query, tuple(update_values))
+    if data.role and not data.role == "string":
+        await bump_claims_version(cursor, current_user["id"])
+    await db.commit()
+    await worker_changed(db, current_user["id"])
 
     return {"message": "Profile updated successfully"}
 
@@ -278,26 +324,26 @@ async def update_profile(
 ## DELETE Endpoint: Delete user profile.
 @user_router.delete("/profile/", status_code=status.HTTP_200_OK, tags=profile_tags)
 async def delete_profile(
-    db: connection.MySQLConnection = Depends(get_db),
-    current_user: UserResponse = Depends(get_current_user),
+    db: PooledConnection = Depends(get_db),
+    current_user: dict = Depends(get_identity),
 ):
-    cursor = db.cursor()
+    cursor = await db.cursor()
 
     # Check if the profile exists
-    result = fetch_profile(cursor, current_user)
-
-    if not result:
+    if current_user["profile_id"] is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Profile not found"
         )
 
     try:
         # Delete user profile from the database
-        delete_user_profile(cursor, current_user)
-        db.commit()
+        await delete_user_profile(cursor, current_user)
+        await bump_claims_version(cursor, current_user["id"])
+        await db.commit()
+        await worker_changed(db, current_user["id"])
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete user profile: {str(e)}",
@@ -310,7 +356,8 @@ async def delete_profile(
 ## PUT Endpoint: Fetch user address using the ipinfo api and update it.
 @user_router.put("/update_address/", status_code=status.HTTP_200_OK, tags=profile_tags)
 async def update_address(
-    db: connection.MySQLConnection = Depends(get_db),
+    request: Request,
+    db: PooledConnection = Depends(get_db),
     current_user: UserResponse = Depends(get_current_user),
 ):
     if not current_user:
@@ -318,10 +365,10 @@ async def update_address(
             status_code=status.HTTP_404_NOT_FOUND, detail="User profile not found"
         )
 
-    cursor = db.cursor()
+    cursor = await db.cursor()
 
-    # Call get_location() to retrieve current user details
-    address = get_location()
+    # Locate the client IP (cached, does not block the event loop)
+    address = await get_location(client_ip(request))
 
     if address is None:
         raise HTTPException(
@@ -332,10 +379,11 @@ async def update_address(
     city, latitude, longitude, location = address
 
     try:
-        rowcount = update_live_address(
+        rowcount = await update_live_address(
             cursor, current_user, city, location, longitude, latitude
         )
-        db.commit()
+        await db.commit()
+        await worker_changed(db, current_user["id"])
 
         if rowcount > 0:
             return {"detail": "User address updated successfully"}
@@ -343,7 +391,7 @@ async def update_address(
             return {"detail": "Your address is up to date"}
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update live address: {str(e)}",
@@ -352,9 +400,9 @@ async def update_address(
 
 ## GET Endpoint: Fetch the current user address [city, latitude, longitude, location].
 @user_router.get("/get_address/", status_code=status.HTTP_200_OK, tags=profile_tags)
-async def get_address():
+async def get_address(request: Request):
     # Call get_location() function (it returns city, latitude, longitude, and address)
-    user_address = get_location()  # Renamed variable to avoid recursion
+    user_address = await get_location(client_ip(request))  # Renamed variable to avoid recursion
 
     if user_address is None:
         raise HTTPException(
@@ -377,34 +425,35 @@ async def get_address():
 ## PUT Endpoint: Update role in user profile (switch user role/type).
 @user_router.put("/switch_role/", status_code=status.HTTP_200_OK, tags=profile_tags)
 async def switch_role(
-    db: connection.MySQLConnection = Depends(get_db),
-    current_user: UserResponse = Depends(get_current_user),
+    db: PooledConnection = Depends(get_db),
+    current_user: dict = Depends(get_identity),
 ):
-    if not current_user:
+    if current_user["profile_id"] is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User profile not found"
         )
 
-    cursor = db.cursor(dictionary=True)
-
-    # Get the current user role
-    user_role = get_curr_user_role(cursor, current_user)
+    cursor = await db.cursor(dictionary=True)
 
     # Change the user role in their profile table (Worker to User Or User to Worker)
-    curr_user_role = user_role[0]["role"]
+    curr_user_role = current_user["role"]
 
     try:
         if curr_user_role == "Worker":
-            switch_user_role(cursor, current_user, "User")
-            db.commit()
+            await switch_user_role(cursor, current_user, "User")
+            await bump_claims_version(cursor, current_user["id"])
+            await db.commit()
+            await worker_changed(db, current_user["id"])
             return {"detail": "User profile switch to -User mode-"}
         else:
-            switch_user_role(cursor, current_user, "Worker")
-            db.commit()
+            await switch_user_role(cursor, current_user, "Worker")
+            await bump_claims_version(cursor, current_user["id"])
+            await db.commit()
+            await worker_changed(db, current_user["id"])
             return {"detail": "User profile switch to -Worker mode-"}
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to switch user role: {str(e)}",
@@ -413,18 +462,18 @@ async def switch_role(
 
 ## POST Endpoint: Contact us (user can connect with us and raise issues via contact us)
 @user_router.post("/contact/", status_code=status.HTTP_201_CREATED, tags=user_tags)
-async def contact(data: Contact, db: connection.MySQLConnection = Depends(get_db)):
-    cursor = db.cursor()
+async def contact(data: Contact, db: PooledConnection = Depends(get_db)):
+    cursor = await db.cursor()
 
     try:
-        create_message(cursor, data)
-        db.commit()
+        await create_message(cursor, data)
+        await db.commit()
         return JSONResponse(
             content={"detail": "Message send successfully!"},
             status_code=status.HTTP_201_CREATED,
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse(
             content={"detail": f"Failed to send message: {str(e)}"},
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
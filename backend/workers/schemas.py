@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from enums import RateEnum
-from typing import Optional
+from typing import List, Optional
 
 
 class WorkingAreaInfo(BaseModel):
@@ -18,6 +18,12 @@ class WorkingAreaInfoUpdate(BaseModel):
     description: Optional[str]
 
 
+class WorkingAreaInfoBatch(BaseModel):
+    create: List[WorkingAreaInfo] = []
+    update: List[WorkingAreaInfoUpdate] = []
+    delete: List[int] = []
+
+
 class Worker(BaseModel):
     profile_id: int
 
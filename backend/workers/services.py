@@ -2,39 +2,18 @@ import mysql.connector
 from fastapi import status, HTTPException
 
 
-## Helper function to fetch user profile
-def get_user_profile(cursor, user_id: int):
-    cursor.execute("SELECT id, role FROM profile WHERE user_id = %s", (user_id,))
-    return cursor.fetchone()
-
-
-## Helper function to check if worker already exists
-def is_worker_exists(cursor, profile_id: int):
-    cursor.execute("SELECT id FROM worker WHERE profile_id = %s", (profile_id,))
-    return cursor.fetchone() is not None
-
-
 ## Helper function to insert a new worker profile
-def create_worker_profile(cursor, profile_id: int):
-    cursor.execute("INSERT INTO worker (profile_id) VALUES (%s)", (profile_id,))
-
-
-## Helper function to get worker id by user id
-def get_worker_id_by_user_id(cursor, user_id: int):
-    cursor.execute(
-        "SELECT id FROM worker WHERE profile_id = (SELECT id FROM profile WHERE user_id = %s)",
-        (user_id,),
-    )
-    return cursor.fetchone()
+async def create_worker_profile(cursor, profile_id: int):
+    await cursor.execute("INSERT INTO worker (profile_id) VALUES (%s)", (profile_id,))
 
 
 ## Helper function to insert new working area informations
-def insert_working_area_info(cursor, worker_id: int, data):
+async def insert_working_area_info(cursor, worker_id: int, data):
     insert_query = """
         INSERT INTO working_area_info (worker_id, name, rate_type, rate, description) 
         VALUES (%s, %s, %s, %s, %s)
     """
-    cursor.execute(
+    await cursor.execute(
         insert_query,
         (
             worker_id,
@@ -46,41 +25,119 @@ def insert_working_area_info(cursor, worker_id: int, data):
     )
 
 
-## Helper function to get workers and (working area informations)
-def get_working_area_info(cursor, current_user):
-    get_query = """
-        SELECT wai.* FROM working_area_info AS wai 
-        JOIN worker AS w ON wai.worker_id = w.id
-        JOIN profile AS p ON w.profile_id = p.id
-        WHERE p.user_id = %s 
-    """
-    cursor.execute(get_query, (current_user["id"],))
-    return cursor.fetchall()
+## Helper function to get the working area informations of a worker
+async def get_working_area_info(cursor, worker_id: int):
+    await cursor.execute("SELECT * FROM working_area_info WHERE worker_id = %s", (worker_id,))
+    return await cursor.fetchall()
 
 
-## Helper function to check worker and (working area information)
-def check_worker_info(cursor, current_user, data):
-    get_worker_info_query = """
-        SELECT wai.id, wai.worker_id FROM working_area_info as wai
-        JOIN worker as w ON wai.worker_id = w.id
-        JOIN profile as p ON w.profile_id = p.id
-        WHERE p.user_id = %s AND wai.id = %s
-    """
-    
-    cursor.execute(get_worker_info_query, (current_user["id"], data.id))
-    return cursor.fetchone()
- 
-
-## Helper function to delete working area information
-def delete_working_area_info(cursor, area_info_id: int):
-    cursor.execute("DELETE FROM working_area_info WHERE id = %s", (area_info_id,))
+## Helper function to check that a working area information belongs to the worker
+async def check_worker_info(cursor, worker_id: int, data):
+    await cursor.execute(
+        "SELECT id, worker_id FROM working_area_info WHERE id = %s AND worker_id = %s",
+        (data.id, worker_id),
+    )
+    return await cursor.fetchone()
+
+
+## Helper function to delete working area information of the worker
+async def delete_working_area_info(cursor, area_info_id: int, worker_id: int):
+    await cursor.execute(
+        "DELETE FROM working_area_info WHERE id = %s AND worker_id = %s", (area_info_id, worker_id)
+    )
     return cursor.rowcount  # Returns the number of affected rows
 
 
+## Helper function to lock the given working area informations of the worker, returns the ids found
+async def lock_worker_areas(cursor, worker_id: int, area_info_ids):
+    await cursor.execute(
+        f"""
+        SELECT id FROM working_area_info
+        WHERE worker_id = %s AND id IN ({', '.join(['%s'] * len(area_info_ids))})
+        FOR UPDATE
+        """,
+        (worker_id, *area_info_ids),
+    )
+    return {row[0] for row in await cursor.fetchall()}
+
+
+## Helper function to apply a batch of working area informations writes (one statement per kind).
+## Runs inside the caller's transaction, returns the per-item results.
+async def apply_working_area_batch(cursor, worker_id: int, batch):
+    results = {"created": [], "updated": [], "deleted": []}
+
+    # Updates and deletes only touch the worker's own rows, locked until the commit
+    ids = [item.id for item in batch.update] + list(batch.delete)
+    owned_ids = await lock_worker_areas(cursor, worker_id, ids) if ids else set()
+
+    delete_ids = [area_info_id for area_info_id in batch.delete if area_info_id in owned_ids]
+    if delete_ids:
+        await cursor.execute(
+            f"DELETE FROM working_area_info WHERE worker_id = %s AND id IN ({', '.join(['%s'] * len(delete_ids))})",
+            (worker_id, *delete_ids),
+        )
+    for area_info_id in batch.delete:
+        results["deleted"].append(
+            {"id": area_info_id, "status": "deleted" if area_info_id in owned_ids else "not_found"}
+        )
+
+    # Same rules as the PATCH endpoint: empty or "string" fields are left unchanged.
+    # The rows exist and are locked, so the upsert only ever takes the update branch
+    # and executemany sends all of them as one multi-row statement.
+    def unchanged_if_empty(value):
+        return value if value and value != "string" else None
+
+    update_rows = [
+        (
+            item.id,
+            worker_id,
+            unchanged_if_empty(item.name),
+            unchanged_if_empty(item.rate_type),
+            unchanged_if_empty(item.rate),
+            unchanged_if_empty(item.description),
+        )
+        for item in batch.update
+        if item.id in owned_ids
+    ]
+    if update_rows:
+        await cursor.executemany(
+            """
+            INSERT INTO working_area_info (id, worker_id, name, rate_type, rate, description)
+            VALUES (%s, %s, %s, %s, %s, %s) AS new
+            ON DUPLICATE KEY UPDATE
+                name = COALESCE(new.name, working_area_info.name),
+                rate_type = COALESCE(new.rate_type, working_area_info.rate_type),
+                rate = COALESCE(new.rate, working_area_info.rate),
+                description = COALESCE(new.description, working_area_info.description)
+            """,
+            update_rows,
+        )
+    for item in batch.update:
+        results["updated"].append(
+            {"id": item.id, "status": "updated" if item.id in owned_ids else "not_found"}
+        )
+
+    if batch.create:
+        await cursor.executemany(
+            """
+            INSERT INTO working_area_info (worker_id, name, rate_type, rate, description)
+            VALUES (%s, %s, %s, %s, %s)
+            """,
+            [(worker_id, item.name, item.rate_type, item.rate, item.description) for item in batch.create],
+        )
+
+        # One multi-row insert gets consecutive ids starting at lastrowid
+        first_id = cursor.lastrowid
+        for index in range(len(batch.create)):
+            results["created"].append({"index": index, "id": first_id + index, "status": "created"})
+
+    return results
+
+
 ## Helper function to create worker rating (given by user)
-def create_worker_rating(cursor, user_id: int, worker_id: int, stars: int):
+async def create_worker_rating(cursor, user_id: int, worker_id: int, stars: int):
     try:
-        cursor.execute(
+        await cursor.execute(
             "INSERT INTO ratings (user_id, worker_id, stars) VALUES (%s, %s, %s)",
             (user_id, worker_id, stars),
         )
@@ -112,23 +169,23 @@ def create_worker_rating(cursor, user_id: int, worker_id: int, stars: int):
             
 
 ## Helper function to fetch worker by ID
-def fetch_worker_by_id(cursor, worker_id: int):
-    cursor.execute("SELECT id FROM worker WHERE id = %s", (worker_id,))
-    return cursor.fetchone()  # fetch one worker if exists
+async def fetch_worker_by_id(cursor, worker_id: int):
+    await cursor.execute("SELECT id FROM worker WHERE id = %s", (worker_id,))
+    return await cursor.fetchone()  # fetch one worker if exists
 
 
 ## Helper function to check for an existing "Pending" request
-def get_existing_request(cursor, user_id: int, worker_id: int):
-    cursor.execute(
+async def get_existing_request(cursor, user_id: int, worker_id: int):
+    await cursor.execute(
         "SELECT status FROM worker_requests WHERE user_id = %s AND worker_id = %s LIMIT 1",
         (user_id, worker_id),
     )
-    return cursor.fetchone()  # fetch one row with status if exists
+    return await cursor.fetchone()  # fetch one row with status if exists
 
 
 ## Helper function to insert a new request into the table
-def insert_new_worker_request(cursor, user_id: int, worker_id: int):
-    cursor.execute(
+async def insert_new_worker_request(cursor, user_id: int, worker_id: int):
+    await cursor.execute(
         "INSERT INTO worker_requests (user_id, worker_id, status) VALUES (%s, %s, %s)",
         (user_id, worker_id, "Pending"),
     )
@@ -136,15 +193,86 @@ def insert_new_worker_request(cursor, user_id: int, worker_id: int):
 
 
 ## Helper function to get worker request status
-def get_worker_request_status(cursor, request_id):
-    cursor.execute(
-        "SELECT status FROM worker_requests WHERE id = %s", (request_id,)
+async def get_worker_request_status(cursor, request_id):
+    await cursor.execute(
+        "SELECT status, worker_id FROM worker_requests WHERE id = %s", (request_id,)
     )
-    return cursor.fetchall()
+    return await cursor.fetchall()
 
 ## Helper function to update worker_requests status
-def update_worker_request_status(cursor, request_id, response):
-    cursor.execute(
+async def update_worker_request_status(cursor, request_id, response):
+    await cursor.execute(
             "UPDATE worker_requests SET status = %s WHERE id = %s",
             (response, request_id),
         )
+
+
+## Helper function to get the stars given by a user to a worker (locks the row for the update)
+async def get_user_rating(cursor, user_id: int, worker_id: int):
+    await cursor.execute(
+        "SELECT stars FROM ratings WHERE user_id = %s AND worker_id = %s FOR UPDATE",
+        (user_id, worker_id),
+    )
+    return await cursor.fetchone()
+
+
+## Helper function to apply a rating change to the worker rating summary
+async def update_rating_summary(cursor, worker_id: int, new_stars: int, old_stars: int | None = None):
+    histogram = [0, 0, 0, 0, 0]
+    histogram[new_stars - 1] += 1
+    if old_stars is not None:
+        histogram[old_stars - 1] -= 1
+
+    count_delta = 0 if old_stars is not None else 1
+    sum_delta = new_stars - (old_stars or 0)
+
+    await cursor.execute(
+        """
+        INSERT INTO rating_summary (worker_id, rating_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s) AS delta
+        ON DUPLICATE KEY UPDATE
+            rating_count = rating_summary.rating_count + delta.rating_count,
+            rating_sum = rating_summary.rating_sum + delta.rating_sum,
+            stars_1 = rating_summary.stars_1 + delta.stars_1,
+            stars_2 = rating_summary.stars_2 + delta.stars_2,
+            stars_3 = rating_summary.stars_3 + delta.stars_3,
+            stars_4 = rating_summary.stars_4 + delta.stars_4,
+            stars_5 = rating_summary.stars_5 + delta.stars_5
+        """,
+        (worker_id, count_delta, sum_delta, *histogram),
+    )
+
+
+## Helper function to fetch the rating summary of a worker
+async def get_rating_summary(cursor, worker_id: int):
+    await cursor.execute(
+        "SELECT * FROM rating_summary WHERE worker_id = %s", (worker_id,)
+    )
+    return await cursor.fetchone()
+
+
+## Helper function to rebuild rating summaries from the ratings table (all workers or one)
+async def rebuild_rating_summary(cursor, worker_id: int | None = None):
+    where = "WHERE worker_id = %s" if worker_id is not None else ""
+    params = (worker_id,) if worker_id is not None else ()
+
+    await cursor.execute(f"DELETE FROM rating_summary {where}", params)
+    await cursor.execute(
+        f"""
+        INSERT INTO rating_summary (worker_id, rating_count, rating_sum, stars_1, stars_2, stars_3, stars_4, stars_5)
+        SELECT
+            worker_id,
+            COUNT(*),
+            SUM(stars),
+            SUM(stars = 1),
+            SUM(stars = 2),
+            SUM(stars = 3),
+            SUM(stars = 4),
+            SUM(stars = 5)
+        FROM ratings
+        {where}
+        GROUP BY worker_id
+        """,
+        params,
+    )
+    return cursor.rowcount
@@ -1,76 +1,85 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 import mysql.connector
-from mysql.connector import connection
-from database import get_db
+from database import get_db, PooledConnection
+from timing import TimedRoute
 from .schemas import (
     WorkingAreaInfo,
     WorkingAreaInfoUpdate,
+    WorkingAreaInfoBatch,
     WorkerRating,
     WorkerRatingUpdate,
 )
 from users.schemas import UserResponse
 from auth.views import get_current_user
-from notification import worker_notifications, user_notifications
+from auth.identity import get_token_identity
+from auth.services import bump_claims_version
+from search_workers.hooks import worker_changed, rating_changed
+from notification import publish_notification
 from .services import (
-    get_user_profile,
-    is_worker_exists,
     create_worker_profile,
-    get_worker_id_by_user_id,
     insert_working_area_info,
     get_working_area_info,
     check_worker_info,
-    delete_working_area_info,
+    delete_working_area_info as remove_working_area_info,
+    apply_working_area_batch,
     create_worker_rating,
     fetch_worker_by_id,
     get_existing_request,
     insert_new_worker_request,
     update_worker_request_status,
     get_worker_request_status,
+    get_user_rating,
+    update_rating_summary,
+    get_rating_summary,
 )
 
 
-worker_router = APIRouter()
+worker_router = APIRouter(route_class=TimedRoute)
 
 worker_tags = ["Worker"]
 worker_area_info_tags = ["Worker area information"]
 
+## Maximum number of operations in one working area info batch
+MAX_BATCH_ITEMS = 100
+
 
 ## POST Endpoint: Complete worker profile.
 @worker_router.post("/worker/", status_code=status.HTTP_201_CREATED, tags=worker_tags)
 async def create_worker(
-    db: connection.MySQLConnection = Depends(get_db),
-    current_user: UserResponse = Depends(get_current_user),
+    db: PooledConnection = Depends(get_db),
+    identity: dict = Depends(get_token_identity),
 ):
-    cursor = db.cursor(dictionary=True)
+    cursor = await db.cursor(dictionary=True)
 
-    profile_result = get_user_profile(cursor, current_user["id"])
-    if not profile_result:
+    if identity["profile_id"] is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User profile not found"
         )
 
-    if is_worker_exists(cursor, profile_result["id"]):
+    if identity["worker_id"] is not None:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Worker profile already exists"
         )
 
-    if profile_result["role"] != "Worker":
+    if identity["role"] != "Worker":
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User role must be 'Worker' to create a worker profile",
         )
 
     try:
-        create_worker_profile(cursor, profile_result["id"])
-        db.commit()
+        await create_worker_profile(cursor, identity["profile_id"])
+        await bump_claims_version(cursor, identity["id"])
+        await db.commit()
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create worker profile: {str(e)}",
         )
 
+    await worker_changed(db, identity["id"])
     return {"detail": "Worker created successfully"}
 
 
@@ -82,28 +91,28 @@ async def create_worker(
 )
 async def create_working_area_info(
     data: WorkingAreaInfo,
-    db: connection.MySQLConnection = Depends(get_db),
-    current_user: UserResponse = Depends(get_current_user),
+    db: PooledConnection = Depends(get_db),
+    identity: dict = Depends(get_token_identity),
 ):
-    cursor = db.cursor(dictionary=True)
+    cursor = await db.cursor(dictionary=True)
 
-    worker_result = get_worker_id_by_user_id(cursor, current_user["id"])
-    if not worker_result:
+    if identity["worker_id"] is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Worker not found, please create",
         )
 
     try:
-        insert_working_area_info(cursor, worker_result["id"], data)
-        db.commit()
+        await insert_working_area_info(cursor, identity["worker_id"], data)
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create working area info: {str(e)}",
         )
 
+    await worker_changed(db, identity["id"])
     return {"detail": "Working area information created successfully"}
 
 
@@ -112,12 +121,14 @@ async def create_working_area_info(
     "/working_area_info/", status_code=status.HTTP_200_OK, tags=worker_area_info_tags
 )
 async def view_working_area_info(
-    db: connection.MySQLConnection = Depends(get_db),
-    current_user: UserResponse = Depends(get_current_user),
+    db: PooledConnection = Depends(get_db),
+    identity: dict = Depends(get_token_identity),
 ):
-    cursor = db.cursor(dictionary=True)
+    cursor = await db.cursor(dictionary=True)
 
-    working_area_info_result = get_working_area_info(cursor, current_user)
+    working_area_info_result = None
+    if identity["worker_id"] is not None:
+        working_area_info_result = await get_working_area_info(cursor, identity["worker_id"])
 
     if working_area_info_result:
         return working_area_info_result
@@ -133,16 +144,18 @@ async def view_working_area_info(
 )
 async def update_working_area_info(
     data: WorkingAreaInfoUpdate,
-    db: connection.MySQLConnection = Depends(get_db),
-    current_user: UserResponse = Depends(get_current_user),
+    db: PooledConnection = Depends(get_db),
+    identity: dict = Depends(get_token_identity),
 ):
-    cursor = db.cursor()
+    cursor = await db.cursor()
 
     # Check if the worker and their working area info exist
-    worker_info_result = check_worker_info(cursor, current_user, data)  # Fetch only one record
+    worker_info_result = None
+    if identity["worker_id"] is not None:
+        worker_info_result = await check_worker_info(cursor, identity["worker_id"], data)  # Fetch only one record
 
-    # Before executing the update query, make sure there are no unread results
-    cursor.fetchall()  # Consume remaining results, if any
+        # Before executing the update query, make sure there are no unread results
+        await cursor.fetchall()  # Consume remaining results, if any
 
     # If the worker's working area info exists, proceed with the update
     if worker_info_result:
@@ -189,8 +202,9 @@ async def update_working_area_info(
         )  # Append working area info id to the list of values for the query
 
         # Execute the final update query
-        cursor.execute(update_query, tuple(update_values))
-        db.commit()
+        await cursor.execute(update_query, tuple(update_values))
+        await db.commit()
+        await worker_changed(db, identity["id"])
 
         return {"detail": "Working area information updated successfully"}
     else:
@@ -207,11 +221,16 @@ async def update_working_area_info(
     tags=worker_area_info_tags,
 )
 async def delete_working_area_info(
-    id: int, db: connection.MySQLConnection = Depends(get_db)
+    id: int,
+    db: PooledConnection = Depends(get_db),
+    identity: dict = Depends(get_token_identity),
 ):
-    cursor = db.cursor()
+    cursor = await db.cursor()
 
-    affected_rows = delete_working_area_info(cursor, id)
+    # Only the worker owning the working area can delete it
+    affected_rows = 0
+    if identity["worker_id"] is not None:
+        affected_rows = await remove_working_area_info(cursor, id, identity["worker_id"])
 
     if affected_rows == 0:
         raise HTTPException(
@@ -219,17 +238,70 @@ async def delete_working_area_info(
             detail="No working area info found with the given id",
         )
 
-    db.commit()
+    await db.commit()
+    await worker_changed(db, identity["id"])
     return {"detail": "Working area info successfully deleted"}
 
 
+## POST Endpoint: Create, update and delete many working area info in one transaction.
+@worker_router.post(
+    "/working_area_info/batch",
+    status_code=status.HTTP_200_OK,
+    tags=worker_area_info_tags,
+)
+async def batch_working_area_info(
+    data: WorkingAreaInfoBatch,
+    db: PooledConnection = Depends(get_db),
+    identity: dict = Depends(get_token_identity),
+):
+    if identity["worker_id"] is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Worker not found, please create",
+        )
+
+    items = len(data.create) + len(data.update) + len(data.delete)
+    if items == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="No operations provided"
+        )
+    if items > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_ITEMS} operations per batch",
+        )
+
+    # Every id may appear once, in update or in delete
+    ids = [item.id for item in data.update] + list(data.delete)
+    if len(ids) != len(set(ids)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A working area info id appears more than once",
+        )
+
+    cursor = await db.cursor()
+
+    try:
+        results = await apply_working_area_batch(cursor, identity["worker_id"], data)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to apply working area info batch: {str(e)}",
+        )
+
+    await worker_changed(db, identity["id"])
+    return results
+
+
 ## POST Endpoint: User gives rating/stars to worker.
 @worker_router.post(
     "/worker_ratings/", status_code=status.HTTP_201_CREATED, tags=worker_tags
 )
 async def worker_ratings(
     data: WorkerRating,
-    db: connection.MySQLConnection = Depends(get_db),
+    db: PooledConnection = Depends(get_db),
     current_user: UserResponse = Depends(get_current_user),
 ):
     if not current_user:
@@ -237,27 +309,30 @@ async def worker_ratings(
             status_code=status.HTTP_404_NOT_FOUND, detail="User profile not found"
         )
 
-    cursor = db.cursor()
+    cursor = await db.cursor()
 
     try:
         # Using the helper function to handle the rating insertion and exceptions
-        affected_rows = create_worker_rating(
+        affected_rows = await create_worker_rating(
             cursor, current_user["id"], data.worker_id, data.stars
         )
 
         if affected_rows > 0:
-            db.commit()
+            # Keep the rating summary in the same transaction as the rating
+            await update_rating_summary(cursor, data.worker_id, data.stars)
+            await db.commit()
+            rating_changed(data.worker_id)
             return {"detail": "Rating created successfully"}
 
         # Edge case: If no rows were affected (unlikely with successful insert), rollback.
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create rating for unknown reasons.",
         )
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create rating: {str(e)}"
@@ -271,7 +346,7 @@ async def worker_ratings(
 async def worker_ratings(
     worker_id: int,
     data: WorkerRatingUpdate,
-    db: connection.MySQLConnection = Depends(get_db),
+    db: PooledConnection = Depends(get_db),
     current_user: UserResponse = Depends(get_current_user),
 ):
     if not current_user:
@@ -279,24 +354,31 @@ async def worker_ratings(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
 
-    cursor = db.cursor()
+    cursor = await db.cursor()
 
     try:
-        cursor.execute(
-            "UPDATE ratings SET stars = %s WHERE user_id = %s AND worker_id = %s",
-            (data.stars, current_user["id"], worker_id),
-        )
+        # Lock the current rating so the summary delta is computed from its old stars
+        existing_rating = await get_user_rating(cursor, current_user["id"], worker_id)
 
-        if cursor.rowcount > 0:
-            db.commit()
-            return {"detail": "Rating updated successfully"}
-        else:
+        if not existing_rating:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"No rating found to update with the worker id {worker_id}",
             )
 
+        await cursor.execute(
+            "UPDATE ratings SET stars = %s WHERE user_id = %s AND worker_id = %s",
+            (data.stars, current_user["id"], worker_id),
+        )
+
+        # Keep the rating summary in the same transaction as the rating
+        await update_rating_summary(cursor, worker_id, data.stars, existing_rating[0])
+        await db.commit()
+        rating_changed(worker_id)
+        return {"detail": "Rating updated successfully"}
+
     except mysql.connector.DatabaseError as e:
+        await db.rollback()
         error_code = e.errno  # Error number from the exception
 
         if (
@@ -308,13 +390,36 @@ async def worker_ratings(
             )
 
 
+## GET Endpoint: Worker rating summary (average stars and histogram).
+@worker_router.get(
+    "/worker_ratings/{worker_id}", status_code=status.HTTP_200_OK, tags=worker_tags
+)
+async def view_worker_ratings(
+    worker_id: int,
+    db: PooledConnection = Depends(get_db),
+    current_user: UserResponse = Depends(get_current_user),
+):
+    cursor = await db.cursor(dictionary=True)
+
+    summary = await get_rating_summary(cursor, worker_id)
+    if not summary:
+        return {"worker_id": worker_id, "rating_count": 0, "avg_stars": 0, "histogram": [0, 0, 0, 0, 0]}
+
+    return {
+        "worker_id": worker_id,
+        "rating_count": summary["rating_count"],
+        "avg_stars": summary["rating_sum"] / summary["rating_count"] if summary["rating_count"] else 0,
+        "histogram": [summary[f"stars_{stars}"] for stars in range(1, 6)],
+    }
+
+
 ## POST Endpoint: User sends a request to the worker.
 @worker_router.post(
     "/request_worker/", status_code=status.HTTP_201_CREATED, tags=worker_tags
 )
 async def request_worker(
     worker_id: int,
-    db: connection.MySQLConnection = Depends(get_db),
+    db: PooledConnection = Depends(get_db),
     current_user: dict = Depends(get_current_user),
 ):
     # Verify if the current user exists
@@ -323,17 +428,17 @@ async def request_worker(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
 
-    cursor = db.cursor(dictionary=True)
+    cursor = await db.cursor(dictionary=True)
 
     # Check if the specified worker exists
-    worker = fetch_worker_by_id(cursor, worker_id)
+    worker = await fetch_worker_by_id(cursor, worker_id)
     if not worker:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Worker not found"
         )
 
     # Check if the user has already sent a request with "Pending" status
-    existing_request = get_existing_request(cursor, current_user["id"], worker_id)
+    existing_request = await get_existing_request(cursor, current_user["id"], worker_id)
     if existing_request and existing_request["status"] == "Pending":
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
@@ -342,20 +447,12 @@ async def request_worker(
 
     try:
         # Insert a new request and obtain the request ID
-        request_id, affected_rows = insert_new_worker_request(
+        request_id, affected_rows = await insert_new_worker_request(
             cursor, current_user["id"], worker_id
         )
 
         if affected_rows > 0:
-            db.commit()
-
-            # Notify the worker if they are connected to SSE (Server-Sent Events)
-            if worker_id in worker_notifications:
-                worker_notifications[worker_id].append(
-                    f"New request from User {current_user['id']} with Request ID {request_id}"
-                )
-
-            return {"request_id": request_id, "detail": "Request sent successfully"}
+            await db.commit()
         else:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -363,47 +460,61 @@ async def request_worker(
             )
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to insert new request: {str(e)}",
         )
 
+    # Notify the worker through SSE (Server-Sent Events), once the request is committed
+    await publish_notification(
+        "worker",
+        worker_id,
+        f"New request from User {current_user['id']} with Request ID {request_id}",
+    )
+
+    return {"request_id": request_id, "detail": "Request sent successfully"}
+
 
 ## PUT Endpoint: Worker accepts or rejects the request.
 @worker_router.put("/request_worker/", status_code=status.HTTP_200_OK, tags=worker_tags)
 async def respond_to_request(
     request_id: int,
     response: str,
-    db: connection.MySQLConnection = Depends(get_db),
-    current_user: UserResponse = Depends(get_current_user),
+    db: PooledConnection = Depends(get_db),
+    identity: dict = Depends(get_token_identity),
 ):
-    cursor = db.cursor(dictionary=True)
+    cursor = await db.cursor(dictionary=True)
 
     # Fetch the worker request id
-    worker_request = get_worker_request_status()
+    worker_request = await get_worker_request_status(cursor, request_id)
 
     if not worker_request:
         raise HTTPException(status_code=404, detail="Request not found")
 
+    # Only the requested worker can respond
+    if worker_request[0]["worker_id"] != identity["worker_id"]:
+        raise HTTPException(status_code=403, detail="Request was sent to another worker")
+
     if worker_request[0]["status"] != "Pending":
         raise HTTPException(status_code=400, detail="Request already responded to")
 
     # Update the worker_requests table with status
     try:
-        update_worker_request_status(cursor, request_id, response)
-        db.commit()
-
-        # Notify the worker if they are connected to SSE
-        if request_id in user_notifications:
-            user_notifications[request_id].append(
-                f"Your request response is {response}, with request ID {request_id}"
-            )
+        await update_worker_request_status(cursor, request_id, response)
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update worker request status: {str(e)}",
         )
 
+    # Notify the user through SSE, once the response is committed
+    await publish_notification(
+        "user",
+        request_id,
+        f"Your request response is {response}, with request ID {request_id}",
+    )
+
     return {"message": f"Request {response}"}